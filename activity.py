@@ -0,0 +1,138 @@
+import discord
+from discord.ext import commands, tasks
+import logging
+import utils
+import clock
+from spamfilter import SpamFilter
+
+class ActivityTracker(commands.Cog):
+    """Tracks activity requirements (messages, voice time, approved posts)"""
+
+    def __init__(self, bot):
+        self.bot = bot
+        # (guild_id, user_id) -> time the current voice session started
+        self.voice_sessions = {}
+        # guild_id -> (spam_filter settings, filter built from them), so a user's messages
+        # in one guild never count against them in another
+        self.spam_filters = {}
+        # Guild states with counter changes waiting to be saved
+        self.dirty = set()
+        self.flush_counters.start()
+
+    def cog_unload(self):
+        self.flush_counters.cancel()
+
+    @tasks.loop(minutes=5)
+    async def flush_counters(self):
+        """Persist counter changes in batches instead of on every message"""
+        dirty, self.dirty = self.dirty, set()
+        for state in dirty:
+            state.save_user_data()
+
+    def spam_filter(self, state) -> SpamFilter:
+        """The guild's spam filter, rebuilt when its config snapshot changes the settings"""
+        settings = state.CONFIG.get("spam_filter", {})
+        current = self.spam_filters.get(state.guild_id)
+        if current is None or current[0] != settings:
+            current = self.spam_filters[state.guild_id] = (settings, SpamFilter.from_config(state.CONFIG))
+        return current[1]
+
+    async def increment(self, member: discord.Member, counter: str, amount: int = 1) -> None:
+        """Bump a single counter for a tracked user and evaluate only that user"""
+        state = self.bot.state_for(member.guild)
+        data = utils.get_tracked_phase_data(state, str(member.id)) if state else None
+        if data is None:
+            return
+
+        activity = data.setdefault("activity", {})
+        previous = activity.get(counter, 0)
+        activity[counter] = previous + amount
+        # Counters are only saved every few minutes; the query API still has to see them change
+        state.touch()
+        self.dirty.add(state)
+
+        threshold = utils.get_requirement_threshold(state.CONFIG, counter)
+        if threshold is not None and previous < threshold <= activity[counter]:
+            await utils.evaluate_requirements(state, member)
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        """Count messages sent in general chat"""
+        state = self.bot.state_for(message.guild)
+        if message.author.bot or state is None:
+            return
+        if message.channel.id != state.CONFIG.get("general_channel"):
+            return
+        data = utils.get_tracked_phase_data(state, str(message.author.id))
+        if data is None:
+            return
+        if not data.get("messages_backfilled") and "messages_counted_since" not in data:
+            # A later backfill only counts history from before this message
+            data["messages_counted_since"] = message.created_at.replace(tzinfo=None).isoformat()
+            self.dirty.add(state)
+        if not self.spam_filter(state).allow(str(message.author.id), message.content, message.created_at.timestamp()):
+            return
+
+        await self.increment(message.author, "messages")
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+        """Accumulate time spent in voice calls"""
+        if member.bot:
+            return
+
+        afk_channel = member.guild.afk_channel
+        was_in_call = before.channel is not None and before.channel != afk_channel
+        is_in_call = after.channel is not None and after.channel != afk_channel
+        session = (member.guild.id, str(member.id))
+
+        if is_in_call and not was_in_call:
+            self.voice_sessions[session] = clock.utcnow()
+        elif was_in_call and not is_in_call:
+            started = self.voice_sessions.pop(session, None)
+            if started:
+                seconds = int((clock.utcnow() - started).total_seconds())
+                await self.increment(member, "voice_seconds", seconds)
+
+    @commands.Cog.listener()
+    async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
+        """Count posts approved by a moderator in the approval channel"""
+        state = self.bot.state_for(payload.guild_id)
+        if state is None or payload.channel_id != state.CONFIG.get("approval_channel"):
+            return
+        if str(payload.emoji) != state.CONFIG.get("approval_emoji", "✅"):
+            return
+
+        # Only moderators can approve posts
+        approver = payload.member
+        if approver is None or approver.bot or not approver.guild_permissions.manage_messages:
+            return
+
+        channel = self.bot.get_channel(payload.channel_id)
+        if channel is None:
+            return
+
+        try:
+            message = await channel.fetch_message(payload.message_id)
+        except discord.HTTPException:
+            return
+
+        author = message.author
+        if not isinstance(author, discord.Member) or author.bot:
+            return
+
+        data = utils.get_tracked_phase_data(state, str(author.id))
+        if data is None:
+            return
+
+        # A post counts once no matter how many moderators approve it
+        approved_posts = data.setdefault("approved_posts", [])
+        if message.id in approved_posts:
+            return
+        approved_posts.append(message.id)
+
+        logging.info("Post %s by %s approved by %s", message.id, author.id, approver.id, extra={"user_id": author.id, "event": "post_approved"})
+        await self.increment(author, "approvals")
+
+async def setup(bot):
+    await bot.add_cog(ActivityTracker(bot))
@@ -0,0 +1,133 @@
+import discord
+import asyncio
+import datetime
+import json
+import logging
+import os
+from typing import Optional
+import utils
+import clock
+import phases
+from spamfilter import SpamFilter
+
+CHECKPOINT_FILE = "/data/backfill_checkpoint.json"
+
+# discord.py fetches history in pages of 100 messages
+PAGE_SIZE = 100
+
+def load_checkpoint(path: str = CHECKPOINT_FILE) -> Optional[dict]:
+    """Load an interrupted backfill job, if any"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.error("Error loading backfill checkpoint: %s", e, extra={"event": "backfill"})
+        return None
+
+def save_checkpoint(checkpoint: dict, path: str = CHECKPOINT_FILE) -> None:
+    """Atomically persist the backfill position and partial counts"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_file, path)
+
+def clear_checkpoint(path: str = CHECKPOINT_FILE) -> None:
+    """Remove the checkpoint once a backfill has been applied"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def new_checkpoint(bot, channel_id: int) -> dict:
+    """Snapshot the activity phase users that still need their history counted"""
+    windows = {}
+    ends = {}
+    for user_id, data in bot.user_data.items():
+        if data.get("messages_backfilled") or utils.get_tracked_phase_data(bot, user_id) is None:
+            continue
+        phase = phases.ENGINE.live(data)
+        windows[user_id] = (phase.deadline(data) - phase.duration).isoformat()
+        # on_message has been counting this user since then, so history stops there
+        if "messages_counted_since" in data:
+            ends[user_id] = data["messages_counted_since"]
+
+    return {
+        "channel_id": channel_id,
+        # Messages after this point are already counted live by on_message
+        "started_at": clock.utcnow().isoformat(),
+        "windows": windows,
+        "ends": ends,
+        "last_message_id": None,
+        "scanned": 0,
+        "counts": {}
+    }
+
+def _as_utc(value: str) -> datetime.datetime:
+    """Stored timestamps are naive UTC, message timestamps are aware"""
+    return datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc)
+
+async def run_backfill(bot, channel: discord.TextChannel) -> dict:
+    """Count historical messages for every tracked user in a single pass over the channel"""
+    path = bot.checkpoint_file
+    checkpoint = load_checkpoint(path)
+    if checkpoint is None or checkpoint["channel_id"] != channel.id:
+        checkpoint = new_checkpoint(bot, channel.id)
+        save_checkpoint(checkpoint, path)
+    else:
+        logging.info("Resuming backfill after message %s", checkpoint['last_message_id'], extra={"event": "backfill"})
+
+    windows = {user_id: _as_utc(start) for user_id, start in checkpoint["windows"].items()}
+    ends = {user_id: _as_utc(end) for user_id, end in checkpoint.get("ends", {}).items()}
+    counts = checkpoint["counts"]
+    page_delay = bot.CONFIG.get("backfill", {}).get("page_delay", 1.0)
+    spam_filter = SpamFilter.from_config(bot.CONFIG)
+
+    if windows:
+        if checkpoint["last_message_id"]:
+            after = discord.Object(id=checkpoint["last_message_id"])
+        else:
+            after = min(windows.values())
+        before = _as_utc(checkpoint["started_at"])
+
+        scanned = 0
+        async for message in channel.history(limit=None, after=after, before=before, oldest_first=True):
+            user_id = str(message.author.id)
+            window_start = windows.get(user_id)
+            if (window_start is not None and window_start <= message.created_at < ends.get(user_id, before)
+                    and spam_filter.allow(user_id, message.content, message.created_at.timestamp())):
+                counts[user_id] = counts.get(user_id, 0) + 1
+
+            scanned += 1
+            if scanned % PAGE_SIZE == 0:
+                checkpoint["last_message_id"] = message.id
+                checkpoint["scanned"] += PAGE_SIZE
+                save_checkpoint(checkpoint, path)
+                # Leave headroom on the history endpoint for the rest of the bot
+                await asyncio.sleep(page_delay)
+
+        checkpoint["scanned"] += scanned % PAGE_SIZE
+
+    # Apply all counts at once so an interrupted job never double counts
+    guild = channel.guild
+    for user_id in windows:
+        data = bot.user_data.get(user_id)
+        if data is None:
+            continue
+        activity = data.setdefault("activity", {})
+        activity["messages"] = activity.get("messages", 0) + counts.get(user_id, 0)
+        data["messages_backfilled"] = True
+        data.pop("messages_counted_since", None)
+
+    bot.save_user_data()
+    clear_checkpoint(path)
+
+    for user_id in counts:
+        member = guild.get_member(int(user_id))
+        if member:
+            await utils.evaluate_requirements(bot, member)
+
+    logging.info("Backfill complete: scanned %s messages for %s users", checkpoint['scanned'], len(windows), extra={"event": "backfill"})
+    return {"users": len(windows), "scanned": checkpoint["scanned"], "counted": sum(counts.values())}
@@ -0,0 +1,5 @@
+"""Synthetic large-guild benchmarks for the TimeBomb bot
+
+Run with ``python -m benchmarks run`` and compare two result files with
+``python -m benchmarks compare old.json new.json``.
+"""
@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+DEFAULT_SIZES = (1000, 10000, 100000)
+
+# Number of users check_and_send_warnings is timed on; it saves the whole
+# data file on every call, so a full pass is already covered by check_timers
+WARNING_SAMPLE = 200
+
+def _cases():
+    """Benchmark name -> (prepare, run); prepare does untimed setup, run is what gets measured"""
+    import utils
+    from commands import AdminCommands
+    from benchmarks.fakes import FakeInteraction
+
+    def command(name):
+        async def run(bot, admin):
+            cog = AdminCommands(bot)
+            interaction = FakeInteraction(bot.guild, admin)
+            await getattr(cog, name).callback(cog, interaction)
+        return None, run
+
+    async def check_timers(bot, admin):
+        await bot.check_timers()
+
+    async def check_and_send_warnings(bot, admin):
+        for user_id, data in list(bot.state.user_data.items())[:WARNING_SAMPLE]:
+            await utils.check_and_send_warnings(bot.state, user_id, data)
+
+    def prepare_load(bot):
+        bot.state.save_user_data()
+        bot.state.user_data = {}
+
+    async def load_user_data(bot, admin):
+        bot.state.load_user_data()
+
+    async def save_user_data(bot, admin):
+        bot.state.save_user_data()
+
+    return {
+        "check_timers": (None, check_timers),
+        "check_and_send_warnings": (None, check_and_send_warnings),
+        "alltimer": command("alltimer"),
+        "synctimer": command("synctimer"),
+        "resetserver": command("resetserver"),
+        "getdata": command("getdata"),
+        "load_user_data": (prepare_load, load_user_data),
+        "save_user_data": (None, save_user_data),
+    }
+
+def _max_rss_kb() -> int:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+async def _measure(case: str, size: int, seed: int, trace: bool) -> dict:
+    from benchmarks.guilds import BenchBot, build_guild, load_config
+
+    prepare, run = _cases()[case]
+    config = load_config()
+    with tempfile.TemporaryDirectory() as workdir:
+        guild, user_data, admin = build_guild(config, size, seed)
+        bot = BenchBot(config, guild, workdir)
+        bot.state.user_data = user_data
+        if prepare:
+            prepare(bot)
+        gc.collect()
+
+        rss_before = _max_rss_kb()
+        if trace:
+            tracemalloc.start()
+        started = time.perf_counter()
+        await run(bot, admin)
+        wall = time.perf_counter() - started
+
+        result = {"wall_seconds": wall, "rss_setup_kb": rss_before, "peak_rss_kb": _max_rss_kb()}
+        if trace:
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result.update({"alloc_peak_bytes": peak, "alloc_retained_bytes": current})
+        result["dms_sent"] = sum(member.dm_channel.sent for member in guild.members)
+        result["role_edits"] = sum(member.role_edits for member in guild.members)
+        return result
+
+def worker(args) -> None:
+    """Run one case in this process and print its measurements as JSON"""
+    logging.basicConfig(level=args.log_level)
+    result = asyncio.run(_measure(args.case, args.size, args.seed, trace=False))
+    # tracemalloc slows everything down, so allocations come from a second, untimed run
+    traced = asyncio.run(_measure(args.case, args.size, args.seed, trace=True))
+    result["alloc_peak_bytes"] = traced["alloc_peak_bytes"]
+    result["alloc_retained_bytes"] = traced["alloc_retained_bytes"]
+    print(json.dumps(result))
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except Exception:
+        return "unknown"
+
+def run(args) -> None:
+    """Run every case at every size, each in a fresh process so peak RSS is per case"""
+    cases = args.cases or list(_cases())
+    commit = _git_commit()
+    results = []
+
+    for size in args.sizes:
+        for case in cases:
+            command = [sys.executable, "-m", "benchmarks", "worker",
+                       "--case", case, "--size", str(size), "--seed", str(args.seed)]
+            entry = {"case": case, "size": size}
+            try:
+                output = subprocess.run(command, capture_output=True, text=True, timeout=args.timeout, check=True)
+                entry.update(json.loads(output.stdout.strip().splitlines()[-1]))
+                entry["status"] = "ok"
+                print(f"{case:>24} {size:>7}  {entry['wall_seconds']:9.3f}s  "
+                      f"alloc peak {entry['alloc_peak_bytes'] / 2 ** 20:8.1f} MiB  rss {entry['peak_rss_kb'] / 1024:8.1f} MiB")
+            except subprocess.TimeoutExpired:
+                entry["status"] = "timeout"
+                print(f"{case:>24} {size:>7}  timed out after {args.timeout}s")
+            except subprocess.CalledProcessError as e:
+                entry["status"] = "error"
+                entry["error"] = e.stderr.strip().splitlines()[-1] if e.stderr.strip() else str(e)
+                print(f"{case:>24} {size:>7}  failed: {entry['error']}")
+            results.append(entry)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    output_file = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}_{commit}.json"
+    )
+    with open(output_file, 'w') as f:
+        json.dump({
+            "commit": commit,
+            "created_at": datetime.datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "results": results
+        }, f, indent=4)
+    print(f"Results written to {output_file}")
+
+def compare(args) -> None:
+    """Print the wall time and allocation ratio of every case present in both files"""
+    with open(args.baseline) as f:
+        baseline = {(r["case"], r["size"]): r for r in json.load(f)["results"]}
+    with open(args.candidate) as f:
+        candidate = json.load(f)["results"]
+
+    print(f"{'case':>24} {'size':>7} {'baseline':>10} {'candidate':>10} {'time':>7} {'alloc':>7}")
+    for entry in candidate:
+        before = baseline.get((entry["case"], entry["size"]))
+        if not before or before.get("status") != "ok" or entry.get("status") != "ok":
+            status = entry.get("status") if before else "new"
+            print(f"{entry['case']:>24} {entry['size']:>7} {'':>10} {'':>10} {status:>7}")
+            continue
+        time_ratio = entry["wall_seconds"] / before["wall_seconds"] if before["wall_seconds"] else float("inf")
+        alloc_ratio = entry["alloc_peak_bytes"] / before["alloc_peak_bytes"] if before["alloc_peak_bytes"] else float("inf")
+        print(f"{entry['case']:>24} {entry['size']:>7} {before['wall_seconds']:>9.3f}s "
+              f"{entry['wall_seconds']:>9.3f}s {time_ratio:>6.2f}x {alloc_ratio:>6.2f}x")
+
+def e2e(args) -> None:
+    """Drive the real bot through a local mock of Discord's API and gateway"""
+    from benchmarks.e2e import run_scenario
+
+    logging.basicConfig(level=args.log_level)
+    report = asyncio.run(run_scenario(
+        members=args.members, joins=args.joins, join_rate=args.join_rate,
+        role_updates=args.role_updates, role_rate=args.role_rate,
+        rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+        drain_timeout=args.drain_timeout, seed=args.seed, record=args.record
+    ))
+    report["commit"] = _git_commit()
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+def simulate(args) -> None:
+    """Fast-forward a cohort through the whole TimeBomb lifecycle on a simulated clock"""
+    from benchmarks.simulate import run_simulation
+
+    logging.basicConfig(level=args.log_level)
+    report = asyncio.run(run_simulation(
+        members=args.members, join_days=args.join_days, tick_hours=args.tick_hours,
+        first_success=args.first_success, second_success=args.second_success,
+        release_rate=args.release_rate, max_days=args.max_days, persist=args.persist, seed=args.seed
+    ))
+    report["commit"] = _git_commit()
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+def replay(args) -> None:
+    """Feed a recorded event stream back into the bot's handlers against a fake guild"""
+    from benchmarks.replay import run_replay
+
+    logging.basicConfig(level=args.log_level)
+    report = asyncio.run(run_replay(args.recording, speed=args.speed, tick_hours=args.tick_hours, persist=args.persist))
+    report["commit"] = _git_commit()
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+def conformance(args) -> None:
+    """Check a store backend behaves the way the bot expects of every store"""
+    from benchmarks.conformance import run_conformance
+
+    report = run_conformance(args.backend, redis_url=args.redis_url)
+    print(json.dumps(report, indent=4))
+    if report["failed"]:
+        sys.exit(1)
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="run the benchmark suite")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    run_parser.add_argument("--cases", nargs="+", help="subset of cases to run")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--timeout", type=float, default=600, help="per-case timeout in seconds")
+    run_parser.add_argument("--output", help="where to write the results JSON")
+    run_parser.set_defaults(func=run)
+
+    worker_parser = subparsers.add_parser("worker", help="run a single case (used by run)")
+    worker_parser.add_argument("--case", required=True)
+    worker_parser.add_argument("--size", type=int, required=True)
+    worker_parser.add_argument("--seed", type=int, default=0)
+    worker_parser.add_argument("--log-level", default="WARNING")
+    worker_parser.set_defaults(func=worker)
+
+    e2e_parser = subparsers.add_parser("e2e", help="end-to-end load test against a mock Discord")
+    e2e_parser.add_argument("--members", type=int, default=1000, help="members already in the guild")
+    e2e_parser.add_argument("--joins", type=int, default=200, help="size of the member join storm")
+    e2e_parser.add_argument("--join-rate", type=float, default=0.0, help="joins per second, 0 for all at once")
+    e2e_parser.add_argument("--role-updates", type=int, default=200, help="first_success roles handed out")
+    e2e_parser.add_argument("--role-rate", type=float, default=0.0, help="role updates per second, 0 for all at once")
+    e2e_parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    e2e_parser.add_argument("--retry-after", type=float, default=0.25, help="retry_after sent with injected 429s")
+    e2e_parser.add_argument("--drain-timeout", type=float, default=120.0)
+    e2e_parser.add_argument("--seed", type=int, default=0)
+    e2e_parser.add_argument("--log-level", default="WARNING")
+    e2e_parser.add_argument("--output", help="where to write the report JSON")
+    e2e_parser.add_argument("--record", help="also record the handled events to this NDJSON file")
+    e2e_parser.set_defaults(func=e2e)
+
+    simulate_parser = subparsers.add_parser("simulate", help="fast-forward lifecycle simulation")
+    simulate_parser.add_argument("--members", type=int, default=5000, help="size of the joining cohort")
+    simulate_parser.add_argument("--join-days", type=float, default=3.0, help="days the joins are spread over")
+    simulate_parser.add_argument("--tick-hours", type=float, help="sweep interval, defaults to check_timers'")
+    simulate_parser.add_argument("--first-success", type=float, default=0.7, help="chance a phase 1 is completed")
+    simulate_parser.add_argument("--second-success", type=float, default=0.6, help="chance a phase 2 is completed")
+    simulate_parser.add_argument("--release-rate", type=float, default=0.5, help="chance a jailed user is released")
+    simulate_parser.add_argument("--max-days", type=float, default=120.0, help="simulated time limit")
+    simulate_parser.add_argument("--persist", action="store_true", help="write the data file on every save")
+    simulate_parser.add_argument("--seed", type=int, default=0)
+    simulate_parser.add_argument("--log-level", default="WARNING")
+    simulate_parser.add_argument("--output", help="where to write the report JSON")
+    simulate_parser.set_defaults(func=simulate)
+
+    replay_parser = subparsers.add_parser("replay", help="replay a recorded event stream")
+    replay_parser.add_argument("recording", help="NDJSON file written by the event recorder")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="multiple of the original pace, 0 for as fast as possible")
+    replay_parser.add_argument("--tick-hours", type=float, help="sweep interval, defaults to check_timers', 0 to disable")
+    replay_parser.add_argument("--persist", action="store_true", help="write the data file on every save")
+    replay_parser.add_argument("--log-level", default="WARNING")
+    replay_parser.add_argument("--output", help="where to write the report JSON")
+    replay_parser.set_defaults(func=replay)
+
+    conformance_parser = subparsers.add_parser("conformance", help="run the store conformance checks")
+    conformance_parser.add_argument("--backend", choices=["json", "sqlite", "redis"], default="json")
+    conformance_parser.add_argument("--redis-url", help="a real server to check against instead of fakeredis")
+    conformance_parser.set_defaults(func=conformance)
+
+    compare_parser = subparsers.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+import datetime
+import os
+import tempfile
+import time
+import stores
+
+GUILD = 1
+OTHER_GUILD = 2
+NOW = datetime.datetime(2025, 1, 1)
+
+def _user(hours: float, **fields) -> dict:
+    data = {"first_bomb_end": (NOW + datetime.timedelta(hours=hours)).isoformat(), "warnings_sent": {}}
+    data.update(fields)
+    return data
+
+def open_backends(name: str, workdir: str, redis_url: str = None) -> tuple:
+    """Two handles on the same store, standing in for two processes"""
+    if name == "json":
+        return stores.JsonBackend(), None
+    if name == "sqlite":
+        path = os.path.join(workdir, "timebomb.db")
+        return stores.SQLiteBackend(path), stores.SQLiteBackend(path)
+    if name == "redis":
+        if redis_url:
+            return stores.RedisBackend(redis_url, prefix="conformance"), stores.RedisBackend(redis_url, prefix="conformance")
+        import fakeredis
+        server = fakeredis.FakeServer()
+        return (
+            stores.RedisBackend(client=fakeredis.FakeRedis(server=server, decode_responses=True)),
+            stores.RedisBackend(client=fakeredis.FakeRedis(server=server, decode_responses=True)),
+        )
+    raise ValueError(f"Unknown store backend {name!r}")
+
+def _clear(backend) -> None:
+    if isinstance(backend, stores.RedisBackend):
+        for key in backend.redis.scan_iter(backend.prefix + ":*"):
+            backend.redis.delete(key)
+
+class Checks:
+    """Behaviour every store backend has to share, run against fresh partitions"""
+
+    def __init__(self, backend, peer, workdir: str):
+        self.backend = backend
+        self.peer = peer
+        self.workdir = workdir
+        self.count = 0
+
+    def partition(self, backend=None, guild_id: int = GUILD):
+        backend = backend or self.backend
+        # JSON partitions are files; every check gets its own
+        data_file = os.path.join(self.workdir, f"{guild_id}-{self.count}.json")
+        return backend.partition(guild_id, data_file)
+
+    def fresh(self) -> None:
+        self.count += 1
+        _clear(self.backend)
+        if isinstance(self.backend, stores.SQLiteBackend):
+            with self.backend.transaction() as db:
+                db.execute("DELETE FROM users")
+                db.execute("DELETE FROM leases")
+
+    def check_empty_load(self):
+        # A missing data file is how the JSON store says empty, and GuildState handles it
+        try:
+            user_data = self.partition().load()
+        except FileNotFoundError:
+            user_data = {}
+        assert user_data == {}, user_data
+
+    def check_round_trip(self):
+        user_data = {"10": _user(5), "11": _user(30, second_bomb_active=True, second_bomb_end=NOW.isoformat(), warnings_sent={"first_24h": NOW.isoformat()})}
+        self.partition().save(user_data)
+        assert self.partition().load() == user_data
+
+    def check_nested_change(self):
+        partition = self.partition()
+        user_data = {"10": _user(5)}
+        partition.save(user_data)
+        user_data["10"]["warnings_sent"]["first_12h"] = NOW.isoformat()
+        user_data["10"]["first_bomb_failed"] = True
+        partition.save(user_data)
+        assert self.partition().load() == user_data
+
+    def check_dropped_field(self):
+        partition = self.partition()
+        user_data = {"10": _user(5, second_bomb_active=True)}
+        partition.save(user_data)
+        del user_data["10"]["second_bomb_active"]
+        partition.save(user_data)
+        assert self.partition().load() == user_data
+
+    def check_delete(self):
+        partition = self.partition()
+        user_data = {"10": _user(5), "11": _user(6)}
+        partition.save(user_data)
+        del user_data["10"]
+        partition.save(user_data)
+        assert self.partition().load() == {"11": _user(6)}
+
+    def check_guild_isolation(self):
+        self.partition().save({"10": _user(5)})
+        other = self.partition(guild_id=OTHER_GUILD)
+        other.save({"20": _user(7)})
+        assert self.partition().load() == {"10": _user(5)}
+        assert self.partition(guild_id=OTHER_GUILD).load() == {"20": _user(7)}
+
+    def check_due_order(self):
+        partition = self.partition()
+        user_data = {
+            "late": _user(48),
+            "soon": _user(1),
+            "overdue": _user(-3),
+            "failed": _user(-1, first_bomb_failed=True),
+            "second": _user(-10, second_bomb_active=True, second_bomb_end=(NOW + datetime.timedelta(hours=2)).isoformat()),
+            "done": {"warnings_sent": {}},
+        }
+        partition.save(user_data)
+        due = partition.due(user_data, NOW + datetime.timedelta(hours=24))
+        assert due == ["overdue", "soon", "second"], due
+
+    def check_partial_save(self):
+        partition = self.partition()
+        user_data = {"10": _user(5), "11": _user(6)}
+        partition.save(user_data)
+        user_data["10"]["first_bomb_end"] = (NOW + datetime.timedelta(hours=30)).isoformat()
+        del user_data["11"]
+        partition.save(user_data, ["10", "11"])
+        partition.flush(user_data)
+        assert self.partition().load() == {"10": _user(30)}
+        assert partition.due(user_data, NOW + datetime.timedelta(hours=24)) == []
+
+    def check_paused_not_due(self):
+        partition = self.partition()
+        user_data = {"10": _user(-2), "11": _user(2)}
+        partition.save(user_data)
+        paused = user_data["10"]
+        del paused["first_bomb_end"]
+        paused["first_bomb_paused"] = 3600.0
+        partition.save(user_data, ["10"])
+        partition.flush(user_data)
+        assert partition.due(user_data, NOW + datetime.timedelta(hours=24)) == ["11"]
+        assert self.partition().load()["10"] == paused
+
+    def check_refresh_in_place(self):
+        mine, theirs = self.partition(), self.partition(self.peer)
+        user_data = {"10": _user(5)}
+        mine.save(user_data)
+        record = user_data["10"]
+        their_data = theirs.load()
+        their_data["10"]["first_bomb_failed"] = True
+        their_data["30"] = _user(9)
+        theirs.save(their_data)
+        applied = mine.refresh(user_data)
+        assert applied == 2, applied
+        assert record is user_data["10"] and record["first_bomb_failed"]
+        assert user_data["30"] == _user(9)
+        assert mine.refresh(user_data) == 0
+
+    def check_unsaved_local_wins(self):
+        mine, theirs = self.partition(), self.partition(self.peer)
+        user_data = {"10": _user(5)}
+        mine.save(user_data)
+        their_data = theirs.load()
+        their_data["10"]["warnings_sent"]["first_24h"] = "theirs"
+        theirs.save(their_data)
+        user_data["10"]["warnings_sent"]["first_24h"] = "mine"
+        mine.refresh(user_data)
+        assert user_data["10"]["warnings_sent"]["first_24h"] == "mine"
+
+    def check_remote_delete(self):
+        mine, theirs = self.partition(), self.partition(self.peer)
+        user_data = {"10": _user(5), "11": _user(6)}
+        mine.save(user_data)
+        their_data = theirs.load()
+        del their_data["10"]
+        theirs.save(their_data)
+        mine.refresh(user_data)
+        assert list(user_data) == ["11"], user_data
+
+    def check_compact(self):
+        mine, theirs = self.partition(), self.partition(self.peer)
+        user_data = {"10": _user(5), "11": _user(6)}
+        mine.save(user_data)
+        their_data = theirs.load()
+        del user_data["10"]
+        mine.save(user_data)
+        mine.compact()
+        # The first compaction after a delete leaves it for processes that haven't refreshed yet
+        theirs.refresh(their_data)
+        assert list(their_data) == ["11"], their_data
+        mine.compact()
+        assert self.partition().load() == {"11": _user(6)}
+
+    def check_lease(self):
+        assert self.backend.acquire_lease("conformance", "a", 0.5)
+        assert not self.peer.acquire_lease("conformance", "b", 0.5)
+        assert self.backend.acquire_lease("conformance", "a", 0.5)
+        time.sleep(0.6)
+        assert self.peer.acquire_lease("conformance", "b", 0.5)
+        self.backend.release_lease("conformance", "a")
+        assert not self.backend.acquire_lease("conformance", "a", 0.5)
+        self.peer.release_lease("conformance", "b")
+        assert self.backend.acquire_lease("conformance", "a", 0.5)
+
+    def names(self) -> list:
+        shared_only = {"check_refresh_in_place", "check_unsaved_local_wins", "check_remote_delete", "check_compact", "check_lease"}
+        names = [name for name in dir(self) if name.startswith("check_")]
+        return [name for name in names if self.peer is not None or name not in shared_only]
+
+def run_conformance(name: str, redis_url: str = None) -> dict:
+    """Run every check against one backend; the report lists the failures"""
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        backend, peer = open_backends(name, workdir, redis_url)
+        checks = Checks(backend, peer, workdir)
+        try:
+            for check in checks.names():
+                checks.fresh()
+                try:
+                    getattr(checks, check)()
+                    results[check] = "ok"
+                except Exception as e:
+                    results[check] = f"FAILED: {type(e).__name__}: {e}"
+        finally:
+            _clear(backend)
+            backend.close()
+            if peer is not None:
+                peer.close()
+    failed = [check for check, result in results.items() if result != "ok"]
+    return {"backend": name, "passed": len(results) - len(failed), "failed": failed, "checks": results}
@@ -0,0 +1,89 @@
+import asyncio
+from discord.gateway import DiscordWebSocket
+from discord.http import Route
+import os
+import tempfile
+import time
+import yarl
+from bot import TimeBombBot
+from benchmarks.guilds import bench_state, load_config, redirect_tombstones
+from benchmarks.mock_discord import API_PREFIX, MockDiscord
+
+class LoadTestBot(TimeBombBot):
+    """The real bot with config and data files redirected for an offline run"""
+
+    def __init__(self, config: dict, workdir: str):
+        super().__init__()
+        self.loadtest_config = config
+        self.workdir = workdir
+
+    def load_config(self):
+        self.CONFIG = self.loadtest_config
+
+    def build_guild_state(self, config: dict, primary: bool):
+        return bench_state(self, config, self.workdir)
+
+async def _wait_for(predicate, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if predicate():
+            return True
+        await asyncio.sleep(0.05)
+    return predicate()
+
+async def run_scenario(members: int = 1000, joins: int = 200, join_rate: float = 0.0,
+                       role_updates: int = 200, role_rate: float = 0.0,
+                       rate_limit_rate: float = 0.0, retry_after: float = 0.25,
+                       drain_timeout: float = 120.0, seed: int = 0, record: str = None) -> dict:
+    """Boot the bot against a mock Discord, inject a join storm and a role burst, and measure reactions"""
+    config = load_config()
+    config["watchdog"] = {"enabled": True, "report_minutes": 60}
+    # The load test config never came from config.json
+    config["config_reload"] = {"enabled": False}
+    if record:
+        config["recorder"] = {"enabled": True, "path": os.path.abspath(record), "flush_seconds": 1}
+    mock = MockDiscord(config["guild_id"], dict(config["roles"], starter=config["starter_role"]), [config["log_channel"]],
+                       rate_limit_rate=rate_limit_rate, retry_after=retry_after, seed=seed)
+    for _ in range(members):
+        mock.add_member([config["starter_role"]])
+
+    original_base, original_gateway = Route.BASE, DiscordWebSocket.DEFAULT_GATEWAY
+    base_url = await mock.start()
+
+    with tempfile.TemporaryDirectory() as workdir, redirect_tombstones(workdir):
+        Route.BASE = base_url + API_PREFIX
+        DiscordWebSocket.DEFAULT_GATEWAY = yarl.URL(base_url.replace("http", "ws", 1) + "/gateway")
+
+        bot = LoadTestBot(config, workdir)
+        bot_task = asyncio.create_task(bot.start("loadtest-token"))
+        try:
+            ready_task = asyncio.create_task(bot.wait_until_ready())
+            await asyncio.wait({ready_task, bot_task}, timeout=60, return_when=asyncio.FIRST_COMPLETED)
+            if bot_task.done():
+                # Surface login/connect errors instead of waiting out the timeout
+                bot_task.result()
+            if not ready_task.done():
+                ready_task.cancel()
+                raise TimeoutError("Bot did not become ready against the mock gateway")
+
+            started = time.perf_counter()
+            await mock.member_join_storm(joins, join_rate)
+            await mock.role_update_burst(config["roles"]["first_success"], role_updates, role_rate)
+            injected = time.perf_counter() - started
+
+            drained = await _wait_for(lambda: not mock.pending_events, drain_timeout)
+            report = mock.report()
+            report.update({
+                "members": members, "joins": joins, "role_updates": role_updates,
+                "rate_limit_rate": rate_limit_rate,
+                "inject_seconds": injected,
+                "wall_seconds": time.perf_counter() - started,
+                "drained": drained,
+                "loop_lag": bot.watchdog.stats() if bot.watchdog else None
+            })
+            return report
+        finally:
+            await bot.close()
+            bot_task.cancel()
+            await mock.stop()
+            Route.BASE, DiscordWebSocket.DEFAULT_GATEWAY = original_base, original_gateway
@@ -0,0 +1,134 @@
+import itertools
+
+_ids = itertools.count(10 ** 17)
+
+def next_id() -> int:
+    """Snowflake-sized ids so string keys look like production data"""
+    return next(_ids)
+
+class FakeRole:
+    def __init__(self, role_id: int, name: str):
+        self.id = role_id
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, FakeRole) and other.id == self.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+class FakeDMChannel:
+    """Counts messages instead of sending them"""
+
+    def __init__(self):
+        self.sent = 0
+
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+
+class FakeChannel(FakeDMChannel):
+    def __init__(self, channel_id: int, guild=None):
+        super().__init__()
+        self.id = channel_id
+        self.guild = guild
+        self.mention = f"<#{channel_id}>"
+
+class FakeMember:
+    def __init__(self, guild, member_id: int, roles=(), bot: bool = False):
+        self.guild = guild
+        self.id = member_id
+        self.bot = bot
+        self.roles = list(roles)
+        self.name = f"user{member_id}"
+        self.display_name = self.name
+        self.mention = f"<@{member_id}>"
+        self.dm_channel = FakeDMChannel()
+        self.role_edits = 0
+
+    async def send(self, content=None, **kwargs):
+        await self.dm_channel.send(content, **kwargs)
+
+    async def add_roles(self, *roles, reason=None):
+        self.role_edits += 1
+        for role in roles:
+            if role not in self.roles:
+                self.roles.append(role)
+
+    async def remove_roles(self, *roles, reason=None):
+        self.role_edits += 1
+        self.roles = [role for role in self.roles if role not in roles]
+
+    async def edit(self, *, roles=None, reason=None, **kwargs):
+        self.role_edits += 1
+        if roles is not None:
+            self.roles = list(roles)
+
+class FakeGuild:
+    member_class = FakeMember
+
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+        self._members = {}
+        self._roles = {}
+        self._channels = {}
+        self.afk_channel = None
+
+    @property
+    def members(self):
+        return list(self._members.values())
+
+    def add_role(self, role_id: int, name: str) -> FakeRole:
+        role = self._roles[role_id] = FakeRole(role_id, name)
+        return role
+
+    def add_member(self, roles=(), bot: bool = False, member_id: int = None) -> FakeMember:
+        member = self.member_class(self, member_id or next_id(), roles, bot)
+        self._members[member.id] = member
+        return member
+
+    def remove_member(self, member_id: int):
+        return self._members.pop(member_id, None)
+
+    def add_channel(self, channel_id: int) -> FakeChannel:
+        channel = self._channels[channel_id] = FakeChannel(channel_id, self)
+        return channel
+
+    def get_member(self, member_id: int):
+        return self._members.get(member_id)
+
+    def get_role(self, role_id: int):
+        return self._roles.get(role_id)
+
+    def get_channel(self, channel_id: int):
+        return self._channels.get(channel_id)
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+        self.messages = 0
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def send_message(self, content=None, **kwargs):
+        self.done = True
+        self.messages += 1
+
+    async def defer(self, **kwargs):
+        self.done = True
+
+class FakeFollowup:
+    def __init__(self):
+        self.messages = 0
+
+    async def send(self, content=None, **kwargs):
+        self.messages += 1
+
+class FakeInteraction:
+    def __init__(self, guild: FakeGuild, user: FakeMember):
+        self.guild = guild
+        self.user = user
+        self.response = FakeResponse()
+        self.followup = FakeFollowup()
+        self.extras = {}
+        self.command = None
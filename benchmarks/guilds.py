@@ -0,0 +1,127 @@
+import contextlib
+import datetime
+import json
+import os
+import random
+import clock
+from storage import ColdArchive
+from stores import JsonBackend, JsonPartition
+import tombstones
+from tombstones import TombstoneIndex
+from bot import TimeBombBot
+from guildstate import GuildState
+from roles import RoleTransitions
+from benchmarks.fakes import FakeGuild
+
+# Rough shape of the production guild: most members are either mid-way
+# through a phase or long finished, with a tail of jailed users
+PHASE_MIX = (
+    ("first", 0.35),
+    ("second", 0.30),
+    ("first_jailed", 0.05),
+    ("second_jailed", 0.05),
+    ("veteran", 0.24),
+    ("bot", 0.01),
+)
+
+def load_config(path: str = "config.json") -> dict:
+    with open(path, 'r') as f:
+        config = json.load(f)
+    # Nothing in the benchmarks should try to open a socket
+    config["metrics"] = {"enabled": False}
+    config["query_api"] = {"enabled": False}
+    config["watchdog"] = {"enabled": False}
+    return config
+
+@contextlib.contextmanager
+def redirect_tombstones(workdir: str):
+    """Point the tombstone files at a temp dir so a run never writes to the real /data volume"""
+    original = tombstones.TOMBSTONE_FILE, tombstones.BLOOM_FILE
+    tombstones.TOMBSTONE_FILE = os.path.join(workdir, "tombstones.json")
+    tombstones.BLOOM_FILE = os.path.join(workdir, "tombstones.bloom")
+    try:
+        yield
+    finally:
+        tombstones.TOMBSTONE_FILE, tombstones.BLOOM_FILE = original
+
+def bench_state(bot, config: dict, workdir: str, state_class=GuildState) -> GuildState:
+    """A guild state whose data files live in a temp dir"""
+    return state_class(
+        bot, config,
+        partition=JsonPartition(os.path.join(workdir, "persistent_user_data.json")),
+        archive=ColdArchive(os.path.join(workdir, "archive.jsonl.gz"), os.path.join(workdir, "archive_index.json")),
+        tombstone_index=TombstoneIndex(config, os.path.join(workdir, "tombstones.json"), os.path.join(workdir, "tombstones.bloom")),
+        checkpoint_file=os.path.join(workdir, "backfill_checkpoint.json")
+    )
+
+class BenchBot(TimeBombBot):
+    """The real bot with its Discord lookups pointed at a fake guild and its files at a temp dir"""
+    state_class = GuildState
+
+    def __init__(self, config: dict, guild: FakeGuild, workdir: str):
+        super().__init__()
+        self.CONFIG = config
+        self.guild = guild
+        self.store = JsonBackend()
+        self.state = bench_state(self, config, workdir, self.state_class)
+        self.guild_states = {guild.id: self.state}
+        # Fake members apply edits instantly, so only same-tick changes need merging
+        self.role_transitions = RoleTransitions(window=0)
+
+    def get_guild(self, guild_id: int):
+        return self.guild if guild_id == self.guild.id else None
+
+    def get_channel(self, channel_id: int):
+        return self.guild.get_channel(channel_id)
+
+def build_guild(config: dict, size: int, seed: int = 0, now: datetime.datetime = None):
+    """Create a fake guild of `size` members and the user_data the bot would hold for it"""
+    rng = random.Random(seed)
+    now = now or clock.utcnow()
+    guild = FakeGuild(config["guild_id"])
+    roles = {name: guild.add_role(role_id, name) for name, role_id in config["roles"].items()}
+    starter = guild.add_role(config["starter_role"], "starter")
+    guild.add_channel(config["log_channel"])
+    admin = guild.add_member()
+
+    kinds = [kind for kind, _ in PHASE_MIX]
+    weights = [weight for _, weight in PHASE_MIX]
+    user_data = {}
+
+    for _ in range(size):
+        kind = rng.choices(kinds, weights)[0]
+        if kind == "bot":
+            guild.add_member(bot=True)
+            continue
+        if kind == "veteran":
+            guild.add_member([roles["first_success"], roles["second_success"]])
+            continue
+
+        joined = now - datetime.timedelta(days=rng.uniform(0, 20))
+        data = {"join_date": joined.isoformat(), "warnings_sent": {}, "second_bomb_active": False}
+
+        if kind in ("first", "first_jailed"):
+            member = guild.add_member([starter] + ([roles["first_jail"]] if kind == "first_jailed" else []))
+            # A few deadlines have already passed and are due in this sweep
+            data["first_bomb_end"] = (now + datetime.timedelta(hours=rng.uniform(-12, 72))).isoformat()
+            if kind == "first_jailed":
+                data["first_bomb_failed"] = True
+            elif rng.random() < 0.3:
+                data["warnings_sent"]["first_24h"] = now.isoformat()
+        else:
+            member = guild.add_member([roles["first_success"]] + ([roles["second_jail"]] if kind == "second_jailed" else []))
+            data["second_bomb_active"] = True
+            data["second_bomb_end"] = (now + datetime.timedelta(days=rng.uniform(-1, 14))).isoformat()
+            data["activity"] = {
+                "messages": rng.randint(0, 9),
+                "voice_seconds": rng.randint(0, 1700),
+                "approvals": rng.randint(0, 2)
+            }
+            if kind == "second_jailed":
+                data["second_bomb_failed"] = True
+            elif rng.random() < 0.3:
+                data["warnings_sent"]["second_7d"] = now.isoformat()
+
+        user_data[str(member.id)] = data
+
+    return guild, user_data, admin
@@ -0,0 +1,287 @@
+import asyncio
+from aiohttp import web
+import datetime
+import itertools
+import json
+import logging
+import random
+import re
+import time
+
+API_PREFIX = "/api/v10"
+
+def _now_iso() -> str:
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+def _json(data, status: int = 200, headers: dict = None) -> web.Response:
+    """discord.py only parses bodies whose content type is exactly application/json"""
+    return web.Response(body=json.dumps(data).encode(), status=status,
+                        content_type="application/json", headers=headers)
+
+def _percentiles(values: list) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]
+    return {
+        "count": len(values),
+        "p50_ms": pick(0.50) * 1000,
+        "p95_ms": pick(0.95) * 1000,
+        "p99_ms": pick(0.99) * 1000,
+        "max_ms": values[-1] * 1000
+    }
+
+class MockDiscord:
+    """Just enough of Discord's REST API and gateway to run TimeBombBot offline"""
+
+    def __init__(self, guild_id: int, role_ids: dict, channel_ids: list,
+                 rate_limit_rate: float = 0.0, retry_after: float = 0.25, seed: int = 0):
+        self.ids = itertools.count(10 ** 18)
+        self.rng = random.Random(seed)
+        self.guild_id = guild_id
+        self.bot_user = self._user(next(self.ids), "TimeBomb", bot=True)
+        self.application = {
+            "id": self.bot_user["id"], "name": "TimeBomb", "icon": None, "description": "",
+            "rpc_origins": [], "bot_public": True, "bot_require_code_grant": False,
+            "owner": self._user(next(self.ids), "owner"), "summary": "", "verify_key": "",
+            "flags": 0, "team": None
+        }
+        self.roles = [self._role(guild_id, "@everyone", 0)] + [
+            self._role(role_id, name, position) for position, (name, role_id) in enumerate(role_ids.items(), 1)
+        ]
+        self.channels = [
+            {"id": str(channel_id), "type": 0, "name": f"channel-{i}", "position": i,
+             "guild_id": str(guild_id), "permission_overwrites": [], "nsfw": False, "parent_id": None}
+            for i, channel_id in enumerate(channel_ids)
+        ]
+        # user_id -> member payload
+        self.members = {}
+        # dm channel id -> recipient user id
+        self.dm_channels = {}
+
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.sockets = set()
+        self.sequence = 0
+        self.ready = asyncio.Event()
+
+        # user_id -> perf_counter time of the last event injected for them
+        self.pending_events = {}
+        self.latencies = {"dm": [], "role_edit": []}
+        self.requests = 0
+        self.rate_limited = 0
+        self.runner = None
+
+    # -- payload builders --
+
+    @staticmethod
+    def _user(user_id: int, name: str, bot: bool = False) -> dict:
+        return {"id": str(user_id), "username": name, "discriminator": "0", "global_name": name,
+                "avatar": None, "bot": bot, "public_flags": 0}
+
+    @staticmethod
+    def _role(role_id: int, name: str, position: int) -> dict:
+        return {"id": str(role_id), "name": name, "permissions": "0", "position": position, "color": 0,
+                "hoist": False, "managed": False, "mentionable": False, "flags": 0}
+
+    def add_member(self, role_ids=(), bot: bool = False) -> dict:
+        user_id = next(self.ids)
+        member = {
+            "user": self._user(user_id, f"user{user_id}", bot=bot),
+            "roles": [str(role_id) for role_id in role_ids],
+            "joined_at": _now_iso(), "nick": None, "deaf": False, "mute": False, "flags": 0
+        }
+        self.members[str(user_id)] = member
+        return member
+
+    def _guild_payload(self) -> dict:
+        bot_member = {"user": self.bot_user, "roles": [], "joined_at": _now_iso(), "nick": None,
+                      "deaf": False, "mute": False, "flags": 0}
+        return {
+            "id": str(self.guild_id), "name": "Load Test", "icon": None, "owner_id": self.application["owner"]["id"],
+            "afk_channel_id": None, "afk_timeout": 300, "verification_level": 0,
+            "default_message_notifications": 0, "explicit_content_filter": 0, "mfa_level": 0,
+            "premium_tier": 0, "features": [], "emojis": [], "stickers": [], "roles": self.roles,
+            "channels": self.channels, "threads": [], "voice_states": [], "presences": [],
+            "stage_instances": [], "guild_scheduled_events": [], "soundboard_sounds": [],
+            "members": [bot_member] + list(self.members.values()),
+            "member_count": len(self.members) + 1, "large": len(self.members) > 250,
+            "unavailable": False, "joined_at": _now_iso(), "preferred_locale": "en-US", "nsfw_level": 0
+        }
+
+    def _message(self, channel_id: str, payload: dict) -> dict:
+        return {
+            "id": str(next(self.ids)), "channel_id": channel_id, "author": self.bot_user,
+            "content": payload.get("content") or "", "timestamp": _now_iso(), "edited_timestamp": None,
+            "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [],
+            "attachments": [], "embeds": payload.get("embeds", []), "pinned": False, "type": 0, "flags": 0
+        }
+
+    # -- gateway --
+
+    async def _dispatch(self, event: str, data: dict) -> None:
+        self.sequence += 1
+        payload = json.dumps({"op": 0, "t": event, "s": self.sequence, "d": data})
+        for ws in list(self.sockets):
+            await ws.send_str(payload)
+
+    async def gateway(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({"op": 10, "d": {"heartbeat_interval": 41250}}))
+
+        async for msg in ws:
+            payload = json.loads(msg.data)
+            op = payload["op"]
+            if op == 1:
+                await ws.send_str(json.dumps({"op": 11}))
+            elif op == 2:
+                self.sockets.add(ws)
+                await self._dispatch("READY", {
+                    "v": 10, "user": self.bot_user, "guilds": [{"id": str(self.guild_id), "unavailable": True}],
+                    "session_id": "loadtest", "resume_gateway_url": str(request.url.with_query(None)),
+                    "application": {"id": self.application["id"], "flags": 0},
+                    "shard": payload["d"].get("shard", [0, 1])
+                })
+                await self._dispatch("GUILD_CREATE", self._guild_payload())
+                self.ready.set()
+            elif op == 8:
+                await self._dispatch("GUILD_MEMBERS_CHUNK", {
+                    "guild_id": str(self.guild_id), "members": list(self.members.values()),
+                    "chunk_index": 0, "chunk_count": 1, "nonce": payload["d"].get("nonce")
+                })
+
+        self.sockets.discard(ws)
+        return ws
+
+    # -- event injection --
+
+    async def member_join_storm(self, count: int, per_second: float = 0.0) -> None:
+        """Add `count` new members, optionally paced"""
+        for _ in range(count):
+            member = self.add_member()
+            self.pending_events[member["user"]["id"]] = time.perf_counter()
+            await self._dispatch("GUILD_MEMBER_ADD", dict(member, guild_id=str(self.guild_id)))
+            if per_second:
+                await asyncio.sleep(1 / per_second)
+
+    async def role_update_burst(self, role_id: int, count: int, per_second: float = 0.0) -> None:
+        """Give `role_id` to `count` members that don't have it yet, as an admin would"""
+        candidates = [m for m in self.members.values() if str(role_id) not in m["roles"] and not m["user"]["bot"]]
+        for member in self.rng.sample(candidates, min(count, len(candidates))):
+            member["roles"].append(str(role_id))
+            self.pending_events[member["user"]["id"]] = time.perf_counter()
+            await self._dispatch("GUILD_MEMBER_UPDATE", dict(member, guild_id=str(self.guild_id)))
+            if per_second:
+                await asyncio.sleep(1 / per_second)
+
+    def _reacted(self, kind: str, user_id: str) -> None:
+        started = self.pending_events.pop(user_id, None)
+        if started is not None:
+            self.latencies[kind].append(time.perf_counter() - started)
+
+    # -- REST --
+
+    async def rest(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        path = "/" + request.match_info["tail"]
+        method = request.method
+        body = await request.json() if request.can_read_body else {}
+
+        bootstrap = path in ("/users/@me", "/oauth2/applications/@me", "/gateway/bot") or "/commands" in path
+        if not bootstrap and self.rng.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            return _json(
+                {"message": "You are being rate limited.", "retry_after": self.retry_after, "global": False},
+                status=429,
+                # discord.py treats a 429 without a Via header as a Cloudflare ban and won't retry it
+                headers={"Retry-After": str(self.retry_after), "X-RateLimit-Scope": "user", "Via": "1.1 google",
+                         "X-RateLimit-Remaining": "0", "X-RateLimit-Reset-After": str(self.retry_after)}
+            )
+
+        if path == "/users/@me":
+            return _json(self.bot_user)
+        if path == "/oauth2/applications/@me":
+            return _json(self.application)
+        if path == "/gateway/bot":
+            return _json({"url": str(request.url.with_path("/gateway").with_query(None)), "shards": 1,
+                                      "session_start_limit": {"total": 1000, "remaining": 1000,
+                                                              "reset_after": 0, "max_concurrency": 1}})
+        if path.endswith("/commands"):
+            return _json([])
+
+        if path == "/users/@me/channels" and method == "POST":
+            channel_id = str(next(self.ids))
+            recipient = body["recipient_id"]
+            self.dm_channels[channel_id] = str(recipient)
+            member = self.members.get(str(recipient))
+            user = member["user"] if member else self._user(int(recipient), "unknown")
+            return _json({"id": channel_id, "type": 1, "recipients": [user], "last_message_id": None})
+
+        match = re.fullmatch(r"/channels/(\d+)/messages", path)
+        if match:
+            channel_id = match.group(1)
+            if method == "GET":
+                return _json([])
+            if channel_id in self.dm_channels:
+                self._reacted("dm", self.dm_channels[channel_id])
+            return _json(self._message(channel_id, body))
+
+        match = re.fullmatch(r"/guilds/(\d+)/members/(\d+)/roles/(\d+)", path)
+        if match:
+            _, user_id, role_id = match.groups()
+            member = self.members.get(user_id)
+            if member is None:
+                return _json({"message": "Unknown Member", "code": 10007}, status=404)
+            if method == "PUT" and role_id not in member["roles"]:
+                member["roles"].append(role_id)
+            elif method == "DELETE" and role_id in member["roles"]:
+                member["roles"].remove(role_id)
+            self._reacted("role_edit", user_id)
+            # Discord echoes role changes back over the gateway
+            await self._dispatch("GUILD_MEMBER_UPDATE", dict(member, guild_id=str(self.guild_id)))
+            return web.Response(status=204)
+
+        match = re.fullmatch(r"/guilds/(\d+)/members/(\d+)", path)
+        if match and method == "PATCH":
+            user_id = match.group(2)
+            member = self.members.get(user_id)
+            if member is None:
+                return _json({"message": "Unknown Member", "code": 10007}, status=404)
+            if "roles" in body:
+                member["roles"] = [str(role_id) for role_id in body["roles"]]
+                self._reacted("role_edit", user_id)
+                await self._dispatch("GUILD_MEMBER_UPDATE", dict(member, guild_id=str(self.guild_id)))
+            return _json(member)
+
+        logging.warning("Mock Discord has no handler for %s %s", method, path)
+        return _json({"message": "404: Not Found", "code": 0}, status=404)
+
+    # -- lifecycle --
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving and return the base URL"""
+        app = web.Application()
+        app.router.add_get("/gateway", self.gateway)
+        app.router.add_route("*", API_PREFIX + "/{tail:.*}", self.rest)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def stop(self) -> None:
+        for ws in list(self.sockets):
+            await ws.close()
+        if self.runner:
+            await self.runner.cleanup()
+
+    def report(self) -> dict:
+        return {
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "unanswered_events": len(self.pending_events),
+            "dm_latency": _percentiles(self.latencies["dm"]),
+            "role_edit_latency": _percentiles(self.latencies["role_edit"])
+        }
@@ -0,0 +1,167 @@
+import asyncio
+import collections
+import datetime
+import json
+import logging
+import tempfile
+import time
+from types import SimpleNamespace
+import clock
+from clock import SimulatedClock
+from bot import TimeBombBot
+from commands import AdminCommands
+from benchmarks.fakes import FakeGuild, FakeInteraction
+from benchmarks.guilds import load_config, redirect_tombstones
+from benchmarks.simulate import SimBot, _summary
+
+# Discord application command option types that refer to guild objects
+USER_OPTION = 6
+ROLE_OPTION = 8
+
+def load_recording(path: str) -> list:
+    """Read a recorder NDJSON file, oldest event first"""
+    events = []
+    with open(path, 'r') as f:
+        for line in f:
+            if line.strip():
+                events.append(json.loads(line))
+    events.sort(key=lambda event: event["at"])
+    return events
+
+class Replayer:
+    """Feeds recorded events into the real handlers against a fake guild"""
+
+    def __init__(self, bot: SimBot, guild: FakeGuild, sim_clock: SimulatedClock):
+        self.bot = bot
+        self.guild = guild
+        self.clock = sim_clock
+        self.cog = AdminCommands(bot)
+        self.commands = {command.name: command for command in self.cog.get_app_commands()}
+        self.handlers = {
+            "member_join": self.member_join,
+            "member_update": self.member_update,
+            "member_remove": self.member_remove,
+            "interaction": self.interaction,
+        }
+
+    def _roles(self, role_ids: list) -> list:
+        roles = []
+        for role_id in role_ids:
+            role = self.guild.get_role(role_id) or self.guild.add_role(role_id, f"role{role_id}")
+            roles.append(role)
+        return roles
+
+    def _member(self, user_id: int, role_ids=(), bot: bool = False):
+        member = self.guild.get_member(user_id)
+        if member is None:
+            member = self.guild.add_member(self._roles(role_ids), bot=bot, member_id=user_id)
+        return member
+
+    async def member_join(self, event: dict) -> None:
+        member = self._member(event["user_id"], bot=event.get("bot", False))
+        member.roles = self._roles(event.get("roles", []))
+        await self.bot.on_member_join(member)
+
+    async def member_update(self, event: dict) -> None:
+        member = self._member(event["user_id"])
+        before = SimpleNamespace(roles=self._roles(event["before"]))
+        member.roles = self._roles(event["after"])
+        await self.bot.on_member_update(before, member)
+
+    async def member_remove(self, event: dict) -> None:
+        member = self._member(event["user_id"], event.get("roles", []))
+        await self.bot.on_member_remove(member)
+        self.guild.remove_member(member.id)
+
+    async def interaction(self, event: dict) -> None:
+        command = self.commands.get(event["command"])
+        if command is None:
+            raise LookupError(f"Unknown command /{event['command']}")
+
+        kwargs = {}
+        for option in event.get("options", []):
+            if option["type"] == USER_OPTION:
+                kwargs[option["name"]] = self._member(int(option["value"]))
+            elif option["type"] == ROLE_OPTION:
+                kwargs[option["name"]] = self._roles([int(option["value"])])[0]
+            else:
+                kwargs[option["name"]] = option["value"]
+
+        interaction = FakeInteraction(self.guild, self._member(event["user_id"]))
+        await command.callback(self.cog, interaction, **kwargs)
+
+async def run_replay(path: str, speed: float = 1.0, tick_hours: float = None, persist: bool = False) -> dict:
+    """Replay a recording at `speed` times its original pace, or as fast as possible when speed is 0"""
+    config = load_config()
+    events = load_recording(path)
+    if not events:
+        return {"events": 0}
+
+    first = datetime.datetime.fromisoformat(events[0]["at"])
+    sim_clock = SimulatedClock(first)
+    tick = datetime.timedelta(hours=TimeBombBot.check_timers.hours if tick_hours is None else tick_hours)
+
+    guild = FakeGuild(config["guild_id"])
+    for name, role_id in config["roles"].items():
+        guild.add_role(role_id, name)
+    guild.add_channel(config["log_channel"])
+
+    handler_times = collections.defaultdict(list)
+    errors = collections.Counter()
+    sweep_times = []
+    behind = []
+
+    with tempfile.TemporaryDirectory() as workdir, redirect_tombstones(workdir), clock.use_clock(sim_clock):
+        bot = SimBot(config, guild, workdir, persist=persist)
+        replayer = Replayer(bot, guild, sim_clock)
+        next_sweep = first + tick if tick else None
+        started = time.perf_counter()
+
+        for event in events:
+            at = datetime.datetime.fromisoformat(event["at"])
+
+            # Sweeps that check_timers would have run before this event
+            while next_sweep is not None and next_sweep <= at:
+                sim_clock.set(next_sweep)
+                sweep_started = time.perf_counter()
+                await bot.check_timers()
+                sweep_times.append(time.perf_counter() - sweep_started)
+                next_sweep += tick
+
+            if speed:
+                due = (at - first).total_seconds() / speed
+                elapsed = time.perf_counter() - started
+                if due > elapsed:
+                    await asyncio.sleep(due - elapsed)
+                else:
+                    behind.append(elapsed - due)
+
+            sim_clock.set(at)
+            handler = replayer.handlers.get(event["event"])
+            if handler is None:
+                errors[event["event"]] += 1
+                continue
+            handler_started = time.perf_counter()
+            try:
+                await handler(event)
+            except Exception as e:
+                errors[event["event"]] += 1
+                logging.debug("Replaying %s failed: %s", event["event"], e)
+            handler_times[event["event"]].append(time.perf_counter() - handler_started)
+
+        wall = time.perf_counter() - started
+        recorded = (datetime.datetime.fromisoformat(events[-1]["at"]) - first).total_seconds()
+        return {
+            "events": len(events),
+            "speed": speed,
+            "recorded_seconds": recorded,
+            "wall_seconds": wall,
+            "handler_ms": {name: _summary(times, 0.001) for name, times in handler_times.items()},
+            "errors": dict(errors),
+            "sweeps": {"count": len(sweep_times), "seconds": _summary(sweep_times)},
+            "behind_schedule_ms": _summary(behind, 0.001),
+            "tracked_users": len(bot.state.user_data),
+            "dms_sent": sum(member.dm_channel.sent for member in guild.members),
+            "role_edits": sum(member.role_edits for member in guild.members),
+            "saves": bot.state.saves
+        }
@@ -0,0 +1,282 @@
+import collections
+import datetime
+import heapq
+import itertools
+import random
+import tempfile
+import time
+from types import SimpleNamespace
+import clock
+import phases
+import utils
+from clock import SimulatedClock
+from bot import TimeBombBot
+from benchmarks.fakes import FakeGuild, FakeMember
+from guildstate import GuildState
+from benchmarks.guilds import BenchBot, load_config, redirect_tombstones
+
+# Warning key -> (phase, how long before the deadline it is meant to go out)
+WARNINGS = {
+    "first_24h": (1, datetime.timedelta(hours=24)),
+    "first_12h": (1, datetime.timedelta(hours=12)),
+    "second_7d": (2, datetime.timedelta(days=7)),
+    "second_3d": (2, datetime.timedelta(days=3)),
+    "second_24h": (2, datetime.timedelta(hours=24)),
+}
+DEADLINE_KEYS = {1: "first_bomb_end", 2: "second_bomb_end"}
+
+def _summary(values: list, scale: float = 1.0) -> dict:
+    if not values:
+        return {"count": 0}
+    values = sorted(value / scale for value in values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]
+    return {"count": len(values), "min": values[0], "p50": pick(0.50), "p95": pick(0.95), "max": values[-1]}
+
+class EchoingMember(FakeMember):
+    """Queues the GUILD_MEMBER_UPDATE Discord would send back after a role edit"""
+
+    async def add_roles(self, *roles, reason=None):
+        before = SimpleNamespace(roles=list(self.roles))
+        await super().add_roles(*roles, reason=reason)
+        self.guild.echoes.append((before, self))
+
+    async def remove_roles(self, *roles, reason=None):
+        before = SimpleNamespace(roles=list(self.roles))
+        await super().remove_roles(*roles, reason=reason)
+        self.guild.echoes.append((before, self))
+
+    async def edit(self, *, roles=None, reason=None, **kwargs):
+        before = SimpleNamespace(roles=list(self.roles))
+        await super().edit(roles=roles, reason=reason, **kwargs)
+        self.guild.echoes.append((before, self))
+
+class SimGuild(FakeGuild):
+    member_class = EchoingMember
+
+    def __init__(self, guild_id: int):
+        super().__init__(guild_id)
+        self.echoes = collections.deque()
+
+class CountingState(GuildState):
+    """Guild state that only counts saves unless asked to persist, so I/O doesn't swamp the lifecycle"""
+    persist = False
+    saves = 0
+
+    def save_user_data(self, user_ids: list = None):
+        self.saves += 1
+        if self.persist:
+            super().save_user_data(user_ids)
+
+class SimBot(BenchBot):
+    state_class = CountingState
+
+    def __init__(self, config: dict, guild: SimGuild, workdir: str, persist: bool = False):
+        super().__init__(config, guild, workdir)
+        self.state.persist = persist
+
+class Simulation:
+    """Discrete-event run of a member cohort through both TimeBomb phases on a simulated clock"""
+
+    def __init__(self, bot: SimBot, sim_clock: SimulatedClock, rng: random.Random, tick: datetime.timedelta,
+                 first_success: float, second_success: float, release_rate: float, max_days: float):
+        self.bot = bot
+        self.guild = bot.guild
+        self.clock = sim_clock
+        self.rng = rng
+        self.tick = tick
+        self.success_rate = {1: first_success, 2: second_success}
+        self.release_rate = release_rate
+        self.horizon = sim_clock.now() + datetime.timedelta(days=max_days)
+        self.roles = {name: self.guild.get_role(role_id) for name, role_id in bot.CONFIG["roles"].items()}
+        self.jail_phase = {self.roles["first_jail"]: 1, self.roles["second_jail"]: 2}
+
+        self.queue = []
+        self.sequence = itertools.count()
+        # user_id -> the phase the simulation believes they are in
+        self.phases = {}
+        self.pending = 0
+        self.events = 0
+
+        self.outcomes = collections.Counter()
+        self.jail_delays = {1: [], 2: []}
+        self.warning_offsets = {key: [] for key in WARNINGS}
+        self.warnings_missed = collections.Counter()
+        self.warnings_suppressed = collections.Counter()
+        self.sweep_times = []
+        self.users_swept = 0
+
+    def schedule(self, when: datetime.datetime, action, *args) -> None:
+        heapq.heappush(self.queue, (when, next(self.sequence), action, args))
+        if action != self.sweep:
+            self.pending += 1
+
+    # -- phase bookkeeping --
+
+    def open_phase(self, member, phase: int) -> None:
+        user_id = str(member.id)
+        data = self.bot.state.user_data[user_id]
+        deadline = datetime.datetime.fromisoformat(data[DEADLINE_KEYS[phase]])
+        record = {
+            "phase": phase, "started": self.clock.now(), "deadline": deadline, "data": data,
+            "already_sent": set(data.get("warnings_sent", {}))
+        }
+        self.phases[user_id] = record
+        if self.rng.random() < self.success_rate[phase]:
+            self.schedule(record["started"] + (deadline - record["started"]) * self.rng.random(),
+                          self.succeed, member, record)
+
+    def close_phase(self, user_id: str, outcome: str) -> dict:
+        record = self.phases.pop(user_id)
+        ended = self.clock.now()
+        warnings_sent = record["data"].get("warnings_sent", {})
+        for key, (phase, offset) in WARNINGS.items():
+            if phase != record["phase"]:
+                continue
+            target = record["deadline"] - offset
+            if key in record["already_sent"]:
+                # Carried over from before a release, so it won't be sent again
+                self.warnings_suppressed[key] += 1
+            elif key in warnings_sent:
+                sent = datetime.datetime.fromisoformat(warnings_sent[key])
+                self.warning_offsets[key].append((sent - target).total_seconds())
+            elif record["started"] <= target < ended:
+                self.warnings_missed[key] += 1
+        self.outcomes[f"phase{record['phase']}_{outcome}"] += 1
+        return record
+
+    def observe(self, before, member):
+        """Close phases on jail and success roles; returns the phase to open once the bot has reacted"""
+        user_id = str(member.id)
+        for role in set(member.roles) - set(before.roles):
+            record = self.phases.get(user_id)
+            if record is None:
+                continue
+            if role in self.jail_phase and self.jail_phase[role] == record["phase"]:
+                self.close_phase(user_id, "jailed")
+                self.jail_delays[record["phase"]].append((self.clock.now() - record["deadline"]).total_seconds())
+                if self.rng.random() < self.release_rate:
+                    self.schedule(self.clock.now() + datetime.timedelta(hours=self.rng.uniform(1, 48)),
+                                  self.release, member, record["phase"])
+            elif role == self.roles["first_success"] and record["phase"] == 1:
+                self.close_phase(user_id, "completed")
+                return 2
+            elif role == self.roles["second_success"] and record["phase"] == 2:
+                self.close_phase(user_id, "completed")
+        return None
+
+    async def drain(self) -> None:
+        """Deliver queued role echoes to the bot, as the gateway would"""
+        while self.guild.echoes:
+            before, member = self.guild.echoes.popleft()
+            next_phase = self.observe(before, member)
+            await self.bot.on_member_update(before, member)
+            if next_phase:
+                self.open_phase(member, next_phase)
+
+    # -- actions --
+
+    async def join(self) -> None:
+        member = self.guild.add_member()
+        await self.bot.on_member_join(member)
+        self.outcomes["joined"] += 1
+        self.open_phase(member, 1)
+
+    async def succeed(self, member, record: dict) -> None:
+        if self.phases.get(str(member.id)) is not record:
+            return
+        if record["phase"] == 1:
+            # An admin hands out the first success role
+            await member.add_roles(self.roles["first_success"])
+        else:
+            # Reaching every threshold at once, as ActivityTracker would over time
+            record["data"]["activity"] = {
+                counter: utils.get_requirement_threshold(self.bot.state.CONFIG, counter)
+                for counter in ("messages", "voice_seconds", "approvals")
+            }
+            await utils.evaluate_requirements(self.bot.state, member)
+
+    async def release(self, member, phase: int) -> None:
+        await utils.handle_jail_release(self.bot.state, member, phases.ENGINE.by_number[phase])
+        self.outcomes[f"phase{phase}_released"] += 1
+        self.open_phase(member, phase)
+
+    async def sweep(self) -> None:
+        self.users_swept += len(self.bot.state.user_data)
+        started = time.perf_counter()
+        await self.bot.check_timers()
+        self.sweep_times.append(time.perf_counter() - started)
+        if self.pending or self.bot.state.user_data:
+            self.schedule(self.clock.now() + self.tick, self.sweep)
+
+    async def run(self, members: int, join_window: datetime.timedelta) -> None:
+        start = self.clock.now()
+        for _ in range(members):
+            self.schedule(start + join_window * self.rng.random(), self.join)
+        self.schedule(start, self.sweep)
+
+        while self.queue:
+            when, _, action, args = heapq.heappop(self.queue)
+            if when > self.horizon:
+                break
+            if action != self.sweep:
+                self.pending -= 1
+            self.clock.set(when)
+            await action(*args)
+            await self.drain()
+            self.events += 1
+
+async def run_simulation(members: int = 5000, join_days: float = 3.0, tick_hours: float = None,
+                         first_success: float = 0.7, second_success: float = 0.6, release_rate: float = 0.5,
+                         max_days: float = 120.0, persist: bool = False, seed: int = 0) -> dict:
+    """Push a cohort through joins, warnings, jails, releases and completions on a simulated clock"""
+    config = load_config()
+    rng = random.Random(seed)
+    tick = datetime.timedelta(hours=tick_hours if tick_hours else TimeBombBot.check_timers.hours)
+    sim_clock = SimulatedClock(datetime.datetime(2025, 1, 1))
+    start = sim_clock.now()
+
+    guild = SimGuild(config["guild_id"])
+    for name, role_id in config["roles"].items():
+        guild.add_role(role_id, name)
+    guild.add_channel(config["log_channel"])
+
+    with tempfile.TemporaryDirectory() as workdir, redirect_tombstones(workdir), clock.use_clock(sim_clock):
+        bot = SimBot(config, guild, workdir, persist=persist)
+        simulation = Simulation(bot, sim_clock, rng, tick, first_success, second_success, release_rate, max_days)
+        started = time.perf_counter()
+        await simulation.run(members, datetime.timedelta(days=join_days))
+        wall = time.perf_counter() - started
+        simulated = (sim_clock.now() - start).total_seconds()
+
+        sweeps = simulation.sweep_times
+        return {
+            "members": members,
+            "tick_hours": tick.total_seconds() / 3600,
+            "simulated_days": simulated / 86400,
+            "wall_seconds": wall,
+            "speedup": simulated / wall if wall else None,
+            "events": simulation.events,
+            "events_per_second": simulation.events / wall if wall else None,
+            "sweeps": {
+                "count": len(sweeps),
+                "seconds": _summary(sweeps),
+                "users_swept": simulation.users_swept,
+                "users_per_second": simulation.users_swept / sum(sweeps) if sum(sweeps) else None
+            },
+            "outcomes": dict(simulation.outcomes),
+            "jail_delay_hours": {f"phase{phase}": _summary(delays, 3600)
+                                 for phase, delays in simulation.jail_delays.items()},
+            "warnings": {
+                key: {
+                    "sent": len(simulation.warning_offsets[key]),
+                    "missed": simulation.warnings_missed[key],
+                    "suppressed": simulation.warnings_suppressed[key],
+                    "offset_hours": _summary(simulation.warning_offsets[key], 3600)
+                }
+                for key in WARNINGS
+            },
+            "still_tracked": len(bot.state.user_data),
+            "dms_sent": sum(member.dm_channel.sent for member in guild.members),
+            "role_edits": sum(member.role_edits for member in guild.members),
+            "saves": bot.state.saves
+        }
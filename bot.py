@@ -1,20 +1,36 @@
 import discord
 from discord.ext import commands, tasks
-import json
+import asyncio
+from collections import deque
 import datetime
 import logging
 import os
+from typing import Optional
 from dotenv import load_dotenv
 import utils  # Make sure to import utils
+import clock
+import liveconfig
+import logsetup
+import phases
+import storage
+import stores
+from guildstate import GuildState, PinnedState, guild_configs
+from liveconfig import ConfigSnapshot
+from sharding import Lease, RemoteGuild, shard_settings
+import metrics
+import queryapi
+from metrics import METRICS
+from lagmonitor import LoopWatchdog
+from smoothing import DispatchLimiter
+from roles import RoleTransitions
 
 # Load token
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
-# Setup logging
-logging.basicConfig(level=logging.INFO)
+# Logging is set up in __main__ so importing the bot has no side effects
 
-class TimeBombBot(commands.Bot):
+class TimeBombBot(commands.AutoShardedBot):
     def __init__(self):
         intents = discord.Intents.default()
         intents.members = True
@@ -23,84 +39,132 @@ class TimeBombBot(commands.Bot):
         
         super().__init__(
             command_prefix='/',
-            intents=intents
+            intents=intents,
+            http_trace=metrics.trace_config(),
+            **shard_settings()
         )
+        metrics.instrument_http(self)
+        metrics.register_user_gauges(self)
         
         # Initialize data storage
-        self.user_data = {}
         self.CONFIG = {}
+        # Modification time of the config file the running config came from
+        self.config_mtime = None
+        # guild id -> that guild's config and data
+        self.guild_states = {}
+        self.store = None
+        # Only the holder runs the deadline sweep when several processes share a store
+        self.scheduler_lease = None
+        self.metrics_runner = None
+        self.query_api_runner = None
+        self.watchdog = None
+        # Caps how fast the sweep sends warnings and jails; uncapped until the config says otherwise
+        self.dispatch_limiter = DispatchLimiter()
+        # Every role change goes through here, one edit per member
+        self.role_transitions = RoleTransitions()
     
     def load_config(self):
         try:
-            with open('config.json', 'r') as f:
-                self.CONFIG = json.load(f)
-            print("Configuration loaded successfully")
+            self.config_mtime = liveconfig.config_mtime()
+            self.CONFIG = liveconfig.read_config()
+            phases.configure(self.CONFIG)
+            logging.info("Configuration loaded successfully", extra={"event": "config_loaded"})
         except Exception as e:
-            print(f"Error loading config: {e}")
+            logging.error("Error loading config: %s", e, extra={"event": "config_error"})
             raise SystemExit("Could not load configuration!")
 
-    def load_user_data(self):
-        """Load user data from single persistent file"""
-        data_file = "/data/persistent_user_data.json"
-        
-        try:
-            # Try loading from persistent storage
-            with open(data_file, 'r') as f:
-                self.user_data = json.load(f)
-            print(f"User data loaded successfully from {data_file}")
-        except FileNotFoundError:
-            print("No existing data found, starting fresh")
-            self.user_data = {}
-        except Exception as e:
-            print(f"Error loading data: {e}")
-            self.user_data = {}
+    def build_guild_state(self, config: dict, primary: bool) -> GuildState:
+        return GuildState.for_guild(self, config, primary, self.store)
 
-    def save_user_data(self):
-        """Save user data to single persistent file"""
-        # Ensure data directory exists
-        os.makedirs("/data", exist_ok=True)
-        
-        # Use a single, consistent filename
-        data_file = "/data/persistent_user_data.json"
-        
+    def load_guild_states(self):
+        """Load the data of every configured guild into its own partition"""
+        primary = self.CONFIG.get("guild_id")
+        self.guild_states = {}
+        for guild_id, config in guild_configs(self.CONFIG).items():
+            state = self.build_guild_state(config, primary=guild_id == primary)
+            state.load_user_data()
+            state.tombstones.load()
+            self.guild_states[guild_id] = state
+        logging.info("Tracking %d guilds", len(self.guild_states), extra={"event": "config_loaded"})
+
+    def reload_config(self) -> bool:
+        """Re-read config.json and swap every guild onto the new settings at once
+
+        Everything is parsed and compiled before anything is swapped, so a
+        bad edit leaves the running config alone. Work already in flight
+        keeps the snapshot it started with.
+        """
         try:
-            # Save to persistent storage
-            with open(data_file, 'w') as f:
-                json.dump(self.user_data, f, indent=4)
-            print(f"User data saved successfully to {data_file}")
+            config = liveconfig.read_config()
+            snapshots = {guild_id: ConfigSnapshot(guild_config) for guild_id, guild_config in guild_configs(config).items()}
         except Exception as e:
-            print(f"Error saving to persistent storage: {e}")
+            logging.error("Not reloading config: %r", e, extra={"event": "config_error"})
+            return False
+        if config.get("guild_id") != self.CONFIG.get("guild_id"):
+            logging.error("Not reloading config: changing guild_id needs a restart", extra={"event": "config_error"})
+            return False
+
+        for key in liveconfig.restart_settings_changed(self.CONFIG, config):
+            logging.warning("The %s setting changed and needs a restart to take effect", key, extra={"event": "config_reloaded"})
+        # Nothing below awaits, so no handler sees a half-applied reload
+        self.CONFIG = config
+        self.dispatch_limiter = DispatchLimiter.from_config(config)
+        for guild_id, snapshot in snapshots.items():
+            if guild_id in self.guild_states:
+                self.guild_states[guild_id].snapshot = snapshot
+            else:
+                state = self.build_guild_state(snapshot.config, primary=False)
+                state.load_user_data()
+                state.tombstones.load()
+                self.guild_states[guild_id] = state
+        for guild_id in [guild_id for guild_id in self.guild_states if guild_id not in snapshots]:
+            self.guild_states.pop(guild_id).save_user_data()
+        logging.info("Configuration reloaded, tracking %d guilds", len(self.guild_states), extra={"event": "config_reloaded"})
+        return True
+
+    @tasks.loop(seconds=5)
+    async def watch_config(self):
+        """Reload config.json when it changes on disk"""
+        mtime = liveconfig.config_mtime()
+        if mtime is not None and mtime != self.config_mtime:
+            # Remember even a bad edit, so it's reported once rather than every poll
+            self.config_mtime = mtime
+            self.reload_config()
+
+    def state_for(self, guild) -> Optional[GuildState]:
+        """The state of a guild, or None for guilds TimeBomb isn't configured in"""
+        if guild is None:
+            return None
+        return self.guild_states.get(guild if isinstance(guild, int) else guild.id)
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
         """Handle new member joins"""
-        if member.bot:
+        state = self.state_for(member.guild)
+        if member.bot or state is None:
             return
 
-        # Set up initial timer
-        current_time = datetime.datetime.utcnow()
-        end_time = current_time + datetime.timedelta(days=3)
-        
-        # Store user data
-        self.user_data[str(member.id)] = {
-            "join_date": current_time.isoformat(),
-            "first_bomb_end": end_time.isoformat(),
-            "warnings_sent": {},
-            "second_bomb_active": False
-        }
-        self.save_user_data()
+        # Returning members pick up where they left off
+        tombstone = state.tombstones.pop(str(member.id))
+        if tombstone:
+            await utils.restore_returning_member(state, member, tombstone)
+            return
+
+        # Set up initial timer and store user data
+        current_time = clock.utcnow()
+        first = phases.ENGINE.first
+        state.user_data[str(member.id)] = phases.ENGINE.new_record(current_time)
+        state.save_user_data()
 
         # Send welcome message
         embed = discord.Embed(
             title="🎯 Welcome to Your First TimeBomb!",
             description=(
                 "Welcome to our community! You're now on your first TimeBomb challenge.\n\n"
-                "⏰ You have 3 days to complete these requirements:\n\n"
-                "1️⃣ Create an Instagram account following our course rules\n"
-                "2️⃣ Verify your account by opening a ticket\n"
-                "3️⃣ Introduce yourself in general chat\n\n"
+                f"⏰ You have {first.days} days to complete these requirements:\n\n"
+                f"{utils.PHASE_TASKS.get(first.name, '')}\n"
                 "💡 Use /timer to check your remaining time!\n\n"
-                "⚠️ Important: Failing to complete these requirements within 3 days "
+                f"⚠️ Important: Failing to complete these requirements within {first.days} days "
                 "will result in being moved to jail until requirements are met."
             ),
             color=discord.Color.blue()
@@ -109,96 +173,218 @@ class TimeBombBot(commands.Bot):
 
         try:
             await member.send(embed=embed)
-            logging.info(f"Welcome message sent to {member.id}")
+            logging.info("Welcome message sent to %s", member.id, extra={"user_id": member.id, "phase": 1, "event": "welcome_sent"})
         except discord.Forbidden:
-            logging.warning(f"Could not send welcome message to {member.id}")
+            logging.warning("Could not send welcome message to %s", member.id, extra={"user_id": member.id, "phase": 1, "event": "dm_failed"})
 
         # Log the join
-        log_channel = self.get_channel(self.CONFIG["log_channel"])
+        log_channel = state.log_channel
         if log_channel:
             await log_channel.send(f"New member {member.mention} started their TimeBomb journey!")
 
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        """Keep a tombstone so leaving and rejoining doesn't reset the timer"""
+        state = self.state_for(member.guild)
+        if state is not None and utils.handle_member_leave(state, member):
+            logging.info("User %s left during TimeBomb period", member.id, extra={"user_id": member.id, "event": "member_left"})
+
+    def bulk_lease(self, state: GuildState) -> Lease:
+        """Lease that keeps two processes from running bulk jobs on the same guild at once"""
+        return Lease(self.store, f"bulk:{state.guild_id}", self.CONFIG.get("sharding", {}).get("lease_seconds", 60))
+
+    @tasks.loop(seconds=5)
+    async def flush_guild_states(self):
+        """Write single-user saves the JSON store holds back, a few seconds' worth at a time"""
+        for state in self.guild_states.values():
+            state.flush_user_data()
+
+    @tasks.loop(seconds=30)
+    async def refresh_guild_states(self):
+        """Pick up what other processes wrote to the shared store"""
+        for state in self.guild_states.values():
+            state.refresh_user_data()
+
     @tasks.loop(hours=8)
     async def check_timers(self):
         """Check timers every 8 hours"""
+        if self.scheduler_lease is not None and not self.scheduler_lease.held:
+            logging.info("Skipping the timer check, another process holds the scheduler lease", extra={"event": "sweep_skipped"})
+            return
+        with METRICS.timer("timebomb_check_timers_seconds"):
+            await self.sweep_timers()
+
+    async def resolve_guild(self, state: GuildState):
+        """The guild to sweep, fetched over REST when its shard runs in another process"""
+        guild = self.get_guild(state.guild_id)
+        if guild is not None or self.shard_ids is None:
+            return guild
         try:
-            current_time = datetime.datetime.utcnow()
-            guild = self.get_guild(self.CONFIG["guild_id"])
-            if not guild:
-                return
-
-            for user_id, data in self.user_data.items():
-                # Check warnings
-                await utils.check_and_send_warnings(self, user_id, data)
-
-                # Check first phase
-                if "first_bomb_end" in data and not data.get("first_bomb_failed", False):
-                    end_time = datetime.datetime.fromisoformat(data["first_bomb_end"])
-                    if current_time > end_time:
-                        await utils.handle_bomb_failure(guild, int(user_id), 1)
-                        data["first_bomb_failed"] = True
-
-                # Check second phase
-                if data.get("second_bomb_active", False) and not data.get("second_bomb_failed", False):
-                    end_time = datetime.datetime.fromisoformat(data["second_bomb_end"])
-                    if current_time > end_time:
-                        await utils.handle_bomb_failure(guild, int(user_id), 2)
-                        data["second_bomb_failed"] = True
-
-            self.save_user_data()
+            state.remote_guild = await RemoteGuild.fetch(self, state.guild_id)
+        except discord.HTTPException as e:
+            logging.error("Could not fetch guild %s for the sweep: %s", state.guild_id, e, extra={"event": "sweep_error", "guild_id": state.guild_id})
+        return state.remote_guild
+
+    async def sweep_timers(self):
+        """Warn, jail and archive users whose deadlines have come due
+
+        Each guild gets its own queue and the queues take turns a batch at a
+        time, so one large guild can't hold up the sweep of a small one.
+        """
+        current_time = clock.utcnow()
+        batch_size = self.CONFIG.get("scheduler", {}).get("batch_size", 200)
+        queues = {}
+        for state in list(self.guild_states.values()):
+            guild = await self.resolve_guild(state)
+            if guild:
+                state.refresh_user_data()
+                # Nobody further out than the earliest warning has anything due yet;
+                # a config reload mid-sweep takes effect from the next one
+                queues[state] = (state.pinned(), guild, deque(state.due_users(current_time + phases.ENGINE.horizon)))
+
+        while queues:
+            for state in list(queues):
+                pinned, guild, queue = queues[state]
+                overdue = []
+                for _ in range(min(batch_size, len(queue))):
+                    user_id, data = queue.popleft()
+                    # One user's failure costs that user, never the rest of the guild's queue
+                    try:
+                        phase = await self.sweep_user(pinned, guild, user_id, data, current_time)
+                    except Exception as e:
+                        logging.exception("Error checking timers of %s in guild %s: %s", user_id, state.guild_id, e, extra={"user_id": user_id, "event": "sweep_error", "guild_id": state.guild_id})
+                        continue
+                    if phase is not None:
+                        overdue.append((user_id, data, phase))
+                # The batch's jailings go out together, a bounded number at a time
+                await self.role_transitions.run_batch(
+                    self.enforce_deadline(pinned, guild, user_id, data, phase) for user_id, data, phase in overdue
+                )
+
+                if not queue:
+                    del queues[state]
+                    state.remote_guild = None
+                    # Jailed users no longer need to be swept or re-saved
+                    jailed = [user_id for user_id, data in state.user_data.items() if storage.is_jailed(data)]
+                    state.archive_users(jailed, "jailed")
+                    state.save_user_data()
+            await asyncio.sleep(0)
+
+    async def sweep_user(self, state: PinnedState, guild: discord.Guild, user_id: str, data: dict, current_time: datetime.datetime) -> Optional[phases.Phase]:
+        """Check one user's warnings; returns the phase whose deadline has passed, if any"""
+        # Users archived by an event while the sweep was yielding are done
+        if user_id not in state.user_data:
+            return
+
+        phase = phases.ENGINE.live(data)
+        if phase is None:
+            return
+
+        # Check warnings
+        await utils.check_and_send_warnings(state, user_id, data)
+
+        # Check the running phase's deadline
+        return phase if current_time > phase.deadline(data) else None
 
+    async def enforce_deadline(self, state: PinnedState, guild: discord.Guild, user_id: str, data: dict, phase: phases.Phase):
+        """Jail a user whose phase ran out; a failure is logged and the user is left for the next sweep"""
+        await self.dispatch_limiter.wait()
+        try:
+            await state.snapshot.dispatch[(phase.number, "deadline")](state, guild, int(user_id), phase)
         except Exception as e:
-            logging.error(f"Error in timer check: {e}")
+            logging.exception("Error enforcing the deadline of %s in guild %s: %s", user_id, state.guild_id, e, extra={"user_id": user_id, "event": "sweep_error", "guild_id": state.guild_id})
+            return
+        data[phase.failed_key] = True
 
     async def setup_hook(self):
-        print("Bot is setting up...")
+        logging.info("Bot is setting up...")
         self.load_config()
-        self.load_user_data()
+        self.store = stores.open_backend(self.CONFIG)
+        self.dispatch_limiter = DispatchLimiter.from_config(self.CONFIG)
+        self.role_transitions = RoleTransitions.from_config(self.CONFIG)
+        self.load_guild_states()
+        self.scheduler_lease = Lease(self.store, "scheduler", self.CONFIG.get("sharding", {}).get("lease_seconds", 60))
+        self.scheduler_lease.start()
+        config_settings = self.CONFIG.get("config_reload", {})
+        if config_settings.get("enabled", True):
+            self.watch_config.change_interval(seconds=config_settings.get("poll_seconds", 5))
+            self.watch_config.start()
+        if not self.store.shared:
+            self.flush_guild_states.change_interval(seconds=self.CONFIG.get("store", {}).get("flush_seconds", 5))
+            self.flush_guild_states.start()
+        if self.store.shared:
+            self.refresh_guild_states.change_interval(seconds=self.CONFIG.get("store", {}).get("refresh_seconds", 30))
+            self.refresh_guild_states.start()
+        self.metrics_runner = await metrics.start_server(self.CONFIG)
+        self.query_api_runner = await queryapi.start_server(self, self.CONFIG)
+        if self.CONFIG.get("watchdog", {}).get("enabled", True):
+            self.watchdog = LoopWatchdog.from_config(self.CONFIG)
+            self.watchdog.start()
         
         # Start timer check loop
         self.check_timers.start()
         
         # Load extensions
         await self.load_extension('commands')
-        print("Commands loaded")
+        await self.load_extension('activity')
+        await self.load_extension('recorder')
+        logging.info("Commands loaded")
         
         # Sync commands with Discord
-        print("Syncing commands...")
+        logging.info("Syncing commands...")
         try:
             synced = await self.tree.sync()
-            print(f"Synced {len(synced)} commands")
+            logging.info("Synced %d commands", len(synced))
         except Exception as e:
-            print(f"Error syncing commands: {e}")
+            logging.error("Error syncing commands: %s", e)
         
-        print("Setup complete!")
+        logging.info("Setup complete!")
+
+    async def close(self):
+        if self.scheduler_lease is not None:
+            self.scheduler_lease.stop()
+        await super().close()
+        for state in self.guild_states.values():
+            state.flush_user_data()
+        if self.store is not None:
+            self.store.close()
 
     @commands.Cog.listener()
     async def on_member_update(self, before: discord.Member, after: discord.Member):
         """Handle role changes"""
-        if before.roles != after.roles:
+        state = self.state_for(after.guild)
+        self.role_transitions.observe(before, after)
+        if state is not None and before.roles != after.roles:
             # Find which role was added
             added_roles = set(after.roles) - set(before.roles)
+            state = state.pinned()
             for role in added_roles:
-                if role.id in [
-                    self.CONFIG["roles"]["first_success"],
-                    self.CONFIG["roles"]["second_success"],
-                    self.CONFIG["roles"]["first_jail"],
-                    self.CONFIG["roles"]["second_jail"]
-                ]:
-                    await utils.handle_role_change(after, role)
+                if role.id in state.snapshot.tracked_roles:
+                    await utils.handle_role_change(state, after, role)
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        state = self.state_for(channel.guild)
+        if state is not None:
+            state.snapshot.forget_channel(channel.id)
 
 bot = TimeBombBot()
 
 @bot.event
 async def on_ready():
-    print(f'Logged in as {bot.user}')
-    print('Syncing commands...')
+    logging.info('Logged in as %s', bot.user)
+    logging.info('Syncing commands...')
     try:
         await bot.tree.sync()
-        print('Commands synced!')
+        logging.info('Commands synced!')
     except Exception as e:
-        print(f"Error syncing commands: {e}")
-    print('Bot is ready!')
+        logging.error("Error syncing commands: %s", e)
+    logging.info('Bot is ready!')
 
 if __name__ == "__main__":
-    bot.run(TOKEN) 
\ No newline at end of file
+    log_listener = logsetup.setup_logging(logsetup.load_settings())
+    try:
+        # log_handler=None keeps discord.py from adding its own blocking handler
+        bot.run(TOKEN, log_handler=None)
+    finally:
+        log_listener.stop() 
\ No newline at end of file
@@ -0,0 +1,48 @@
+import contextlib
+import datetime
+
+class SystemClock:
+    """Wall clock time as naive UTC, matching the timestamps stored in user_data"""
+
+    def now(self) -> datetime.datetime:
+        return datetime.datetime.utcnow()
+
+class SimulatedClock:
+    """A clock that only moves when told to, for fast-forward simulations"""
+
+    def __init__(self, start: datetime.datetime = None):
+        self.current = start or datetime.datetime.utcnow()
+
+    def now(self) -> datetime.datetime:
+        return self.current
+
+    def advance(self, delta: datetime.timedelta) -> datetime.datetime:
+        self.current += delta
+        return self.current
+
+    def set(self, when: datetime.datetime) -> None:
+        if when < self.current:
+            raise ValueError("Simulated time cannot move backwards")
+        self.current = when
+
+# Shared clock, so helpers in utils don't need a bot reference
+CLOCK = SystemClock()
+
+def utcnow() -> datetime.datetime:
+    """Current time from whichever clock is installed"""
+    return CLOCK.now()
+
+def set_clock(new_clock):
+    """Install a clock and return the one it replaced"""
+    global CLOCK
+    previous, CLOCK = CLOCK, new_clock
+    return previous
+
+@contextlib.contextmanager
+def use_clock(new_clock):
+    """Run a block against a different clock, restoring the previous one afterwards"""
+    previous = set_clock(new_clock)
+    try:
+        yield new_clock
+    finally:
+        set_clock(previous)
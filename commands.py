@@ -1,53 +1,122 @@
 from discord import app_commands
 from discord.ext import commands
 import discord
-import datetime
 import logging
 import utils
+import clock
+import backfill
+import enforcement
+import asyncio
+import datetime
 import json
 import io
+import time
+from metrics import METRICS
+import gzip
+import tempfile
+from typing import Literal, Optional
+import phases
+import profiler
+import smoothing
+import tracing
+from guildstate import GuildState
+from sharding import Lease
+
+BULK_JOB_RUNNING = "Another bot process is running a bulk job on this server, try again once it finishes."
+# Longest /releaseall, /extendtimers or /enforcenow duration, 90 days
+MAX_BULK_HOURS = 2160
 
 class AdminCommands(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # guild id -> running backfill job
+        self.backfill_tasks = {}
+        # guild id -> running /releaseall, /extendtimers or /enforcenow job
+        self.bulk_tasks = {}
+
+    def state_for(self, interaction: discord.Interaction) -> GuildState:
+        """The guild a command was run in; DMs fall back to the only guild when there is just one.
+        Admin commands are guild-only, so only the member commands ever take the fallback"""
+        if interaction.guild is None and len(self.bot.guild_states) == 1:
+            return next(iter(self.bot.guild_states.values()))
+        return self.bot.state_for(interaction.guild)
+
+    @staticmethod
+    def promotions(guild: discord.Guild, state: GuildState) -> list:
+        """(success role, phase it leads to) pairs, latest phase first, for bulk timer assignment"""
+        return [
+            (guild.get_role(state.CONFIG["roles"][phase.success_role]), phase.next)
+            for phase in phases.ENGINE.newest_first if phase.next is not None
+        ]
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        interaction.extras["started"] = time.perf_counter()
+        if self.state_for(interaction) is None:
+            await interaction.response.send_message("TimeBomb isn't set up for this server.", ephemeral=True)
+            return False
+        return True
+
+    @commands.Cog.listener()
+    async def on_app_command_completion(self, interaction: discord.Interaction, command):
+        """Record how long each slash command took"""
+        started = interaction.extras.get("started")
+        if started is not None:
+            METRICS.observe("timebomb_command_seconds", time.perf_counter() - started, command=command.name, status="ok")
+
+    async def cog_app_command_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        started = interaction.extras.get("started")
+        if started is not None and interaction.command is not None:
+            METRICS.observe("timebomb_command_seconds", time.perf_counter() - started, command=interaction.command.name, status="error")
+        logging.error("Error in /%s: %s", interaction.command.name if interaction.command else '?', error, extra={"event": "command_error"})
 
     @app_commands.command(name="timer")
+    @tracing.traced
     async def timer(self, interaction: discord.Interaction):
         """Shows remaining time for your active bombs"""
+        state = self.state_for(interaction)
         user_id = str(interaction.user.id)
-        if user_id not in self.bot.user_data:
+        if user_id not in state.user_data:
             await interaction.response.send_message("You don't have any active TimeBombs.", ephemeral=True)
             return
 
-        data = self.bot.user_data[user_id]
+        data = state.user_data[user_id]
         embed = discord.Embed(title="Your TimeBomb Status", color=discord.Color.blue())
 
-        if "first_bomb_end" in data:
-            end_time = datetime.datetime.fromisoformat(data["first_bomb_end"])
-            remaining = end_time - datetime.datetime.utcnow()
+        for phase in phases.ENGINE.phases:
+            if not phase.started(data):
+                continue
+            remaining = phase.remaining(data, clock.utcnow())
             if remaining.total_seconds() > 0:
                 embed.add_field(
-                    name="First TimeBomb",
+                    name=f"{phase.title} TimeBomb",
                     value=f"Time remaining: {remaining.days}d {remaining.seconds//3600}h {(remaining.seconds//60)%60}m"
+                          f"{' (paused)' if phase.paused(data) else ''}"
                 )
+            if not phase.requirements:
+                continue
 
-        if data.get("second_bomb_active", False):
-            end_time = datetime.datetime.fromisoformat(data["second_bomb_end"])
-            remaining = end_time - datetime.datetime.utcnow()
-            if remaining.total_seconds() > 0:
-                embed.add_field(
-                    name="Second TimeBomb",
-                    value=f"Time remaining: {remaining.days}d {remaining.seconds//3600}h {(remaining.seconds//60)%60}m"
-                )
+            activity = data.get("activity", {})
+            embed.add_field(
+                name="Progress",
+                value=(
+                    f"Approved posts: {activity.get('approvals', 0)}/{utils.get_requirement_threshold(state.CONFIG, 'approvals')}\n"
+                    f"Messages: {activity.get('messages', 0)}/{utils.get_requirement_threshold(state.CONFIG, 'messages')}\n"
+                    f"Voice: {activity.get('voice_seconds', 0) // 60}/{utils.get_requirement_threshold(state.CONFIG, 'voice_seconds') // 60} minutes"
+                ),
+                inline=False
+            )
 
         await interaction.response.send_message(embed=embed, ephemeral=True)
 
     @app_commands.command(name="alltimer")
     @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
     async def alltimer(self, interaction: discord.Interaction):
         """Shows all active timers"""
-        current_time = datetime.datetime.utcnow()
-        all_users = list(self.bot.user_data.items())
+        state = self.state_for(interaction)
+        current_time = clock.utcnow()
+        all_users = list(state.user_data.items())
         
         if not all_users:
             await interaction.response.send_message("No active timers.", ephemeral=True)
@@ -58,6 +127,7 @@ class AdminCommands(commands.Cog):
         chunks = [all_users[i:i + chunk_size] for i in range(0, len(all_users), chunk_size)]
         
         for i, chunk in enumerate(chunks):
+            await tracing.checkpoint()
             embed = discord.Embed(
                 title=f"All Active TimeBombs (Page {i+1}/{len(chunks)})", 
                 color=discord.Color.blue()
@@ -69,17 +139,12 @@ class AdminCommands(commands.Cog):
                     continue
 
                 status = []
-                if "first_bomb_end" in data:
-                    end_time = datetime.datetime.fromisoformat(data["first_bomb_end"])
-                    remaining = end_time - current_time
-                    if remaining.total_seconds() > 0:
-                        status.append(f"First: {remaining.days}d {remaining.seconds//3600}h")
-
-                if data.get("second_bomb_active", False):
-                    end_time = datetime.datetime.fromisoformat(data["second_bomb_end"])
-                    remaining = end_time - current_time
-                    if remaining.total_seconds() > 0:
-                        status.append(f"Second: {remaining.days}d {remaining.seconds//3600}h")
+                for phase in phases.ENGINE.phases:
+                    if phase.started(data):
+                        remaining = phase.remaining(data, current_time)
+                        if remaining.total_seconds() > 0:
+                            status.append(f"{phase.title}: {remaining.days}d {remaining.seconds//3600}h"
+                                          f"{' (paused)' if phase.paused(data) else ''}")
 
                 if status:
                     embed.add_field(
@@ -95,16 +160,29 @@ class AdminCommands(commands.Cog):
 
     @app_commands.command(name="synctimer")
     @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
     async def synctimer(self, interaction: discord.Interaction):
         """Sync all timers and clean up invalid entries"""
+        state = self.state_for(interaction)
+        lease = self.bot.bulk_lease(state)
+        if not lease.acquire():
+            await interaction.response.send_message(BULK_JOB_RUNNING, ephemeral=True)
+            return
+        try:
+            await self.sync_timers(interaction, state)
+        finally:
+            lease.stop()
+
+    async def sync_timers(self, interaction: discord.Interaction, state: GuildState):
         await interaction.response.defer(ephemeral=True)
         
-        before_count = len(self.bot.user_data)
-        current_time = datetime.datetime.utcnow()
+        before_count = len(state.user_data)
+        current_time = clock.utcnow()
         
         # Get relevant roles
-        first_target = interaction.guild.get_role(self.bot.CONFIG["roles"]["first_success"])
-        starter_role = interaction.guild.get_role(1198697252374462564)
+        promotions = self.promotions(interaction.guild, state)
+        starter_role = interaction.guild.get_role(state.CONFIG["starter_role"])
         
         # Check all members - NO DMs
         for member in interaction.guild.members:
@@ -116,31 +194,24 @@ class AdminCommands(commands.Cog):
             
             # Scenario 1: No roles or starter role - give first timer
             if not member_roles or starter_role in member_roles:
-                end_time = current_time + datetime.timedelta(days=3)
-                self.bot.user_data[user_id] = {
-                    "join_date": current_time.isoformat(),
-                    "first_bomb_end": end_time.isoformat(),
-                    "warnings_sent": {},
-                    "second_bomb_active": False
-                }
+                first = phases.ENGINE.first
+                state.user_data[user_id] = phases.ENGINE.new_record(current_time, first, smoothing.bulk_duration(state.CONFIG, first, user_id))
                 
-            # Scenario 2: Has first target role - give second timer
-            elif first_target in member_roles:
+            # Scenario 2: Has a phase's target role - give the next phase's timer
+            else:
+                phase = next((following for role, following in promotions if role in member_roles), None)
+                if phase is None:
+                    continue
                 # Initialize user data if it doesn't exist
-                if user_id not in self.bot.user_data:
-                    self.bot.user_data[user_id] = {
+                if user_id not in state.user_data:
+                    state.user_data[user_id] = {
                         "join_date": current_time.isoformat(),
                         "warnings_sent": {},
                     }
-                
-                end_time = current_time + datetime.timedelta(days=14)
-                self.bot.user_data[user_id].update({
-                    "second_bomb_active": True,
-                    "second_bomb_end": end_time.isoformat(),
-                })
+                phase.start(state.user_data[user_id], current_time, smoothing.bulk_duration(state.CONFIG, phase, user_id))
         
-        self.bot.save_user_data()
-        after_count = len(self.bot.user_data)
+        state.save_user_data()
+        after_count = len(state.user_data)
         
         await interaction.followup.send(
             f"Timer sync complete. Total users with timers: {after_count} (Change: {after_count - before_count})",
@@ -149,57 +220,170 @@ class AdminCommands(commands.Cog):
 
     @app_commands.command(name="removetimer")
     @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
     async def removetimer(self, interaction: discord.Interaction, user: discord.Member, bomb_number: int):
         """Remove a specific timer from a user"""
-        if bomb_number not in [1, 2]:
+        state = self.state_for(interaction)
+        phase = phases.ENGINE.by_number.get(bomb_number)
+        if phase is None:
             await interaction.response.send_message(
-                "Bomb number must be 1 or 2",
+                f"Bomb number must be between 1 and {len(phases.ENGINE.phases)}",
                 ephemeral=True
             )
             return
 
         user_id = str(user.id)
-        if user_id not in self.bot.user_data:
+        if state.revive_user(user_id) is None:
             await interaction.response.send_message(
                 f"No timer found for {user.display_name}",
                 ephemeral=True
             )
             return
 
-        if bomb_number == 1:
-            if "first_bomb_end" in self.bot.user_data[user_id]:
-                del self.bot.user_data[user_id]["first_bomb_end"]
-                if "first_bomb_failed" in self.bot.user_data[user_id]:
-                    del self.bot.user_data[user_id]["first_bomb_failed"]
-        else:
-            if self.bot.user_data[user_id].get("second_bomb_active", False):
-                self.bot.user_data[user_id]["second_bomb_active"] = False
-                if "second_bomb_end" in self.bot.user_data[user_id]:
-                    del self.bot.user_data[user_id]["second_bomb_end"]
-                if "second_bomb_failed" in self.bot.user_data[user_id]:
-                    del self.bot.user_data[user_id]["second_bomb_failed"]
-
-        self.bot.save_user_data()
+        phase.clear(state.user_data[user_id])
+
+        await tracing.checkpoint()
+        state.save_user_data()
         
         await interaction.response.send_message(
             f"Removed bomb {bomb_number} from {user.display_name}",
             ephemeral=True
         )
 
+    async def reject_phase(self, interaction: discord.Interaction, phase_number: Optional[int]) -> bool:
+        """Reply and return True when a phase option names no phase"""
+        if phase_number is None or phase_number in phases.ENGINE.by_number:
+            return False
+        await interaction.response.send_message(
+            f"Phase must be between 1 and {len(phases.ENGINE.phases)}",
+            ephemeral=True
+        )
+        return True
+
+    def running_timer(self, state: GuildState, user: discord.Member):
+        """(data, phase) for a user's running or paused timer, or (None, None)"""
+        data = state.user_data.get(str(user.id))
+        phase = phases.ENGINE.current(data) if data is not None else None
+        if phase is None or phase.failed(data):
+            return None, None
+        return data, phase
+
+    @app_commands.command(name="pausetimer")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def pausetimer(self, interaction: discord.Interaction, user: discord.Member):
+        """Freeze a user's timer until /resumetimer"""
+        state = self.state_for(interaction)
+        data, phase = self.running_timer(state, user)
+        if phase is None or phase.paused(data):
+            await interaction.response.send_message(f"No running timer found for {user.display_name}", ephemeral=True)
+            return
+
+        left = phase.pause(data, clock.utcnow())
+        # Only this user is written, which re-keys their place in the deadline index
+        state.save_user_data([str(user.id)])
+        await interaction.response.send_message(
+            f"Paused {user.display_name}'s {phase.title.lower()} timer with {utils.format_duration(left)} left",
+            ephemeral=True
+        )
+
+    @app_commands.command(name="resumetimer")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def resumetimer(self, interaction: discord.Interaction, user: discord.Member):
+        """Start a paused timer again with the time it had left"""
+        state = self.state_for(interaction)
+        data, phase = self.running_timer(state, user)
+        if phase is None or not phase.paused(data):
+            await interaction.response.send_message(f"No paused timer found for {user.display_name}", ephemeral=True)
+            return
+
+        end_time = phase.resume(data, clock.utcnow())
+        state.save_user_data([str(user.id)])
+        await interaction.response.send_message(
+            f"Resumed {user.display_name}'s {phase.title.lower()} timer, it now ends {end_time.strftime('%Y-%m-%d %H:%M')} UTC",
+            ephemeral=True
+        )
+
+    @app_commands.command(name="extendtimer")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def extendtimer(self, interaction: discord.Interaction, user: discord.Member, hours: app_commands.Range[int, 1, MAX_BULK_HOURS]):
+        """Give a user's timer extra hours, paused or not"""
+        state = self.state_for(interaction)
+        data, phase = self.running_timer(state, user)
+        if phase is None:
+            await interaction.response.send_message(f"No running timer found for {user.display_name}", ephemeral=True)
+            return
+
+        left = phase.extend(data, datetime.timedelta(hours=hours), clock.utcnow())
+        state.save_user_data([str(user.id)])
+        await interaction.response.send_message(
+            f"Gave {user.display_name} {hours} more hours, {utils.format_duration(left)} left",
+            ephemeral=True
+        )
+
+    @app_commands.command(name="pauseall")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def pauseall(self, interaction: discord.Interaction, phase: Optional[int] = None, role: Optional[discord.Role] = None):
+        """Freeze every running timer, or those in a phase or with a role, e.g. during an outage"""
+        await self.run_pause_job(interaction, enforcement.pause_all, "Paused", phase, role)
+
+    @app_commands.command(name="resumeall")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def resumeall(self, interaction: discord.Interaction, phase: Optional[int] = None, role: Optional[discord.Role] = None):
+        """Start every paused timer, or those in a phase or with a role, again"""
+        await self.run_pause_job(interaction, enforcement.resume_all, "Resumed", phase, role)
+
+    async def run_pause_job(self, interaction: discord.Interaction, job, verb: str, phase_number: Optional[int], role: Optional[discord.Role]):
+        state = self.state_for(interaction)
+        if await self.reject_phase(interaction, phase_number):
+            return
+        lease = self.bot.bulk_lease(state)
+        if not lease.acquire():
+            await interaction.response.send_message(BULK_JOB_RUNNING, ephemeral=True)
+            return
+        try:
+            count = job(state, interaction.guild, phases.ENGINE.by_number.get(phase_number), role)
+        finally:
+            lease.stop()
+        await interaction.response.send_message(f"{verb} {count} timers", ephemeral=True)
+
     @app_commands.command(name="resetserver")
     @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
     async def resetserver(self, interaction: discord.Interaction):
         """Reset all timers and start fresh for the entire server"""
+        state = self.state_for(interaction)
+        lease = self.bot.bulk_lease(state)
+        if not lease.acquire():
+            await interaction.response.send_message(BULK_JOB_RUNNING, ephemeral=True)
+            return
+        try:
+            await self.reset_server(interaction, state)
+        finally:
+            lease.stop()
+
+    async def reset_server(self, interaction: discord.Interaction, state: GuildState):
         await interaction.response.defer(ephemeral=True)
         
-        before_count = len(self.bot.user_data)
-        current_time = datetime.datetime.utcnow()
+        before_count = len(state.user_data)
+        current_time = clock.utcnow()
         
-        self.bot.user_data.clear()
+        state.user_data.clear()
         
         # Get relevant roles
-        first_target = interaction.guild.get_role(self.bot.CONFIG["roles"]["first_success"])
-        starter_role = interaction.guild.get_role(1198697252374462564)
+        promotions = self.promotions(interaction.guild, state)
+        starter_role = interaction.guild.get_role(state.CONFIG["starter_role"])
         
         # Process all members - NO DMs
         for member in interaction.guild.members:
@@ -210,25 +394,14 @@ class AdminCommands(commands.Cog):
             member_roles = member.roles
             
             if not member_roles or starter_role in member_roles:
-                end_time = current_time + datetime.timedelta(days=3)
-                self.bot.user_data[user_id] = {
-                    "join_date": current_time.isoformat(),
-                    "first_bomb_end": end_time.isoformat(),
-                    "warnings_sent": {},
-                    "second_bomb_active": False
-                }
-                
-            elif first_target in member_roles:
-                end_time = current_time + datetime.timedelta(days=14)
-                self.bot.user_data[user_id] = {
-                    "join_date": current_time.isoformat(),
-                    "second_bomb_active": True,
-                    "second_bomb_end": end_time.isoformat(),
-                    "warnings_sent": {}
-                }
+                phase = phases.ENGINE.first
+            else:
+                phase = next((following for role, following in promotions if role in member_roles), None)
+            if phase is not None:
+                state.user_data[user_id] = phases.ENGINE.new_record(current_time, phase, smoothing.bulk_duration(state.CONFIG, phase, user_id))
         
-        self.bot.save_user_data()
-        after_count = len(self.bot.user_data)
+        state.save_user_data()
+        after_count = len(state.user_data)
         
         await interaction.followup.send(
             f"Server reset complete! All timers have been reset.\n"
@@ -237,19 +410,239 @@ class AdminCommands(commands.Cog):
             ephemeral=True
         )
 
+    @app_commands.command(name="backfill")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def backfill(self, interaction: discord.Interaction):
+        """Count past general chat messages for users already in the second phase"""
+        state = self.state_for(interaction)
+        channel = state.channel("general_channel")
+        if channel is None:
+            await interaction.response.send_message("Message counting is not enabled.", ephemeral=True)
+            return
+
+        running = self.backfill_tasks.get(state.guild_id)
+        if running and not running.done():
+            await interaction.response.send_message("A backfill is already running.", ephemeral=True)
+            return
+
+        lease = self.bot.bulk_lease(state)
+        if not lease.start():
+            lease.stop()
+            await interaction.response.send_message(BULK_JOB_RUNNING, ephemeral=True)
+            return
+
+        resuming = backfill.load_checkpoint(state.checkpoint_file) is not None
+        self.backfill_tasks[state.guild_id] = asyncio.create_task(self.run_backfill(state, channel, lease))
+
+        await interaction.response.send_message(
+            f"{'Resuming' if resuming else 'Started'} message backfill for {channel.mention}. "
+            "Results will be posted in the log channel.",
+            ephemeral=True
+        )
+
+    async def run_backfill(self, state: GuildState, channel: discord.TextChannel, lease: Lease):
+        """Run a backfill job in the background and report the result"""
+        log_channel = state.log_channel
+        try:
+            result = await backfill.run_backfill(state, channel)
+        except Exception as e:
+            logging.error("Error in message backfill: %s", e, extra={"event": "backfill"})
+            if log_channel:
+                await log_channel.send(f"❌ Message backfill stopped: {e}. Run /backfill again to resume.")
+            return
+        finally:
+            lease.stop()
+
+        if log_channel:
+            await log_channel.send(
+                f"✅ Message backfill complete: scanned {result['scanned']} messages, "
+                f"counted {result['counted']} for {result['users']} users."
+            )
+
+    @app_commands.command(name="releaseall")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def releaseall(self, interaction: discord.Interaction, phase: Optional[int] = None, role: Optional[discord.Role] = None,
+                         hours: Optional[app_commands.Range[int, 1, MAX_BULK_HOURS]] = None):
+        """Release every jailed member in a phase or with a role, with a new timer of the given hours or the usual length"""
+        duration = datetime.timedelta(hours=hours) if hours else None
+        await self.start_bulk_job(interaction, "/releaseall", enforcement.release_all, phase, role, duration)
+
+    @app_commands.command(name="extendtimers")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def extendtimers(self, interaction: discord.Interaction, hours: app_commands.Range[int, 1, MAX_BULK_HOURS],
+                           phase: Optional[int] = None, role: Optional[discord.Role] = None):
+        """Give every running timer in a phase or with a role extra hours"""
+        await self.start_bulk_job(interaction, "/extendtimers", enforcement.extend_timers, phase, role, datetime.timedelta(hours=hours))
+
+    @app_commands.command(name="enforcenow")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def enforcenow(self, interaction: discord.Interaction, phase: Optional[int] = None, role: Optional[discord.Role] = None,
+                         hours: app_commands.Range[int, 0, MAX_BULK_HOURS] = 0):
+        """Jail everyone in a phase or with a role whose timer runs out within the given hours, now"""
+        await self.start_bulk_job(interaction, "/enforcenow", enforcement.enforce_now, phase, role, datetime.timedelta(hours=hours))
+
+    async def start_bulk_job(self, interaction: discord.Interaction, title: str, job, phase_number: Optional[int],
+                             role: Optional[discord.Role], duration: Optional[datetime.timedelta]):
+        """Validate a bulk command and run it in the background under the guild's bulk lease"""
+        state = self.state_for(interaction)
+        if await self.reject_phase(interaction, phase_number):
+            return
+        phase = phases.ENGINE.by_number.get(phase_number)
+
+        running = self.bulk_tasks.get(state.guild_id)
+        if running and not running.done():
+            await interaction.response.send_message("A bulk job is already running.", ephemeral=True)
+            return
+
+        lease = self.bot.bulk_lease(state)
+        if not lease.start():
+            lease.stop()
+            await interaction.response.send_message(BULK_JOB_RUNNING, ephemeral=True)
+            return
+
+        progress = enforcement.Progress(state.log_channel, title)
+        self.bulk_tasks[state.guild_id] = asyncio.create_task(
+            self.run_bulk_job(state.pinned(), interaction.guild, job, phase, role, duration, progress, lease)
+        )
+        await interaction.response.send_message(f"Started {title}. Progress will be posted in the log channel.", ephemeral=True)
+
+    async def run_bulk_job(self, state, guild: discord.Guild, job, phase, role, duration, progress: enforcement.Progress, lease: Lease):
+        """Run a bulk job in the background and report how it ended"""
+        try:
+            await job(state, guild, phase, role, duration, progress)
+        except Exception as e:
+            logging.exception("Error in %s: %s", progress.title, e, extra={"event": "bulk_job"})
+            await progress.report(f"❌ Stopped ({e}).")
+            return
+        finally:
+            lease.stop()
+        await progress.report("✅")
+
+    @app_commands.command(name="archived")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def archived(self, interaction: discord.Interaction, user: discord.User):
+        """Look up a jailed, completed or departed user in the archive"""
+        state = self.state_for(interaction)
+        with tracing.span("archive_lookup"):
+            record = state.archive.lookup(str(user.id))
+        if record is None:
+            await interaction.response.send_message(f"No archived record for {user.display_name}", ephemeral=True)
+            return
+
+        embed = discord.Embed(title=f"Archived: {user.display_name}", color=discord.Color.greyple())
+        embed.add_field(name="Status", value=record["status"].capitalize())
+        embed.add_field(name="Archived", value=record["archived_at"][:16].replace("T", " ") + " UTC")
+        embed.description = f"```json\n{json.dumps(record['data'], indent=2)[:3900]}\n```"
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="exportarchive")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def exportarchive(self, interaction: discord.Interaction):
+        """Export every archived user record"""
+        state = self.state_for(interaction)
+        await interaction.response.defer(ephemeral=True)
+
+        def write_export():
+            # Streamed to disk, so the whole archive is never held in memory at once
+            out = tempfile.TemporaryFile()
+            with gzip.open(out, 'wt') as f:
+                for record in state.archive.export():
+                    f.write(json.dumps(record) + "\n")
+            out.seek(0)
+            return out
+
+        with tracing.span("archive_export"):
+            # Reading and compressing a large archive would hold up the gateway loop
+            out = await asyncio.to_thread(write_export)
+        file = discord.File(out, filename=f"archive_{clock.utcnow().strftime('%Y%m%d_%H%M%S')}.jsonl.gz")
+        await interaction.followup.send("Here's the user archive:", file=file, ephemeral=True)
+
+    @app_commands.command(name="loopstats")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def loopstats(self, interaction: discord.Interaction):
+        """Show event loop lag and the most recent stalls"""
+        watchdog = self.bot.watchdog
+        if watchdog is None:
+            await interaction.response.send_message("The loop watchdog is disabled.", ephemeral=True)
+            return
+
+        stats = watchdog.stats()
+        embed = discord.Embed(title="Event Loop Lag", color=discord.Color.blue())
+        embed.add_field(name="p50", value=f"{stats['p50'] * 1000:.1f}ms")
+        embed.add_field(name="p99", value=f"{stats['p99'] * 1000:.1f}ms")
+        embed.add_field(name="Max", value=f"{stats['max'] * 1000:.1f}ms")
+        embed.set_footer(text=f"{stats['count']} samples every {watchdog.interval}s")
+
+        for stall in list(watchdog.stalls)[-3:]:
+            # The innermost frames point at the handler that held the loop
+            stack = stall["stack"][-900:]
+            embed.add_field(
+                name=f"Stall {stall['duration']:.2f}s at {stall['at'][:19].replace('T', ' ')} UTC",
+                value=f"```{stack}```",
+                inline=False
+            )
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @app_commands.command(name="profile")
+    @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
+    async def profile(self, interaction: discord.Interaction, seconds: app_commands.Range[int, 1, profiler.MAX_SECONDS] = 30,
+                      mode: Literal["sampling", "cprofile"] = "sampling", allocations: bool = False):
+        """Profile the running bot and send flamegraph-ready results"""
+        if profiler.is_running():
+            await interaction.response.send_message("A profile is already running.", ephemeral=True)
+            return
+
+        await interaction.response.defer(ephemeral=True)
+        try:
+            result = await profiler.run_profile(seconds, mode, allocations)
+        except RuntimeError as e:
+            await interaction.followup.send(f"❌ Could not profile: {e}", ephemeral=True)
+            return
+
+        hottest = "\n".join(f"{count:>6} {frame}" for frame, count in result["top_frames"])
+        file = discord.File(
+            io.BytesIO(result["archive"]),
+            filename=f"profile_{clock.utcnow().strftime('%Y%m%d_%H%M%S')}.zip"
+        )
+        await interaction.followup.send(
+            f"Profiled for {result['seconds']:.0f}s ({result['samples']} samples). Hottest frames:\n```{hottest[:1800]}```",
+            file=file,
+            ephemeral=True
+        )
+
     @app_commands.command(name="getdata")
     @app_commands.default_permissions(administrator=True)
+    @app_commands.guild_only()
+    @tracing.traced
     async def getdata(self, interaction: discord.Interaction):
         """Get current user data"""
+        state = self.state_for(interaction)
         await interaction.response.defer(ephemeral=True)
         
         # Convert data to JSON string with pretty formatting
-        data_str = json.dumps(self.bot.user_data, indent=4)
+        data_str = json.dumps(state.user_data, indent=4)
         
         # Create file object
         file = discord.File(
             io.StringIO(data_str),
-            filename=f"user_data_{datetime.datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
+            filename=f"user_data_{clock.utcnow().strftime('%Y%m%d_%H%M%S')}.json"
         )
         
         # Send file
@@ -0,0 +1,204 @@
+import discord
+import datetime
+import logging
+import time
+from typing import Optional
+import utils
+import clock
+import phases
+
+# How often a running bulk job edits its progress message
+PROGRESS_SECONDS = 5.0
+
+class Progress:
+    """A bulk job's progress, kept up to date in a single log channel message"""
+
+    def __init__(self, channel, title: str, interval: float = PROGRESS_SECONDS):
+        self.channel = channel
+        self.title = title
+        self.interval = interval
+        self.total = 0
+        self.done = 0
+        self.failed = 0
+        self.message = None
+        self.reported = 0.0
+
+    async def begin(self, total: int) -> None:
+        self.total = total
+        await self.report()
+
+    async def step(self, ok: bool = True) -> None:
+        self.done += 1
+        if not ok:
+            self.failed += 1
+        if time.monotonic() - self.reported >= self.interval:
+            await self.report()
+
+    async def report(self, outcome: str = None) -> None:
+        """Post or update the progress message; `outcome` marks the job as over"""
+        self.reported = time.monotonic()
+        text = f"{self.title}: {self.done}/{self.total} members"
+        if self.failed:
+            text += f", {self.failed} failed"
+        text = f"{outcome} {text}" if outcome else f"⏳ {text}"
+        if self.channel is None:
+            return
+        try:
+            if self.message is None:
+                self.message = await self.channel.send(text)
+            else:
+                await self.message.edit(content=text)
+        except discord.HTTPException as e:
+            logging.warning("Could not report bulk job progress: %s", e, extra={"event": "bulk_job"})
+
+def selected_phases(phase: Optional[phases.Phase]) -> tuple:
+    return (phase,) if phase is not None else phases.ENGINE.phases
+
+def role_holders(guild: discord.Guild, role: Optional[discord.Role]) -> Optional[set]:
+    """Ids of the members with a role, or None when there's no role filter"""
+    if role is None:
+        return None
+    return {member.id for member in guild.members if role in member.roles}
+
+def running_targets(bot, guild: discord.Guild, phase: Optional[phases.Phase], role: Optional[discord.Role],
+                    until: datetime.datetime) -> list:
+    """(user id, data, phase) for running TimeBombs that go off by `until`, read from the deadline index"""
+    holders = role_holders(guild, role)
+    targets = []
+    for user_id, data in bot.due_users(until):
+        live = phases.ENGINE.live(data)
+        if phase is not None and live is not phase:
+            continue
+        if holders is not None and int(user_id) not in holders:
+            continue
+        targets.append((user_id, data, live))
+    return targets
+
+def jailed_targets(bot, guild: discord.Guild, phase: Optional[phases.Phase], role: Optional[discord.Role]) -> list:
+    """(member, phase) for jailed members
+
+    Jailed users sit in the cold archive rather than the deadline index, so
+    they are found through the jail roles instead.
+    """
+    holders = role_holders(guild, role)
+    jail_roles = {}
+    for candidate in selected_phases(phase):
+        jail_role = guild.get_role(bot.CONFIG["roles"][candidate.jail_role])
+        if jail_role is not None:
+            jail_roles[jail_role] = candidate
+    targets = []
+    for member in guild.members:
+        if member.bot or (holders is not None and member.id not in holders):
+            continue
+        # A member in two jails is released from the later one
+        jailed = [candidate for jail_role, candidate in jail_roles.items() if jail_role in member.roles]
+        if jailed:
+            targets.append((member, max(jailed, key=lambda candidate: candidate.number)))
+    return targets
+
+async def run_actions(bot, progress: Progress, actions) -> None:
+    """Send each member's role edits and DMs, a bounded number at a time and paced like the sweep"""
+
+    async def run(action):
+        await bot.dispatch_limiter.wait()
+        try:
+            await action
+            ok = True
+        except discord.HTTPException as e:
+            logging.warning("Bulk job action failed: %s", e, extra={"event": "bulk_job"})
+            ok = False
+        await progress.step(ok)
+
+    await bot.role_transitions.run_batch(run(action) for action in actions)
+
+async def release_all(bot, guild: discord.Guild, phase: Optional[phases.Phase], role: Optional[discord.Role],
+                      duration: Optional[datetime.timedelta], progress: Progress) -> dict:
+    """Let every matching jailed member out with a fresh TimeBomb, the phase's usual length unless `duration` is given"""
+    targets = jailed_targets(bot, guild, phase, role)
+    await progress.begin(len(targets))
+
+    # Every new timer lands in one save, before any role or DM goes out
+    current_time = clock.utcnow()
+    with bot.archive.batched():
+        for member, jailed in targets:
+            utils.restart_released_user(bot, str(member.id), jailed, current_time, duration)
+    bot.save_user_data()
+
+    async def release(member, jailed):
+        jail_role = guild.get_role(bot.CONFIG["roles"][jailed.jail_role])
+        await bot.role_transitions.apply(member, remove=[jail_role], reason="Released from jail in bulk")
+        await utils.send_release_message(member)
+
+    await run_actions(bot, progress, (release(member, jailed) for member, jailed in targets))
+    logging.info("Released %d members from jail", len(targets), extra={"event": "bulk_job"})
+    return {"members": len(targets), "failed": progress.failed}
+
+async def extend_timers(bot, guild: discord.Guild, phase: Optional[phases.Phase], role: Optional[discord.Role],
+                        duration: datetime.timedelta, progress: Progress) -> dict:
+    """Give every matching running TimeBomb `duration` more time"""
+    current_time = clock.utcnow()
+    targets = running_targets(bot, guild, phase, role, datetime.datetime.max)
+    await progress.begin(len(targets))
+
+    end_times = {user_id: current_time + live.extend(data, duration, current_time) for user_id, data, live in targets}
+    bot.save_user_data()
+
+    async def notify(user_id):
+        member = guild.get_member(int(user_id))
+        if member is not None:
+            await utils.send_extension_message(member, end_times[user_id])
+
+    await run_actions(bot, progress, (notify(user_id) for user_id in end_times))
+    logging.info("Extended %d TimeBombs by %s", len(targets), duration, extra={"event": "bulk_job"})
+    return {"members": len(targets), "failed": progress.failed}
+
+async def enforce_now(bot, guild: discord.Guild, phase: Optional[phases.Phase], role: Optional[discord.Role],
+                      duration: datetime.timedelta, progress: Progress) -> dict:
+    """Jail every matching user whose TimeBomb goes off within `duration`, without waiting for the sweep"""
+    current_time = clock.utcnow()
+    targets = running_targets(bot, guild, phase, role, current_time + duration)
+    await progress.begin(len(targets))
+
+    # Mark and archive everyone in one save, so the sweep can't jail them a second time
+    for user_id, data, live in targets:
+        data[live.failed_key] = True
+    bot.archive_users([user_id for user_id, _, _ in targets], "jailed")
+    bot.save_user_data()
+
+    dispatch = bot.snapshot.dispatch
+    await run_actions(bot, progress, (
+        dispatch[(live.number, "deadline")](bot, guild, int(user_id), live) for user_id, _, live in targets
+    ))
+    logging.info("Enforced %d TimeBombs early", len(targets), extra={"event": "bulk_job"})
+    return {"members": len(targets), "failed": progress.failed}
+
+def pause_all(bot, guild: discord.Guild, phase: Optional[phases.Phase], role: Optional[discord.Role]) -> int:
+    """Pause every matching running TimeBomb, say while the server is down, in one save"""
+    current_time = clock.utcnow()
+    targets = running_targets(bot, guild, phase, role, datetime.datetime.max)
+    for _, data, live in targets:
+        live.pause(data, current_time)
+    bot.save_user_data()
+    logging.info("Paused %d TimeBombs", len(targets), extra={"event": "bulk_job"})
+    return len(targets)
+
+def resume_all(bot, guild: discord.Guild, phase: Optional[phases.Phase], role: Optional[discord.Role]) -> int:
+    """Resume every matching paused TimeBomb in one save
+
+    Paused TimeBombs have no deadline, so they aren't in the deadline index
+    and everyone is looked at.
+    """
+    current_time = clock.utcnow()
+    holders = role_holders(guild, role)
+    resumed = 0
+    for user_id, data in bot.user_data.items():
+        paused = phases.ENGINE.current(data)
+        if paused is None or not paused.paused(data) or (phase is not None and paused is not phase):
+            continue
+        if holders is not None and int(user_id) not in holders:
+            continue
+        paused.resume(data, current_time)
+        resumed += 1
+    bot.save_user_data()
+    logging.info("Resumed %d TimeBombs", resumed, extra={"event": "bulk_job"})
+    return resumed
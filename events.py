@@ -1,7 +1,9 @@
 import discord
 from discord.ext import commands
-import datetime
 import logging
+import utils
+import clock
+import phases
 
 class EventHandlers(commands.Cog):
     def __init__(self, bot):
@@ -10,43 +12,44 @@ class EventHandlers(commands.Cog):
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
         """Handle new member joins"""
-        if member.guild.id != self.bot.CONFIG["guild_id"]:
+        state = self.bot.state_for(member.guild)
+        if state is None:
             return
 
-        # Set up first bomb timer
-        end_time = datetime.datetime.utcnow() + datetime.timedelta(days=3)
-        
-        # Store user data
-        self.bot.user_data[str(member.id)] = {
-            "join_date": datetime.datetime.utcnow().isoformat(),
-            "first_bomb_end": end_time.isoformat(),
-            "warnings_sent": {},
-            "second_bomb_active": False
-        }
-        self.bot.save_user_data()
+        # Returning members pick up where they left off
+        tombstone = state.tombstones.pop(str(member.id))
+        if tombstone:
+            await utils.restore_returning_member(state, member, tombstone)
+            return
+
+        # Set up first bomb timer and store user data
+        first = phases.ENGINE.first
+        data = state.user_data[str(member.id)] = phases.ENGINE.new_record(clock.utcnow())
+        end_time = first.deadline(data)
+        state.save_user_data()
 
         # Send welcome message
         welcome_embed = discord.Embed(
             title="🎯 Welcome to Your First TimeBomb!",
             description=(
                 "Welcome to our community! You're now on your first TimeBomb challenge.\n\n"
-                "⏰ You have 3 days to complete these requirements:\n\n"
+                f"⏰ You have {first.days} days to complete these requirements:\n\n"
                 "1️⃣ Create an Instagram account following our course rules\n"
                 "2️⃣ Verify your account by opening a ticket\n"
                 "3️⃣ Introduce yourself in general chat\n\n"
                 "💡 Use /timer to check your remaining time!\n\n"
-                "⚠️ Important: Failing to complete these requirements within 3 days "
+                f"⚠️ Important: Failing to complete these requirements within {first.days} days "
                 "will result in being moved to jail until requirements are met."
             ),
             color=discord.Color.blue()
         )
-        welcome_embed.set_footer(text=f"Time started: {datetime.datetime.utcnow()} UTC")
+        welcome_embed.set_footer(text=f"Time started: {clock.utcnow()} UTC")
 
         try:
             await member.send(embed=welcome_embed)
             
             # Log the event
-            log_channel = self.bot.get_channel(self.bot.CONFIG["log_channel"])
+            log_channel = state.log_channel
             if log_channel:
                 log_embed = discord.Embed(
                     title="TimeBomb Assigned",
@@ -56,20 +59,21 @@ class EventHandlers(commands.Cog):
                 log_embed.add_field(name="End Time", value=end_time.strftime("%Y-%m-%d %H:%M UTC"))
                 await log_channel.send(embed=log_embed)
                 
-            logging.info(f"First TimeBomb assigned to user {member.id}")
+            logging.info("First TimeBomb assigned to user %s", member.id, extra={"user_id": member.id, "phase": 1, "event": "phase_started"})
             
         except discord.Forbidden:
-            logging.warning(f"Could not send welcome message to user {member.id}")
+            logging.warning("Could not send welcome message to user %s", member.id, extra={"user_id": member.id, "event": "dm_failed"})
 
     @commands.Cog.listener()
     async def on_member_remove(self, member: discord.Member):
         """Handle member leaves"""
-        if member.guild.id != self.bot.CONFIG["guild_id"]:
+        state = self.bot.state_for(member.guild)
+        if state is None:
             return
 
-        if str(member.id) in self.bot.user_data:
+        if str(member.id) in state.user_data:
             # Log the event
-            log_channel = self.bot.get_channel(self.bot.CONFIG["log_channel"])
+            log_channel = state.log_channel
             if log_channel:
                 log_embed = discord.Embed(
                     title="Member Left During TimeBomb",
@@ -78,11 +82,10 @@ class EventHandlers(commands.Cog):
                 )
                 await log_channel.send(embed=log_embed)
                 
-            logging.info(f"User {member.id} left during TimeBomb period")
+            logging.info("User %s left during TimeBomb period", member.id, extra={"user_id": member.id, "event": "member_left"})
             
-            # Clean up user data
-            del self.bot.user_data[str(member.id)]
-            self.bot.save_user_data()
+            # Keep a tombstone so rejoining resumes the same timer
+            utils.handle_member_leave(state, member)
 
 async def setup(bot):
     await bot.add_cog(EventHandlers(bot)) 
\ No newline at end of file
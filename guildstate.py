@@ -0,0 +1,210 @@
+import datetime
+import logging
+import os
+from typing import Optional
+import backfill
+import clock
+import storage
+import tracing
+from liveconfig import ConfigSnapshot
+from metrics import METRICS
+from storage import ColdArchive
+from stores import JsonPartition
+from tombstones import TombstoneIndex
+
+# Data files of the guild in the top-level config, kept where they always were
+DATA_FILE = "/data/persistent_user_data.json"
+
+# Every other guild gets its own directory under here
+GUILDS_DIR = "/data/guilds"
+
+def guild_configs(config: dict) -> dict:
+    """Per-guild settings: top-level keys are the defaults, entries under "guilds" override them"""
+    defaults = {key: value for key, value in config.items() if key != "guilds"}
+    configs = {}
+    if defaults.get("guild_id"):
+        configs[int(defaults["guild_id"])] = defaults
+    for guild_id, overrides in config.get("guilds", {}).items():
+        merged = dict(configs.get(int(guild_id), defaults))
+        merged.update(overrides)
+        merged["guild_id"] = int(guild_id)
+        configs[int(guild_id)] = merged
+    return configs
+
+def data_file(guild_id: int, primary: bool) -> str:
+    """A guild's JSON data file; the primary guild keeps the original /data layout"""
+    if primary:
+        return DATA_FILE
+    return os.path.join(GUILDS_DIR, str(guild_id), "persistent_user_data.json")
+
+def guild_archive(guild_id: int, primary: bool) -> ColdArchive:
+    """A guild's cold archive, in the same place as its data file"""
+    if primary:
+        return ColdArchive()
+    directory = os.path.join(GUILDS_DIR, str(guild_id))
+    return ColdArchive(os.path.join(directory, "archive.jsonl.gz"), os.path.join(directory, "archive_index.json"))
+
+class GuildState:
+    """One guild's config and TimeBomb data
+
+    Helpers that take a `bot` are handed a GuildState instead, so CONFIG,
+    user_data and saves are always the guild's own; anything else (channels,
+    guilds, the HTTP client) falls through to the bot.
+    """
+
+    def __init__(self, bot, config: dict, partition=None, archive: ColdArchive = None,
+                 tombstone_index: TombstoneIndex = None, checkpoint_file: str = None):
+        self.bot = bot
+        # Swapped whole on a config reload
+        self.snapshot = ConfigSnapshot(config)
+        self.guild_id = config["guild_id"]
+        self.user_data = {}
+        self.partition = partition or JsonPartition(DATA_FILE)
+        self.archive = archive or ColdArchive()
+        self.tombstones = tombstone_index or TombstoneIndex(config)
+        self.checkpoint_file = checkpoint_file or backfill.CHECKPOINT_FILE
+        # Set while the sweep works on a guild whose shard runs in another process
+        self.remote_guild = None
+        # Bumped whenever this guild's data changes in memory, with when it last did
+        self.version = 0
+        self.modified = clock.utcnow()
+
+    @classmethod
+    def for_guild(cls, bot, config: dict, primary: bool, backend) -> "GuildState":
+        """The primary guild keeps the original /data layout; others are partitioned by guild id"""
+        guild_id = config["guild_id"]
+        if primary:
+            backend.import_json(guild_id, DATA_FILE)
+            return cls(bot, config, partition=backend.partition(guild_id, DATA_FILE))
+
+        directory = os.path.join(GUILDS_DIR, str(guild_id))
+        path = data_file(guild_id, primary)
+        backend.import_json(guild_id, path)
+        return cls(
+            bot, config,
+            partition=backend.partition(guild_id, path),
+            archive=guild_archive(guild_id, primary),
+            tombstone_index=TombstoneIndex(config, os.path.join(directory, "tombstones.json"),
+                                           os.path.join(directory, "tombstones.bloom")),
+            checkpoint_file=os.path.join(directory, "backfill_checkpoint.json")
+        )
+
+    def __getattr__(self, name):
+        return getattr(self.bot, name)
+
+    @property
+    def CONFIG(self) -> dict:
+        return self.snapshot.config
+
+    def channel(self, key: str):
+        return self.snapshot.channel(self.bot, key)
+
+    @property
+    def log_channel(self):
+        return self.channel("log_channel")
+
+    def pinned(self) -> "PinnedState":
+        """This state with its current config held fixed, for work that shouldn't see a reload halfway through"""
+        return PinnedState(self, self.snapshot)
+
+    def get_guild(self, guild_id: int):
+        guild = self.bot.get_guild(guild_id)
+        if guild is None and guild_id == self.guild_id:
+            return self.remote_guild
+        return guild
+
+    def load_user_data(self):
+        """Load this guild's user data"""
+        try:
+            with METRICS.timer("timebomb_load_user_data_seconds"):
+                self.user_data = self.partition.load()
+            logging.info("Loaded %d users for guild %s", len(self.user_data), self.guild_id, extra={"event": "data_loaded", "guild_id": self.guild_id})
+        except FileNotFoundError:
+            logging.info("No existing data found for guild %s, starting fresh", self.guild_id, extra={"event": "data_loaded", "guild_id": self.guild_id})
+            self.user_data = {}
+        except Exception as e:
+            logging.error("Error loading data: %s", e, extra={"event": "data_error", "guild_id": self.guild_id})
+            self.user_data = {}
+
+        # Jailed users from older data files belong in the cold archive
+        jailed = [user_id for user_id, data in self.user_data.items() if storage.is_jailed(data)]
+        if jailed:
+            self.archive_users(jailed, "jailed")
+            self.save_user_data()
+            logging.info("Moved %d jailed users to the archive", len(jailed), extra={"event": "archived", "guild_id": self.guild_id})
+
+    @tracing.span("archive_users")
+    def archive_users(self, user_ids: list, status: str):
+        """Move users out of the hot set into the cold archive"""
+        self.archive.append([(user_id, status, self.user_data.pop(user_id)) for user_id in user_ids])
+
+    @tracing.span("revive_user")
+    def revive_user(self, user_id: str) -> Optional[dict]:
+        """Return a user's record, pulling a jailed user back from the archive"""
+        data = self.user_data.get(user_id)
+        if data is None:
+            record = self.archive.lookup(user_id)
+            if record and record["status"] == "jailed":
+                data = self.user_data[user_id] = record["data"]
+                self.archive.forget(user_id)
+        return data
+
+    @tracing.span("save_user_data")
+    def save_user_data(self, user_ids: list = None):
+        """Save this guild's user data, leaving every other guild's data alone; `user_ids` saves just those users"""
+        # Records are changed in place before every save, so this counts as a change even if the write fails
+        self.touch()
+        try:
+            with METRICS.timer("timebomb_save_user_data_seconds"):
+                self.partition.save(self.user_data, user_ids)
+            logging.debug("User data saved for guild %s", self.guild_id, extra={"event": "data_saved", "guild_id": self.guild_id})
+        except Exception as e:
+            logging.error("Error saving to persistent storage: %s", e, extra={"event": "data_error", "guild_id": self.guild_id})
+
+    def flush_user_data(self):
+        """Write single-user saves the store has held back, see JsonPartition"""
+        try:
+            with METRICS.timer("timebomb_save_user_data_seconds"):
+                self.partition.flush(self.user_data)
+        except Exception as e:
+            logging.error("Error saving to persistent storage: %s", e, extra={"event": "data_error", "guild_id": self.guild_id})
+
+    def touch(self) -> None:
+        self.version += 1
+        self.modified = clock.utcnow()
+
+    def due_users(self, until: datetime.datetime) -> list:
+        """Users whose running TimeBomb goes off by `until`, soonest first"""
+        return [(user_id, self.user_data[user_id]) for user_id in self.partition.due(self.user_data, until) if user_id in self.user_data]
+
+    def refresh_user_data(self) -> int:
+        """Pick up changes other processes wrote to the shared store"""
+        try:
+            applied = self.partition.refresh(self.user_data)
+        except Exception as e:
+            logging.error("Error refreshing user data: %s", e, extra={"event": "data_error", "guild_id": self.guild_id})
+            return 0
+        if applied:
+            self.touch()
+        return applied
+
+class PinnedState:
+    """A GuildState that keeps the config snapshot it was made with; everything else is the live state"""
+
+    def __init__(self, state: GuildState, snapshot: ConfigSnapshot):
+        self.state = state
+        self.snapshot = snapshot
+
+    def __getattr__(self, name):
+        return getattr(self.state, name)
+
+    @property
+    def CONFIG(self) -> dict:
+        return self.snapshot.config
+
+    def channel(self, key: str):
+        return self.snapshot.channel(self.state.bot, key)
+
+    @property
+    def log_channel(self):
+        return self.channel("log_channel")
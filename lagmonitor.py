@@ -0,0 +1,109 @@
+import asyncio
+from collections import deque
+import datetime
+import logging
+import sys
+import threading
+import time
+import traceback
+from metrics import METRICS
+
+class LoopWatchdog:
+    """Samples event loop lag and captures the stack of whatever is blocking the loop"""
+
+    def __init__(self, interval: float = 0.25, threshold: float = 0.5,
+                 report_minutes: float = 5, max_samples: int = 2400, max_stalls: int = 20):
+        self.interval = interval
+        self.threshold = threshold
+        self.report_seconds = report_minutes * 60
+        self.samples = deque(maxlen=max_samples)
+        self.stalls = deque(maxlen=max_stalls)
+        self.last_tick = time.monotonic()
+        self.loop_thread_id = None
+        self.current_stall = None
+        self.task = None
+        self.stopped = threading.Event()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "LoopWatchdog":
+        """Build a watchdog from the optional watchdog section of config.json"""
+        settings = dict(config.get("watchdog", {}))
+        settings.pop("enabled", None)
+        return cls(**settings)
+
+    def start(self) -> None:
+        """Start sampling on the running loop and watching it from a helper thread"""
+        self.loop_thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self.task = asyncio.create_task(self._sample())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        METRICS.gauge("timebomb_event_loop_lag_seconds", self._collect, "Event loop lag over the sample window")
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.task:
+            self.task.cancel()
+
+    async def _sample(self):
+        last_report = time.monotonic()
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.samples.append(max(now - started - self.interval, 0.0))
+            self.last_tick = now
+
+            if now - last_report >= self.report_seconds:
+                last_report = now
+                stats = self.stats()
+                logging.info(
+                    "Event loop lag p50=%.1fms p99=%.1fms max=%.1fms stalls=%d",
+                    stats["p50"] * 1000, stats["p99"] * 1000, stats["max"] * 1000, len(self.stalls),
+                    extra={"event": "loop_lag", "lag_p50": stats["p50"], "lag_p99": stats["p99"]}
+                )
+
+    def _watch(self):
+        """Runs off the loop so it can still observe the loop while it is blocked"""
+        while not self.stopped.wait(self.interval):
+            blocked_for = time.monotonic() - self.last_tick - self.interval
+
+            if blocked_for > self.threshold and self.current_stall is None:
+                frame = sys._current_frames().get(self.loop_thread_id)
+                stack = "".join(traceback.format_stack(frame, limit=15)) if frame else ""
+                self.current_stall = {
+                    "at": datetime.datetime.utcnow().isoformat(),
+                    "duration": blocked_for,
+                    "stack": stack
+                }
+                self.stalls.append(self.current_stall)
+                logging.warning("Event loop blocked for over %.2fs in:\n%s", blocked_for, stack, extra={"event": "loop_stall"})
+
+            elif self.current_stall is not None:
+                if blocked_for > self.threshold:
+                    self.current_stall["duration"] = blocked_for
+                else:
+                    # The loop ticked again, so the last sample holds the full stall
+                    if self.samples:
+                        self.current_stall["duration"] = max(self.current_stall["duration"], self.samples[-1])
+                    logging.warning("Event loop stall ended after %.2fs", self.current_stall['duration'], extra={"event": "loop_stall"})
+                    self.current_stall = None
+
+    def stats(self) -> dict:
+        """p50/p99/max lag in seconds over the retained samples"""
+        samples = sorted(self.samples)
+        if not samples:
+            return {"p50": 0.0, "p99": 0.0, "max": 0.0, "count": 0}
+        return {
+            "p50": samples[len(samples) // 2],
+            "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+            "max": samples[-1],
+            "count": len(samples)
+        }
+
+    def _collect(self) -> dict:
+        stats = self.stats()
+        return {
+            (("quantile", "0.5"),): stats["p50"],
+            (("quantile", "0.99"),): stats["p99"],
+            (("quantile", "1"),): stats["max"]
+        }
@@ -0,0 +1,62 @@
+import json
+import os
+from typing import Optional
+import phases
+import utils
+
+CONFIG_FILE = "config.json"
+
+def read_config(path: str = CONFIG_FILE) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def config_mtime(path: str = CONFIG_FILE) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+# What each (phase, event) does. Role events are called with (bot, member, role, phase),
+# "deadline" with (bot, guild, user_id, phase) and "release" with (bot, member, phase)
+ACTIONS = {
+    "success": utils.handle_phase_success,
+    "complete": utils.handle_completion,
+    "jailed": utils.handle_jail_role,
+    "deadline": utils.handle_bomb_failure,
+    "release": utils.handle_jail_release,
+}
+
+class ConfigSnapshot:
+    """One guild's config with the lookups derived from it, built once per (re)load and never changed after"""
+
+    def __init__(self, config: dict):
+        self.config = config
+        engine = phases.ENGINE
+        self.dispatch = engine.compile(ACTIONS)
+        # Role id -> (phase, event) it stands for; its keys are the roles on_member_update cares about
+        self.role_events = {}
+        for phase in engine.phases:
+            self.role_events[config["roles"][phase.success_role]] = (phase, "success")
+            self.role_events[config["roles"][phase.jail_role]] = (phase, "jailed")
+        self.tracked_roles = frozenset(self.role_events)
+        # Config key -> channel object, filled on first use since channels aren't cached until the bot is ready
+        self.channels = {}
+
+    def channel(self, bot, key: str):
+        """The channel a config key names, or None if it isn't set or can't be seen"""
+        channel = self.channels.get(key)
+        if channel is None and self.config.get(key):
+            channel = bot.get_channel(self.config[key])
+            if channel is not None:
+                self.channels[key] = channel
+        return channel
+
+    def forget_channel(self, channel_id: int) -> None:
+        """Drop a deleted channel so the next lookup goes back to the cache"""
+        self.channels = {key: channel for key, channel in self.channels.items() if channel.id != channel_id}
+
+# Only read in setup_hook, so changing them still needs a restart
+RESTART_SETTINGS = ("phases", "store", "sharding", "metrics", "watchdog", "logging", "recorder", "role_transitions", "query_api")
+
+def restart_settings_changed(old: dict, new: dict) -> list:
+    return [key for key in RESTART_SETTINGS if old.get(key) != new.get(key)]
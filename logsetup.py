@@ -0,0 +1,99 @@
+import datetime
+import gzip
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import sys
+
+# Attributes set on every LogRecord; anything else came in through extra=
+STANDARD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with user_id/phase/event and any other extras as fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds") + "Z",
+            "level": record.levelname,
+            "logger": record.name,
+            # Arguments are only interpolated here, on the listener thread
+            "message": record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in STANDARD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+class PreparedQueueHandler(logging.handlers.QueueHandler):
+    """Queue records without formatting them on the event loop"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The default prepare() formats the message eagerly; the listener
+        # thread does that instead. Exceptions are rendered now since
+        # traceback objects aren't safe to hand over.
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+def _gzip_namer(name: str) -> str:
+    return name + ".gz"
+
+def _gzip_rotator(source: str, dest: str) -> None:
+    with open(source, 'rb') as f_in, gzip.open(dest, 'wb') as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+def load_settings(path: str = "config.json") -> dict:
+    """Read the logging section of config.json before the bot itself loads it"""
+    try:
+        with open(path, 'r') as f:
+            return json.load(f).get("logging", {})
+    except Exception as e:
+        print(f"Could not read logging settings: {e}")
+        return {}
+
+def setup_logging(settings: dict) -> logging.handlers.QueueListener:
+    """Route all logging through a queue so handlers never block the event loop"""
+    formatter = JsonFormatter()
+
+    console = logging.StreamHandler(sys.stdout)
+    console.setFormatter(formatter if settings.get("json_console", False) else
+                         logging.Formatter("%(asctime)s - %(levelname)s - %(message)s"))
+    handlers = [console]
+
+    log_file = settings.get("file", "/data/logs/bot.log")
+    if log_file:
+        try:
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file,
+                maxBytes=settings.get("max_bytes", 5 * 1024 * 1024),
+                backupCount=settings.get("backups", 5),
+                encoding="utf-8",
+                delay=True
+            )
+            file_handler.namer = _gzip_namer
+            file_handler.rotator = _gzip_rotator
+            file_handler.setFormatter(formatter)
+            handlers.append(file_handler)
+        except OSError as e:
+            print(f"Could not open log file {log_file}: {e}")
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(PreparedQueueHandler(log_queue))
+    root.setLevel(settings.get("level", "INFO"))
+
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,191 @@
+import discord
+from aiohttp import web
+import aiohttp
+import contextlib
+import logging
+import phases
+import re
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SNOWFLAKE = re.compile(r"/\d{15,21}")
+
+class Histogram:
+    """Cumulative latency histogram for one label set"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.total += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+
+class Metrics:
+    """In-process registry rendered in the Prometheus text format"""
+
+    def __init__(self):
+        # name -> {labels tuple: value}
+        self.histograms = {}
+        self.counters = {}
+        # name -> callable returning {labels tuple: value}
+        self.gauges = {}
+        self.help = {}
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        series = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        if key not in series:
+            series[key] = Histogram()
+        series[key].observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0) + amount
+
+    def gauge(self, name: str, collect, help_text: str = "") -> None:
+        """Register a gauge that is computed at scrape time"""
+        self.gauges[name] = collect
+        self.help[name] = help_text
+
+    @contextlib.contextmanager
+    def timer(self, name: str, **labels):
+        """Observe the wall time of a block, including async blocks it awaits in"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def render(self) -> str:
+        lines = []
+        for name, series in self.counters.items():
+            lines.append(f"# TYPE {name} counter")
+            for key, value in series.items():
+                lines.append(f"{name}{_labels(key)} {value}")
+
+        for name, series in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for key, histogram in series.items():
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    lines.append(f"{name}_bucket{_labels(key + (('le', str(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(key)} {histogram.total}")
+                lines.append(f"{name}_count{_labels(key)} {histogram.count}")
+
+        for name, collect in self.gauges.items():
+            if self.help.get(name):
+                lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                for key, value in collect().items():
+                    lines.append(f"{name}{_labels(key)} {value}")
+            except Exception as e:
+                logging.error("Error collecting gauge %s: %s", name, e, extra={"event": "metrics_error"})
+
+        return "\n".join(lines) + "\n"
+
+def _labels(key: tuple) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{label}="{value}"' for label, value in key) + "}"
+
+# Shared registry, so helpers in utils don't need a bot reference
+METRICS = Metrics()
+
+def route_label(path: str) -> str:
+    """Collapse ids out of a URL path so each API route is one label value"""
+    path = path.split("/api/v", 1)[-1]
+    path = path.split("/", 1)[-1] if path[:1].isdigit() else path
+    return SNOWFLAKE.sub("/{id}", "/" + path.lstrip("/"))
+
+def trace_config() -> aiohttp.TraceConfig:
+    """aiohttp hooks that see every raw response, including retried 429s"""
+    config = aiohttp.TraceConfig()
+
+    async def on_request_end(session, context, params):
+        if params.response.status == 429:
+            METRICS.inc("timebomb_http_429_total", route=route_label(params.url.path))
+
+    config.on_request_end.append(on_request_end)
+    return config
+
+def instrument_http(bot) -> None:
+    """Count DMs, role edits and queued requests at the discord.py HTTP layer"""
+    original_request = bot.http.request
+    pending = {"requests": 0}
+
+    async def request(route, **kwargs):
+        kind = None
+        if route.method == "POST" and route.path == "/channels/{channel_id}/messages":
+            if isinstance(bot.get_channel(route.channel_id), discord.DMChannel):
+                kind = "dm"
+        elif route.path.startswith("/guilds/{guild_id}/members/{user_id}"):
+            if "/roles/" in route.path or (route.method == "PATCH" and "roles" in (kwargs.get("json") or {})):
+                kind = "role_edit"
+
+        # Includes time spent waiting on discord.py's rate limit buckets
+        pending["requests"] += 1
+        try:
+            response = await original_request(route, **kwargs)
+        except Exception:
+            if kind == "dm":
+                METRICS.inc("timebomb_dms_total", status="failed")
+            elif kind == "role_edit":
+                METRICS.inc("timebomb_role_edits_total", status="failed")
+            raise
+        finally:
+            pending["requests"] -= 1
+
+        if kind == "dm":
+            METRICS.inc("timebomb_dms_total", status="sent")
+        elif kind == "role_edit":
+            METRICS.inc("timebomb_role_edits_total", status="ok")
+        return response
+
+    bot.http.request = request
+    METRICS.gauge(
+        "timebomb_outbound_queue_depth",
+        lambda: {(): pending["requests"]},
+        "Discord API requests waiting on a rate limit or in flight"
+    )
+
+def register_user_gauges(bot) -> None:
+    """Expose how many tracked users sit in each phase, per guild"""
+    def collect():
+        samples = {}
+        for guild_id, state in bot.guild_states.items():
+            counts = {phase.name: 0 for phase in phases.ENGINE.phases}
+            for data in state.user_data.values():
+                phase = phases.ENGINE.current(data)
+                if phase is not None:
+                    counts[phase.name] += 1
+            for phase, count in counts.items():
+                samples[(("guild", str(guild_id)), ("phase", phase))] = count
+        return samples
+
+    METRICS.gauge("timebomb_tracked_users", collect, "Users with a live TimeBomb by phase")
+
+async def start_server(config: dict):
+    """Serve /metrics on localhost if enabled in config.json"""
+    settings = config.get("metrics", {})
+    if not settings.get("enabled", False):
+        return None
+
+    async def handle(request):
+        return web.Response(text=METRICS.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.get("host", "127.0.0.1"), settings.get("port", 9108))
+    await site.start()
+    logging.info("Metrics server listening on %s:%s", settings.get('host', '127.0.0.1'), settings.get('port', 9108), extra={"event": "metrics"})
+    return runner
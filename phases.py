@@ -0,0 +1,183 @@
+import datetime
+from typing import Optional
+
+# The lifecycle the bot has always run; a "phases" list in config.json replaces it
+DEFAULT_PHASES = [
+    {
+        "name": "first",
+        "days": 3,
+        "success_role": "first_success",
+        "jail_role": "first_jail",
+        "warnings": [
+            {"key": "first_24h", "from_hours": 23, "to_hours": 25},
+            {"key": "first_12h", "from_hours": 11, "to_hours": 13}
+        ]
+    },
+    {
+        "name": "second",
+        "days": 14,
+        "success_role": "second_success",
+        "jail_role": "second_jail",
+        "requirements": ["messages", "voice_seconds", "approvals"],
+        "warnings": [
+            {"key": "second_7d", "from_hours": 168, "to_hours": 192},
+            {"key": "second_3d", "from_hours": 72, "to_hours": 96},
+            {"key": "second_24h", "from_hours": 23, "to_hours": 25}
+        ]
+    }
+]
+
+# Things that can happen to a user in a phase
+EVENTS = ("success", "jailed", "deadline", "release")
+
+class WarningWindow:
+    """A warning sent once while the time left on a phase is inside [start, end]"""
+
+    def __init__(self, spec: dict):
+        self.key = spec["key"]
+        self.start = datetime.timedelta(hours=spec["from_hours"])
+        self.end = datetime.timedelta(hours=spec["to_hours"])
+
+class Phase:
+    """One TimeBomb phase, with the user_data keys it uses worked out once"""
+
+    def __init__(self, number: int, spec: dict):
+        self.number = number
+        self.name = spec["name"]
+        self.title = spec.get("title", self.name.capitalize())
+        self.days = spec["days"]
+        self.duration = datetime.timedelta(days=spec["days"])
+        # Keys into the guild's "roles" config, so role ids can still differ per guild
+        self.success_role = spec["success_role"]
+        self.jail_role = spec["jail_role"]
+        # Activity counters that complete this phase on their own, checked against "requirements"
+        self.requirements = tuple(spec.get("requirements", ()))
+        # Checked in order, at most one sent per sweep
+        self.warnings = tuple(WarningWindow(warning) for warning in spec.get("warnings", ()))
+        self.end_key = f"{self.name}_bomb_end"
+        self.failed_key = f"{self.name}_bomb_failed"
+        self.active_key = f"{self.name}_bomb_active"
+        # Seconds left on a paused TimeBomb, which has no deadline until it is resumed
+        self.paused_key = f"{self.name}_bomb_paused"
+        self.next = None
+
+    def started(self, data: dict) -> bool:
+        # The first phase never had an active flag; having a deadline is enough
+        return (self.end_key in data or self.paused_key in data) and (self.number == 1 or data.get(self.active_key, False))
+
+    def failed(self, data: dict) -> bool:
+        return data.get(self.failed_key, False)
+
+    def paused(self, data: dict) -> bool:
+        return self.paused_key in data
+
+    def deadline(self, data: dict) -> Optional[datetime.datetime]:
+        end = data.get(self.end_key)
+        return datetime.datetime.fromisoformat(end) if end else None
+
+    def start(self, data: dict, now: datetime.datetime, duration: datetime.timedelta = None) -> datetime.datetime:
+        """Put a user on this phase's TimeBomb and return when it goes off"""
+        end_time = now + (duration or self.duration)
+        if self.number > 1:
+            data[self.active_key] = True
+        data[self.end_key] = end_time.isoformat()
+        data.pop(self.failed_key, None)
+        data.pop(self.paused_key, None)
+        return end_time
+
+    def remaining(self, data: dict, now: datetime.datetime) -> datetime.timedelta:
+        """Time left on this phase's TimeBomb, frozen while it is paused"""
+        if self.paused(data):
+            return datetime.timedelta(seconds=data[self.paused_key])
+        return self.deadline(data) - now
+
+    def pause(self, data: dict, now: datetime.datetime) -> datetime.timedelta:
+        """Stop the clock, keeping the time left in place of the deadline"""
+        left = max(self.remaining(data, now), datetime.timedelta(0))
+        data.pop(self.end_key, None)
+        data[self.paused_key] = left.total_seconds()
+        return left
+
+    def resume(self, data: dict, now: datetime.datetime) -> datetime.datetime:
+        """Start the clock again with the time that was left when it was paused"""
+        end_time = now + datetime.timedelta(seconds=data.pop(self.paused_key))
+        data[self.end_key] = end_time.isoformat()
+        return end_time
+
+    def extend(self, data: dict, by: datetime.timedelta, now: datetime.datetime) -> datetime.timedelta:
+        """Add time to this phase's TimeBomb, paused or not, and return the time left
+
+        Warnings it is no longer close to get sent again.
+        """
+        if self.paused(data):
+            data[self.paused_key] += by.total_seconds()
+        else:
+            data[self.end_key] = (self.deadline(data) + by).isoformat()
+        left = self.remaining(data, now)
+        warnings_sent = data.get("warnings_sent", {})
+        for warning in self.warnings:
+            if left > warning.end:
+                warnings_sent.pop(warning.key, None)
+        return left
+
+    def clear(self, data: dict) -> None:
+        """Take this phase's TimeBomb off a user"""
+        data.pop(self.end_key, None)
+        data.pop(self.failed_key, None)
+        data.pop(self.paused_key, None)
+        if self.number > 1 and self.active_key in data:
+            data[self.active_key] = False
+
+class PhaseEngine:
+    """The configured phases, compiled once into the lookups the hot paths use"""
+
+    def __init__(self, specs: list):
+        if not specs:
+            raise ValueError("At least one phase is needed")
+        self.phases = tuple(Phase(number, spec) for number, spec in enumerate(specs, start=1))
+        for phase, following in zip(self.phases, self.phases[1:]):
+            phase.next = following
+        self.first = self.phases[0]
+        self.by_number = {phase.number: phase for phase in self.phases}
+        # Latest phase first, so current() stops at the first one started
+        self.newest_first = self.phases[::-1]
+        # How far ahead of a deadline anything can come due
+        self.horizon = max((warning.end for phase in self.phases for warning in phase.warnings), default=datetime.timedelta(0))
+
+    def current(self, data: dict) -> Optional[Phase]:
+        """The latest phase a user has started, failed or not"""
+        for phase in self.newest_first:
+            if phase.started(data):
+                return phase
+        return None
+
+    def live(self, data: dict) -> Optional[Phase]:
+        """The phase whose TimeBomb is still running for a user; paused ones aren't"""
+        phase = self.current(data)
+        return phase if phase is not None and not phase.failed(data) and not phase.paused(data) else None
+
+    def new_record(self, now: datetime.datetime, phase: Phase = None, duration: datetime.timedelta = None) -> dict:
+        """user_data for someone starting on a phase, the first by default"""
+        phase = phase or self.first
+        data = {"join_date": now.isoformat(), "warnings_sent": {}}
+        for later in self.phases[phase.number:]:
+            data[later.active_key] = False
+        phase.start(data, now, duration)
+        return data
+
+    def compile(self, actions: dict) -> dict:
+        """(phase number, event) -> handler, with the last phase's success mapped to actions["complete"]"""
+        table = {}
+        for phase in self.phases:
+            for event in EVENTS:
+                action = "complete" if event == "success" and phase.next is None else event
+                table[(phase.number, event)] = actions[action]
+        return table
+
+ENGINE = PhaseEngine(DEFAULT_PHASES)
+
+def configure(config: dict) -> PhaseEngine:
+    """Compile the phases in config.json; they shape the stored data, so this only happens at startup"""
+    global ENGINE
+    ENGINE = PhaseEngine(config.get("phases", DEFAULT_PHASES))
+    return ENGINE
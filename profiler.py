@@ -0,0 +1,156 @@
+import asyncio
+from collections import Counter
+import cProfile
+import io
+import logging
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+import zipfile
+
+MAX_SECONDS = 300
+SAMPLE_INTERVAL = 0.005
+TOP_ENTRIES = 40
+
+# Only one profile at a time; two would skew each other and cProfile refuses to nest
+_running = threading.Lock()
+
+def is_running() -> bool:
+    return _running.locked()
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+class StackSampler:
+    """Samples one thread's stack from a helper thread and counts identical stacks"""
+
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self) -> None:
+        self.thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        # Reading frames from another thread never pauses the loop thread
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(_frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+                self.samples += 1
+
+    def collapsed(self) -> str:
+        """Stacks in the folded format read by flamegraph.pl, speedscope and friends"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def top_frames(self, limit: int = 5) -> list:
+        """Innermost frames with the most samples"""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return leaves.most_common(limit)
+
+def _package(sampler: StackSampler, profile, allocations, seconds: float) -> bytes:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("stacks.collapsed", sampler.collapsed())
+
+        if profile is not None:
+            text = io.StringIO()
+            stats = pstats.Stats(profile, stream=text)
+            stats.sort_stats("cumulative").print_stats(TOP_ENTRIES)
+            stats.sort_stats("tottime").print_stats(TOP_ENTRIES)
+            archive.writestr("cprofile.txt", text.getvalue())
+            # Same format pstats.Stats.dump_stats writes
+            archive.writestr("cprofile.prof", marshal.dumps(stats.stats))
+
+        if allocations is not None:
+            before, after = allocations
+            lines = ["Growth during the profile:"]
+            lines += [str(stat) for stat in after.compare_to(before, "lineno")[:TOP_ENTRIES]]
+            lines += ["", "Largest live allocation sites:"]
+            lines += [str(stat) for stat in after.statistics("lineno")[:TOP_ENTRIES]]
+            archive.writestr("allocations.txt", "\n".join(lines) + "\n")
+
+        archive.writestr("README.txt", (
+            f"Profiled the event loop thread for {seconds:.1f}s, {sampler.samples} stack samples "
+            f"every {sampler.interval * 1000:.0f}ms.\n"
+            "stacks.collapsed: folded stacks for flamegraph.pl or https://www.speedscope.app\n"
+            "cprofile.prof: load with pstats or snakeviz\n"
+        ))
+    return buffer.getvalue()
+
+async def run_profile(seconds: float, mode: str = "sampling", allocations: bool = False) -> dict:
+    """Profile the event loop thread while it keeps serving, and return a zip of the results"""
+    if not _running.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+
+    seconds = max(1.0, min(float(seconds), MAX_SECONDS))
+    sampler = StackSampler(threading.get_ident())
+    profile = None
+    started_tracing = False
+    snapshot_before = None
+
+    try:
+        if allocations:
+            if not tracemalloc.is_tracing():
+                # One frame per trace keeps the overhead on every allocation low
+                tracemalloc.start(1)
+                started_tracing = True
+            # A snapshot of a large heap takes a while; the loop keeps serving meanwhile
+            snapshot_before = await asyncio.to_thread(tracemalloc.take_snapshot)
+
+        if mode == "cprofile":
+            # cProfile hooks only the thread it is enabled on, which here is the loop thread
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError as e:
+                raise RuntimeError(f"cProfile is unavailable: {e}") from e
+
+        sampler.start()
+        started = time.perf_counter()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            elapsed = time.perf_counter() - started
+            if profile is not None:
+                profile.disable()
+            sampler.stop()
+
+        allocation_snapshots = None
+        if allocations:
+            allocation_snapshots = (snapshot_before, await asyncio.to_thread(tracemalloc.take_snapshot))
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+        _running.release()
+
+    # Formatting the stats and diffing the snapshots is CPU work the loop shouldn't wait on
+    archive = await asyncio.to_thread(_package, sampler, profile, allocation_snapshots, elapsed)
+    logging.info("Profiled for %.1fs in %s mode, %d samples", elapsed, mode, sampler.samples, extra={"event": "profile"})
+    return {
+        "archive": archive,
+        "seconds": elapsed,
+        "samples": sampler.samples,
+        "top_frames": sampler.top_frames()
+    }
@@ -0,0 +1,219 @@
+from aiohttp import web
+import asyncio
+import datetime
+import email.utils
+import json
+import logging
+import os
+import time
+import clock
+import phases
+
+# Cached response bodies kept per guild, enough for a handful of polling tools
+CACHE_SIZE = 64
+
+def user_status(user_id: str, data: dict) -> dict:
+    """What other tools need to know about one tracked user; nothing in it depends on the time of asking"""
+    phase = phases.ENGINE.current(data)
+    status = {"user_id": user_id, "phase": None, "phase_name": None, "state": "done", "deadline": None, "paused_seconds": None}
+    if phase is None:
+        return status
+    status.update(phase=phase.number, phase_name=phase.name)
+    if phase.failed(data):
+        status["state"] = "jailed"
+    elif phase.paused(data):
+        status["state"] = "paused"
+        status["paused_seconds"] = data[phase.paused_key]
+    else:
+        status["state"] = "running"
+        status["deadline"] = phase.deadline(data).isoformat()
+    return status
+
+def _snapshot(user_data: dict) -> dict:
+    """A copy of the user map a worker thread can read while the loop keeps changing records
+
+    Records are copied one level deep; the nested warnings and activity
+    maps are shared, but nothing here reads them.
+    """
+    return {user_id: dict(data) for user_id, data in user_data.items()}
+
+def _http_date(when: datetime.datetime) -> str:
+    # Stored timestamps are naive UTC
+    return email.utils.format_datetime(when.replace(tzinfo=datetime.timezone.utc, microsecond=0), usegmt=True)
+
+class QueryAPI:
+    """Read-only JSON view of timer state for other tools on the same host
+
+    Responses carry an ETag built from the guild's data version, so a poll
+    that nothing has changed since gets a 304 without touching the data.
+    Anything that walks the whole guild runs in a worker thread on a copy
+    of the records taken on the loop, so the gateway loop only pays for
+    the copy, and only once per data version however many polls miss the
+    cache.
+    """
+
+    def __init__(self, bot, max_page_size: int = 500):
+        self.bot = bot
+        self.max_page_size = max_page_size
+        # Versions restart with the process, so tags from a previous run never match
+        self.boot = f"{os.getpid():x}{int(time.time()):x}"
+        # guild id -> {path and query: (etag, body)}
+        self.cache = {}
+        # guild id -> (version, copy of the records at that version)
+        self.snapshots = {}
+
+    def routes(self) -> list:
+        return [
+            web.get("/guilds/{guild_id}/users/{user_id}", self.user),
+            web.get("/guilds/{guild_id}/users", self.users),
+            web.get("/guilds/{guild_id}/expiring", self.expiring),
+            web.get("/guilds/{guild_id}/phases", self.phase_counts),
+        ]
+
+    def state(self, request: web.Request):
+        try:
+            guild_id = int(request.match_info["guild_id"])
+        except ValueError:
+            raise web.HTTPNotFound()
+        state = self.bot.state_for(guild_id)
+        if state is None:
+            raise web.HTTPNotFound()
+        return state
+
+    @staticmethod
+    def int_param(request: web.Request, name: str, default: int, low: int, high: int) -> int:
+        try:
+            value = int(request.query.get(name, default))
+        except ValueError:
+            raise web.HTTPBadRequest(text=f"{name} must be a whole number")
+        return max(low, min(value, high))
+
+    def snapshot(self, state) -> dict:
+        """The guild's records as of its current version, copied on the first miss after a change"""
+        cached = self.snapshots.get(state.guild_id)
+        if cached is None or cached[0] != state.version:
+            cached = (state.version, _snapshot(state.user_data))
+            self.snapshots[state.guild_id] = cached
+        return cached[1]
+
+    async def respond(self, request: web.Request, state, build, tag: str = "") -> web.Response:
+        """Answer from the cache or with a 304 when the guild's data hasn't changed, else build the body
+
+        `tag` adds whatever else the answer depends on, like the minute for
+        windows measured from now.
+        """
+        etag = f'"{self.boot}-{state.version}{tag}"'
+        headers = {"ETag": etag, "Last-Modified": _http_date(state.modified), "Cache-Control": "no-cache"}
+        # Only the ETag decides; If-Modified-Since has whole seconds and would miss changes within one
+        if etag in (value.strip() for value in request.headers.get("If-None-Match", "").split(",")):
+            return web.Response(status=304, headers=headers)
+
+        cache = self.cache.setdefault(state.guild_id, {})
+        cached = cache.get(request.path_qs)
+        if cached is not None and cached[0] == etag:
+            body = cached[1]
+        else:
+            payload = await build()
+            body = await asyncio.to_thread(json.dumps, payload, separators=(",", ":"))
+            if len(cache) >= CACHE_SIZE:
+                cache.pop(next(iter(cache)))
+            cache[request.path_qs] = (etag, body)
+        return web.Response(text=body, content_type="application/json", headers=headers)
+
+    async def user(self, request: web.Request) -> web.Response:
+        state = self.state(request)
+        user_id = request.match_info["user_id"]
+
+        async def build():
+            data = state.user_data.get(user_id)
+            if data is not None:
+                return user_status(user_id, data)
+            # Jailed, completed and departed users only live in the cold archive
+            record = await asyncio.to_thread(state.archive.lookup, user_id)
+            if record is None:
+                raise web.HTTPNotFound()
+            status = user_status(user_id, record["data"])
+            status["archived"] = record["status"]
+            return status
+
+        return await self.respond(request, state, build)
+
+    async def users(self, request: web.Request) -> web.Response:
+        """One page of tracked users in id order; `after` is the last id of the previous page"""
+        state = self.state(request)
+        limit = self.int_param(request, "limit", 100, 1, self.max_page_size)
+        after = request.query.get("after", "")
+
+        async def build():
+            snapshot = self.snapshot(state)
+
+            def page():
+                user_ids = sorted(user_id for user_id in snapshot if user_id > after)[:limit]
+                return {
+                    "users": [user_status(user_id, snapshot[user_id]) for user_id in user_ids],
+                    "next": user_ids[-1] if len(user_ids) == limit else None,
+                    "total": len(snapshot),
+                }
+
+            return await asyncio.to_thread(page)
+
+        return await self.respond(request, state, build)
+
+    async def expiring(self, request: web.Request) -> web.Response:
+        """Running TimeBombs that go off within `hours`, soonest first, read from the deadline index"""
+        state = self.state(request)
+        hours = self.int_param(request, "hours", 24, 0, 24 * 365)
+        limit = self.int_param(request, "limit", self.max_page_size, 1, self.max_page_size)
+
+        async def build():
+            snapshot = self.snapshot(state)
+            now = clock.utcnow()
+
+            def window():
+                due = state.partition.due(snapshot, now + datetime.timedelta(hours=hours))
+                users = [user_status(user_id, snapshot[user_id]) for user_id in due if user_id in snapshot]
+                return {"hours": hours, "count": len(users), "users": users[:limit]}
+
+            return await asyncio.to_thread(window)
+
+        # The window moves with the clock, so answers only hold for the minute
+        return await self.respond(request, state, build, f"-{hours}-{clock.utcnow():%Y%m%d%H%M}")
+
+    async def phase_counts(self, request: web.Request) -> web.Response:
+        """Running and paused TimeBombs per phase"""
+        state = self.state(request)
+
+        async def build():
+            records = list(self.snapshot(state).values())
+
+            def count():
+                counts = {phase.name: {"running": 0, "paused": 0} for phase in phases.ENGINE.phases}
+                for data in records:
+                    phase = phases.ENGINE.current(data)
+                    # Jailed users are on their way to the cold archive and aren't counted
+                    if phase is None or phase.failed(data):
+                        continue
+                    if phase.paused(data):
+                        counts[phase.name]["paused"] += 1
+                    else:
+                        counts[phase.name]["running"] += 1
+                return {"phases": counts, "total": len(records)}
+
+            return await asyncio.to_thread(count)
+
+        return await self.respond(request, state, build)
+
+async def start_server(bot, config: dict):
+    """Serve the query API on localhost if enabled in config.json"""
+    settings = config.get("query_api", {})
+    if not settings.get("enabled", False):
+        return None
+
+    app = web.Application()
+    app.add_routes(QueryAPI(bot, settings.get("max_page_size", 500)).routes())
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, settings.get("host", "127.0.0.1"), settings.get("port", 9109))
+    await site.start()
+    logging.info("Query API listening on %s:%s", settings.get('host', '127.0.0.1'), settings.get('port', 9109), extra={"event": "query_api"})
+    return runner
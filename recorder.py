@@ -0,0 +1,86 @@
+import discord
+from discord.ext import commands, tasks
+import json
+import logging
+import os
+import clock
+
+RECORDING_FILE = "/data/events.ndjson"
+
+def _role_ids(member: discord.Member) -> list:
+    return [role.id for role in member.roles if role != member.guild.default_role]
+
+class EventRecorder(commands.Cog):
+    """Appends the member and interaction events the bot handles to an NDJSON file for offline replay"""
+
+    def __init__(self, bot, path: str = RECORDING_FILE, flush_seconds: float = 5.0, max_bytes: int = 50 * 2 ** 20):
+        self.bot = bot
+        self.path = path
+        self.max_bytes = max_bytes
+        self.buffer = []
+        self.flush_events.change_interval(seconds=flush_seconds)
+        self.flush_events.start()
+
+    @classmethod
+    def from_config(cls, bot) -> "EventRecorder":
+        """Build a recorder from the optional recorder section of config.json"""
+        settings = dict(bot.CONFIG.get("recorder", {}))
+        settings.pop("enabled", None)
+        return cls(bot, **settings)
+
+    def cog_unload(self):
+        self.flush_events.cancel()
+        self.flush()
+
+    def record(self, event: str, **fields) -> None:
+        entry = {"event": event, "at": clock.utcnow().isoformat(), **fields}
+        self.buffer.append(json.dumps(entry, separators=(",", ":")))
+
+    def flush(self) -> None:
+        """Write buffered events, keeping one rotated file once the recording hits max_bytes"""
+        if not self.buffer:
+            return
+        lines, self.buffer = self.buffer, []
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+            with open(self.path, 'a') as f:
+                f.write("\n".join(lines) + "\n")
+        except Exception as e:
+            logging.error("Error writing event recording: %s", e, extra={"event": "recorder_error"})
+
+    @tasks.loop(seconds=5)
+    async def flush_events(self):
+        self.flush()
+
+    def _tracked(self, guild) -> bool:
+        return self.bot.state_for(guild) is not None
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        if self._tracked(member.guild):
+            self.record("member_join", user_id=member.id, bot=member.bot, roles=_role_ids(member))
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        # Nickname and avatar changes don't reach any handler
+        if self._tracked(after.guild) and before.roles != after.roles:
+            self.record("member_update", user_id=after.id, before=_role_ids(before), after=_role_ids(after))
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        if self._tracked(member.guild):
+            self.record("member_remove", user_id=member.id, roles=_role_ids(member))
+
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction):
+        if interaction.type != discord.InteractionType.application_command or not self._tracked(interaction.guild):
+            return
+        data = interaction.data or {}
+        self.record("interaction", user_id=interaction.user.id, command=data.get("name"),
+                    options=data.get("options", []))
+
+async def setup(bot):
+    if bot.CONFIG.get("recorder", {}).get("enabled", False):
+        await bot.add_cog(EventRecorder.from_config(bot))
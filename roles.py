@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import time
+import discord
+from metrics import METRICS
+
+class PendingEdit:
+    """Role changes queued for one member until its window closes; later changes win"""
+
+    def __init__(self, member: discord.Member):
+        self.member = member
+        # role id -> role
+        self.add = {}
+        self.remove = {}
+        self.reasons = []
+        self.done = asyncio.get_running_loop().create_future()
+
+    def merge(self, add, remove, reason: str = None) -> None:
+        for role in add:
+            self.remove.pop(role.id, None)
+            self.add[role.id] = role
+        for role in remove:
+            self.add.pop(role.id, None)
+            self.remove[role.id] = role
+        if reason and reason not in self.reasons:
+            self.reasons.append(reason)
+
+class RoleTransitions:
+    """Turns any number of role changes for a member into one member.edit(roles=...)
+
+    Changes for the same member that arrive within `window` seconds of the
+    first are merged into a single edit, edits for one member go out one at
+    a time, and at most `concurrency` edits are in flight across the bot.
+    """
+
+    def __init__(self, window: float = 0.25, concurrency: int = 5, batch_size: int = 20, echo_seconds: float = 10.0):
+        self.window = window
+        self.slots = asyncio.Semaphore(max(concurrency, 1))
+        self.batch_size = max(batch_size, 1)
+        self.echo_seconds = echo_seconds
+        # (guild id, member id) -> edit still collecting changes
+        self.pending = {}
+        # (guild id, member id) -> the last edit sent, until its flush is over
+        self.inflight = {}
+        # (guild id, member id) -> (roles sent, expiry) until Discord echoes them back
+        self.sent = {}
+        self.tasks = set()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "RoleTransitions":
+        """Build from the optional role_transitions section of config.json"""
+        settings = config.get("role_transitions", {})
+        return cls(settings.get("coalesce_seconds", 0.25), settings.get("max_concurrent_edits", 5),
+                   settings.get("batch_concurrency", 20), settings.get("echo_seconds", 10.0))
+
+    async def apply(self, member: discord.Member, add=(), remove=(), reason: str = None) -> bool:
+        """Queue roles to add to and take from a member and wait for the combined edit
+
+        Returns whether an edit was sent; nothing is sent when the member
+        already has the final role set. Errors from Discord are raised to
+        every caller whose change was part of the failed edit.
+        """
+        key = (member.guild.id, member.id)
+        pending = self.pending.get(key)
+        if pending is None:
+            pending = self.pending[key] = PendingEdit(member)
+            task = asyncio.create_task(self.flush(key, pending))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        else:
+            # The newest member object carries the freshest roles
+            pending.member = member
+            METRICS.inc("timebomb_role_changes_coalesced_total")
+        pending.merge(add, remove, reason)
+        return await asyncio.shield(pending.done)
+
+    def observe(self, before: discord.Member, after: discord.Member) -> None:
+        """A member update from the gateway
+
+        Role changes in it that no edit of ours made, like a moderator's, are
+        carried into the roles last sent so the next edit doesn't undo them.
+        Once an update carries exactly the roles sent, the cache can be
+        trusted again.
+        """
+        key = (after.guild.id, after.id)
+        sent = self.sent.get(key)
+        if sent is None:
+            return
+        roles, expires = sent
+        sent_ids = {role.id for role in roles}
+        after_ids = {role.id for role in after.roles if role.id != after.guild.id}
+        if sent_ids == after_ids:
+            del self.sent[key]
+            return
+        before_ids = {role.id for role in before.roles}
+        removed = before_ids - after_ids
+        added = [role for role in after.roles if role.id in after_ids - before_ids - sent_ids]
+        self.sent[key] = ([role for role in roles if role.id not in removed] + added, expires)
+
+    def base_roles(self, key: tuple, member: discord.Member) -> list:
+        """The roles an edit starts from, without @everyone, which Discord adds by itself
+
+        The cache only learns about an edit when Discord echoes it back, so
+        until then the roles last sent stand in for it.
+        """
+        sent = self.sent.get(key)
+        if sent is not None:
+            roles, expires = sent
+            if time.monotonic() < expires:
+                return list(roles)
+            del self.sent[key]
+        return [role for role in member.roles if role.id != member.guild.id]
+
+    async def flush(self, key: tuple, pending: PendingEdit) -> None:
+        await asyncio.sleep(self.window)
+        del self.pending[key]
+        prior = self.inflight.get(key)
+        self.inflight[key] = pending.done
+        if prior is not None and not prior.done():
+            await asyncio.wait([prior])
+        try:
+            pending.done.set_result(await self.edit(key, pending))
+        except Exception as e:
+            pending.done.set_exception(e)
+        finally:
+            if self.inflight.get(key) is pending.done:
+                del self.inflight[key]
+
+    async def edit(self, key: tuple, pending: PendingEdit) -> bool:
+        member = pending.member
+        base = self.base_roles(key, member)
+        final = [role for role in base if role.id not in pending.remove]
+        held = {role.id for role in final}
+        final += [role for role_id, role in pending.add.items() if role_id not in held]
+        if {role.id for role in final} == {role.id for role in base}:
+            return False
+        async with self.slots:
+            await member.edit(roles=final, reason="; ".join(pending.reasons) or None)
+        self.sent[key] = (final, time.monotonic() + self.echo_seconds)
+        logging.debug("Set %s roles on %s in one edit", len(final), member.id, extra={"user_id": member.id, "event": "roles_edited"})
+        return True
+
+    async def run_batch(self, jobs) -> None:
+        """Run a mass jailing or release, `batch_size` members at a time
+
+        Every job runs even if some fail; the first failure is raised once
+        they are all done.
+        """
+        gate = asyncio.Semaphore(self.batch_size)
+
+        async def run(job):
+            async with gate:
+                await job
+
+        results = await asyncio.gather(*(run(job) for job in jobs), return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
@@ -0,0 +1,84 @@
+import logging
+import os
+import socket
+import discord
+from discord.ext import tasks
+
+def shard_settings() -> dict:
+    """Shard layout for this process from SHARD_COUNT and SHARD_IDS ("0,1"); unset means every shard here"""
+    settings = {}
+    if os.getenv("SHARD_COUNT"):
+        settings["shard_count"] = int(os.environ["SHARD_COUNT"])
+    if os.getenv("SHARD_IDS"):
+        settings["shard_ids"] = [int(shard_id) for shard_id in os.environ["SHARD_IDS"].split(",")]
+    return settings
+
+def process_name() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+class Lease:
+    """A named lease in the shared store, renewed in the background while this process holds it"""
+
+    def __init__(self, backend, name: str, seconds: float = 60.0, holder: str = None):
+        self.backend = backend
+        self.name = name
+        self.seconds = seconds
+        self.holder = holder or process_name()
+        self.held = False
+        # Renew well before expiry so one slow renewal doesn't hand the lease over
+        self.keep_alive.change_interval(seconds=seconds / 3)
+
+    def acquire(self) -> bool:
+        """Take or renew the lease once"""
+        try:
+            held = self.backend.acquire_lease(self.name, self.holder, self.seconds)
+        except Exception as e:
+            logging.error("Error renewing the %s lease: %s", self.name, e, extra={"event": "lease_error"})
+            held = False
+        if held != self.held:
+            logging.info("%s the %s lease", "Acquired" if held else "Lost", self.name, extra={"event": "lease", "lease": self.name})
+        self.held = held
+        return held
+
+    def start(self) -> bool:
+        """Try for the lease now and keep trying or renewing in the background"""
+        held = self.acquire()
+        self.keep_alive.start()
+        return held
+
+    def stop(self) -> None:
+        self.keep_alive.cancel()
+        if self.held:
+            self.held = False
+            try:
+                self.backend.release_lease(self.name, self.holder)
+            except Exception as e:
+                logging.error("Error releasing the %s lease: %s", self.name, e, extra={"event": "lease_error"})
+
+    @tasks.loop(seconds=20)
+    async def keep_alive(self):
+        self.acquire()
+
+class RemoteGuild:
+    """A guild whose shard runs in another process, seen through the REST API for one sweep"""
+
+    def __init__(self, guild: discord.Guild, members: dict):
+        self._guild = guild
+        self.members_by_id = members
+
+    @classmethod
+    async def fetch(cls, bot, guild_id: int) -> "RemoteGuild":
+        guild = await bot.fetch_guild(guild_id)
+        # One request per thousand members, instead of one per user due
+        members = {member.id: member async for member in guild.fetch_members(limit=None)}
+        return cls(guild, members)
+
+    def __getattr__(self, name):
+        return getattr(self._guild, name)
+
+    def get_member(self, user_id: int):
+        return self.members_by_id.get(user_id)
+
+    @property
+    def members(self) -> list:
+        return list(self.members_by_id.values())
@@ -0,0 +1,58 @@
+import asyncio
+import datetime
+import hashlib
+import time
+import phases
+from metrics import METRICS
+
+def jitter(user_id: str, max_seconds: float, seed: int = 0) -> datetime.timedelta:
+    """A fixed offset in [0, max_seconds) for a user; re-running a bulk reset gives everyone the same one again"""
+    if max_seconds <= 0:
+        return datetime.timedelta(0)
+    digest = hashlib.blake2b(f"{seed}:{user_id}".encode(), digest_size=8).digest()
+    return datetime.timedelta(seconds=int.from_bytes(digest, "big") / 2**64 * max_seconds)
+
+def bulk_duration(config: dict, phase: phases.Phase, user_id: str) -> datetime.timedelta:
+    """A phase's full duration plus the user's jitter, for deadlines handed out to a whole guild at once
+
+    Jitter is only ever added, so nobody gets less than the phase's grace period.
+    """
+    settings = config.get("smoothing", {})
+    max_seconds = settings.get("jitter_minutes", 0) * 60
+    return phase.duration + jitter(user_id, max_seconds, settings.get("seed", config["guild_id"]))
+
+class DispatchLimiter:
+    """Token bucket that spreads a burst of due warnings and jailings over time
+
+    Actions only ever wait, they are never dropped or moved before their
+    deadline, so the cap costs latency rather than anyone's grace period.
+    """
+
+    def __init__(self, max_per_second: float = 0.0, burst: int = 10):
+        self.rate = max_per_second
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "DispatchLimiter":
+        """Build a limiter from the optional smoothing section of config.json; no cap unless one is set"""
+        settings = config.get("smoothing", {})
+        return cls(settings.get("max_dispatch_per_second", 0.0), settings.get("dispatch_burst", 10))
+
+    async def wait(self) -> None:
+        """Return once another action may go out"""
+        if self.rate <= 0:
+            return
+        started = time.monotonic()
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                break
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+        waited = time.monotonic() - started
+        if waited > 0:
+            METRICS.observe("timebomb_dispatch_wait_seconds", waited)
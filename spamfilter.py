@@ -0,0 +1,56 @@
+from collections import OrderedDict, deque
+import re
+import zlib
+
+NON_WORD = re.compile(r"[\W_]+")
+REPEATED = re.compile(r"(.)\1+")
+
+def normalize(content: str) -> str:
+    """Reduce a message to the part that matters for duplicate detection"""
+    # "Hello!!", "hello" and "heeello" all collapse to "helo"
+    return REPEATED.sub(r"\1", NON_WORD.sub("", content.lower()))
+
+class SpamFilter:
+    """Drops bursts and near-duplicate messages before they are counted"""
+
+    def __init__(self, window_size: int = 5, burst_seconds: float = 30.0,
+                 min_length: int = 3, max_users: int = 10000):
+        self.window_size = window_size
+        self.burst_seconds = burst_seconds
+        self.min_length = min_length
+        self.max_users = max_users
+        # user_id -> ring buffer of (timestamp, content hash), least recently active first
+        self.recent = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "SpamFilter":
+        """Build a filter from the optional spam_filter section of config.json"""
+        return cls(**config.get("spam_filter", {}))
+
+    def allow(self, user_id: str, content: str, timestamp: float) -> bool:
+        """Return True if a message should count, recording it if so"""
+        normalized = normalize(content)
+        if len(normalized) < self.min_length:
+            return False
+
+        buffer = self.recent.get(user_id)
+        if buffer is None:
+            buffer = deque(maxlen=self.window_size)
+            self.recent[user_id] = buffer
+            # Forget the least recently active user to keep memory bounded
+            if len(self.recent) > self.max_users:
+                self.recent.popitem(last=False)
+        else:
+            self.recent.move_to_end(user_id)
+
+        digest = zlib.crc32(normalized.encode())
+        for _, seen in buffer:
+            if seen == digest:
+                return False
+
+        # A full buffer whose oldest entry is still inside the window is a burst
+        if len(buffer) == self.window_size and timestamp - buffer[0][0] < self.burst_seconds:
+            return False
+
+        buffer.append((timestamp, digest))
+        return True
@@ -0,0 +1,191 @@
+import contextlib
+import datetime
+import gzip
+import json
+import logging
+import os
+from typing import Iterator, Optional
+import clock
+import phases
+
+ARCHIVE_FILE = "/data/archive.jsonl.gz"
+INDEX_FILE = "/data/archive_index.json"
+
+# Index journal lines written before the index file is rewritten
+JOURNAL_LIMIT = 1000
+
+def has_live_deadline(data: dict) -> bool:
+    """Whether a user still has a running TimeBomb that the sweep needs to watch"""
+    return phases.ENGINE.live(data) is not None
+
+def next_deadline(data: dict) -> Optional[datetime.datetime]:
+    """When a user's running TimeBomb goes off, or None if nothing is running"""
+    phase = phases.ENGINE.live(data)
+    return phase.deadline(data) if phase is not None else None
+
+def is_jailed(data: dict) -> bool:
+    """Whether the TimeBomb a user is on has failed"""
+    phase = phases.ENGINE.current(data)
+    return phase is not None and phase.failed(data)
+
+class ColdArchive:
+    """Append-only, gzip-compressed archive of users that no longer have a live deadline"""
+
+    def __init__(self, path: str = ARCHIVE_FILE, index_path: str = INDEX_FILE):
+        self.path = path
+        self.index_path = index_path
+        # Each append is its own gzip member, so single records can be read
+        # back without decompressing the whole file.
+        # user_id -> [offset, length] of the gzip member with their latest record
+        self.index = None
+        # Modification time of the index file when it was last read or written here
+        self.index_mtime = None
+        # Index changes since the index file was last rewritten, one JSON line each:
+        # [user_id, offset, length], or [user_id, null] once they are forgotten
+        self.journal_path = index_path + ".log"
+        # How far into the journal this process has replayed, and how many lines it has
+        self.journal_read = 0
+        self.journal_length = 0
+        # Inside batched(), journal lines still to write
+        self.deferred = None
+
+    def _index_mtime(self) -> Optional[int]:
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load_index(self) -> dict:
+        # Another process sharing the volume may have rewritten the index or added to the journal
+        mtime = self._index_mtime()
+        if self.index is None or mtime != self.index_mtime:
+            try:
+                with open(self.index_path, 'r') as f:
+                    self.index = json.load(f)
+            except FileNotFoundError:
+                self.index = {}
+            except Exception as e:
+                logging.error("Error loading archive index: %s", e, extra={"event": "archive_error"})
+                self.index = {}
+            self.index_mtime = mtime
+            self.journal_read = 0
+            self.journal_length = 0
+        self._replay_journal()
+        return self.index
+
+    def _replay_journal(self) -> None:
+        """Apply journal lines written since the last replay, our own included; applying one twice changes nothing"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self.journal_read)
+                tail = f.read()
+        except FileNotFoundError:
+            return
+        # A line still being written by another process waits for the next replay
+        complete = tail[:tail.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            try:
+                user_id, *location = json.loads(line)
+            except ValueError:
+                logging.warning("Skipping a damaged archive index journal line", extra={"event": "archive_error"})
+                continue
+            if location[0] is None:
+                self.index.pop(user_id, None)
+            else:
+                self.index[user_id] = location
+            self.journal_length += 1
+        self.journal_read += len(complete)
+
+    def _write_index(self) -> None:
+        """Rewrite the whole index file and start a new journal"""
+        with open(self.index_path + ".tmp", 'w') as f:
+            # json.dumps uses the C encoder; json.dump streams through the pure Python one
+            f.write(json.dumps(self.index, separators=(",", ":")))
+        os.replace(self.index_path + ".tmp", self.index_path)
+        # Everything in the journal is in the index file now
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.index_mtime = self._index_mtime()
+        self.journal_read = 0
+        self.journal_length = 0
+
+    def _save_index(self, changes: list) -> None:
+        """Journal index changes, rewriting the index file once the journal is long"""
+        lines = [json.dumps(change, separators=(",", ":")) + "\n" for change in changes]
+        if self.deferred is not None:
+            self.deferred += lines
+        else:
+            self._write_journal(lines)
+
+    def _write_journal(self, lines: list) -> None:
+        if self.journal_length + len(lines) > JOURNAL_LIMIT:
+            self._write_index()
+            return
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        with open(self.journal_path, 'a') as f:
+            f.write("".join(lines))
+
+    def append(self, entries: list) -> None:
+        """Archive a batch of (user_id, status, data) tuples in one write"""
+        if not entries:
+            return
+
+        archived_at = clock.utcnow().isoformat()
+        lines = [
+            json.dumps({"user_id": user_id, "status": status, "archived_at": archived_at, "data": data},
+                       separators=(",", ":"))
+            for user_id, status, data in entries
+        ]
+        member = gzip.compress(("\n".join(lines) + "\n").encode())
+
+        index = self._load_index()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'ab') as f:
+            offset = f.tell()
+            f.write(member)
+        for user_id, _, _ in entries:
+            index[user_id] = [offset, len(member)]
+        self._save_index([[user_id, offset, len(member)] for user_id, _, _ in entries])
+
+    @contextlib.contextmanager
+    def batched(self):
+        """Write the index changes of a block that archives or revives many users in one go"""
+        self.deferred = []
+        try:
+            yield self
+        finally:
+            lines, self.deferred = self.deferred, None
+            if lines:
+                self._write_journal(lines)
+
+    def lookup(self, user_id: str) -> Optional[dict]:
+        """Return the latest archived record for a user"""
+        location = self._load_index().get(user_id)
+        if location is None:
+            return None
+
+        offset, length = location
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            member = gzip.decompress(f.read(length))
+
+        record = None
+        for line in member.splitlines():
+            entry = json.loads(line)
+            if entry["user_id"] == user_id:
+                record = entry
+        return record
+
+    def forget(self, user_id: str) -> None:
+        """Drop a user from the index once they are back in the hot set"""
+        if self._load_index().pop(user_id, None) is not None:
+            self._save_index([[user_id, None]])
+
+    def export(self) -> Iterator[dict]:
+        """Stream every archived record, oldest first"""
+        try:
+            with gzip.open(self.path, 'rt') as f:
+                for line in f:
+                    yield json.loads(line)
+        except FileNotFoundError:
+            return
@@ -0,0 +1,353 @@
+"""Offline admin tool for the TimeBomb data store
+
+Works on the store config.json points the bot at, without going near
+Discord, so it stays quick on guilds with 100k tracked users:
+
+    python -m storeadmin query --state running --expiring 24
+    python -m storeadmin edit --phase second --extend 48 --dry-run
+    python -m storeadmin validate
+    python -m storeadmin compact
+    python -m storeadmin convert --to sqlite --path /data/timebomb.db
+
+Reading commands open the store read-only. Commands that write take the
+JSON data file's lock, which the bot holds for as long as it runs, or the
+guild's bulk job lease on a shared store, and give up straight away if
+someone else has it.
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import sys
+import clock
+import phases
+import storage
+import stores
+from guildstate import DATA_FILE, data_file, guild_archive, guild_configs
+from liveconfig import CONFIG_FILE, read_config
+from queryapi import user_status
+from sharding import Lease
+
+STATES = ("running", "paused", "jailed", "done")
+
+def resolve_guilds(config: dict, guild_id: int = None) -> list:
+    """(guild id, primary) for one guild, or every configured guild"""
+    primary = int(config["guild_id"]) if config.get("guild_id") else None
+    guild_ids = list(guild_configs(config))
+    if guild_id is not None:
+        if guild_id not in guild_ids:
+            raise SystemExit(f"Guild {guild_id} isn't in the config")
+        guild_ids = [guild_id]
+    return [(guild_id, guild_id == primary) for guild_id in guild_ids]
+
+@contextlib.contextmanager
+def opened(config: dict, guild_id: int, primary: bool, write: bool = False):
+    """(partition, user_data) for one guild, locked against other writers if `write`"""
+    try:
+        backend = stores.open_backend(config, read_only=not write)
+    except Exception as e:
+        raise SystemExit(f"Could not open the store: {e}")
+    path = data_file(guild_id, primary)
+    release = None
+    try:
+        if not backend.shared:
+            partition = stores.JsonPartition(path, stores.FileLock(path) if write else None)
+            if write:
+                if not partition.lock.acquire(wait=False):
+                    raise SystemExit(f"{path} is locked by the bot or another admin command; stop it first")
+                release = partition.lock.release
+        else:
+            partition = backend.partition(guild_id, path)
+            if write:
+                lease = Lease(backend, f"bulk:{guild_id}", config.get("sharding", {}).get("lease_seconds", 60))
+                if not lease.acquire():
+                    raise SystemExit(f"A bulk job is running on guild {guild_id}; try again when it is done")
+                release = lease.stop
+        try:
+            user_data = partition.load()
+        except FileNotFoundError:
+            user_data = {}
+        yield partition, user_data
+    finally:
+        if release is not None:
+            release()
+        backend.close()
+
+def find_phase(value: str):
+    """A phase by number or name"""
+    for phase in phases.ENGINE.phases:
+        if value in (str(phase.number), phase.name):
+            return phase
+    return None
+
+def select(user_data: dict, args, now: datetime.datetime) -> list:
+    """(user id, data, status) for the users the filters match, in id order"""
+    user_ids = args.user or sorted(user_data)
+    until = now + datetime.timedelta(hours=args.expiring) if args.expiring is not None else None
+    matches = []
+    for user_id in user_ids:
+        data = user_data.get(user_id)
+        if data is None:
+            continue
+        status = user_status(user_id, data)
+        if args.phase is not None and status["phase"] != args.phase.number:
+            continue
+        if args.state is not None and status["state"] != args.state:
+            continue
+        if until is not None and (status["deadline"] is None or datetime.datetime.fromisoformat(status["deadline"]) > until):
+            continue
+        matches.append((user_id, data, status))
+    return matches
+
+def query(config: dict, args) -> int:
+    """Print matching users as JSON lines, or just how many there are"""
+    now = clock.utcnow()
+    for guild_id, primary in resolve_guilds(config, args.guild):
+        with opened(config, guild_id, primary) as (_, user_data):
+            matches = select(user_data, args, now)
+            if args.count:
+                print(json.dumps({"guild_id": guild_id, "count": len(matches), "total": len(user_data)}))
+                continue
+            out = sys.stdout
+            for _, _, status in matches[:args.limit]:
+                out.write(json.dumps(status) + "\n")
+
+            # Jailed, completed and departed users only live in the cold archive
+            missing = [user_id for user_id in args.user or () if user_id not in user_data]
+            if missing:
+                archive = guild_archive(guild_id, primary)
+                for user_id in missing:
+                    record = archive.lookup(user_id)
+                    if record is not None:
+                        status = user_status(user_id, record["data"])
+                        status["archived"] = record["status"]
+                        out.write(json.dumps(status) + "\n")
+    return 0
+
+def apply_edit(args, phase: phases.Phase, data: dict, now: datetime.datetime) -> bool:
+    """Make one edit to one user's record; False when it doesn't apply to them"""
+    if args.extend is not None:
+        if phase is None or phase.failed(data):
+            return False
+        phase.extend(data, datetime.timedelta(hours=args.extend), now)
+    elif args.pause:
+        if phase is None or phase.failed(data) or phase.paused(data):
+            return False
+        phase.pause(data, now)
+    elif args.resume:
+        if phase is None or not phase.paused(data):
+            return False
+        phase.resume(data, now)
+    elif args.set is not None:
+        field, value = args.set
+        data[field] = value
+    elif args.unset is not None:
+        if args.unset not in data:
+            return False
+        del data[args.unset]
+    return True
+
+def edit(config: dict, args) -> int:
+    """Apply one change to every matching user, saved in one go"""
+    if not (args.user or args.phase or args.state or args.expiring is not None or args.all):
+        raise SystemExit("Pick users with --user, --phase, --state or --expiring, or pass --all")
+    now = clock.utcnow()
+    (guild_id, primary), = resolve_guilds(config, args.guild)
+    with opened(config, guild_id, primary, write=not args.dry_run) as (partition, user_data):
+        matches = select(user_data, args, now)
+        changed = []
+        for user_id, data, _ in matches:
+            if args.delete:
+                changed.append(user_id)
+            elif apply_edit(args, phases.ENGINE.current(data), data, now):
+                changed.append(user_id)
+        if args.dry_run:
+            print(f"Would change {len(changed)} of {len(matches)} matching users")
+            return 0
+        if args.delete:
+            for user_id in changed:
+                del user_data[user_id]
+        if changed:
+            partition.save(user_data, changed)
+            partition.flush(user_data)
+        print(f"Changed {len(changed)} of {len(matches)} matching users")
+    return 0
+
+def record_problems(data) -> list:
+    """What is wrong with one stored record, as messages"""
+    if not isinstance(data, dict):
+        return ["record is not an object"]
+    problems = []
+
+    def check_time(key):
+        try:
+            datetime.datetime.fromisoformat(data[key])
+        except (TypeError, ValueError):
+            problems.append(f"{key} is not a timestamp: {data[key]!r}")
+
+    if "join_date" in data:
+        check_time("join_date")
+    if not isinstance(data.get("warnings_sent", {}), dict):
+        problems.append("warnings_sent is not an object")
+    for phase in phases.ENGINE.phases:
+        if phase.end_key in data:
+            check_time(phase.end_key)
+        if phase.paused_key in data:
+            left = data[phase.paused_key]
+            if not isinstance(left, (int, float)) or isinstance(left, bool) or left < 0:
+                problems.append(f"{phase.paused_key} is not a number of seconds: {left!r}")
+            if phase.end_key in data:
+                problems.append(f"{phase.name} has both a deadline and paused time")
+        for key in (phase.failed_key, phase.active_key):
+            if key in data and not isinstance(data[key], bool):
+                problems.append(f"{key} is not true or false: {data[key]!r}")
+    return problems
+
+def index_problems(partition, user_data: dict) -> list:
+    """(user id, message) where Redis' deadline index disagrees with the records"""
+    if not isinstance(partition, stores.RedisPartition):
+        return []
+    indexed = dict(partition.redis.zrange(partition.deadlines_key, 0, -1, withscores=True))
+    problems = []
+    for user_id, data in user_data.items():
+        deadline = storage.next_deadline(data)
+        # Scored like RedisPartition.save does, in naive UTC epoch seconds
+        expected = deadline.replace(tzinfo=datetime.timezone.utc).timestamp() if deadline is not None else None
+        if indexed.pop(user_id, None) != expected:
+            problems.append((user_id, "deadline index is out of date"))
+    problems += [(user_id, "deadline index has a user that isn't stored") for user_id in indexed]
+    return problems
+
+def validate(config: dict, args) -> int:
+    """Check every record; exits with 1 if anything is wrong"""
+    found = 0
+    for guild_id, primary in resolve_guilds(config, args.guild):
+        with opened(config, guild_id, primary) as (partition, user_data):
+            problems = []
+            for user_id, data in user_data.items():
+                problems += [(user_id, problem) for problem in record_problems(data)]
+            try:
+                problems += index_problems(partition, user_data)
+            except Exception as e:
+                problems.append(("-", f"could not read the deadline index: {e}"))
+            for user_id, problem in problems:
+                print(f"{guild_id} {user_id}: {problem}")
+            print(f"Guild {guild_id}: {len(user_data)} records, {len(problems)} problems")
+            found += len(problems)
+    return 1 if found else 0
+
+def compact(config: dict, args) -> int:
+    """Reclaim space the store no longer needs"""
+    for guild_id, primary in resolve_guilds(config, args.guild):
+        with opened(config, guild_id, primary, write=True) as (partition, user_data):
+            if hasattr(partition, "compact"):
+                print(f"Guild {guild_id}: dropped {partition.compact()} stale entries")
+                continue
+
+            # The lock means the bot is stopped, so jailed users it hasn't
+            # archived yet can go to the cold archive the way it would at startup
+            jailed = [user_id for user_id, data in user_data.items() if storage.is_jailed(data)]
+            if jailed:
+                guild_archive(guild_id, primary).append([(user_id, "jailed", user_data.pop(user_id)) for user_id in jailed])
+            before = os.path.getsize(partition.path) if os.path.exists(partition.path) else 0
+            partition.save(user_data)
+            print(f"Guild {guild_id}: archived {len(jailed)} jailed users, {before} -> {os.path.getsize(partition.path)} bytes")
+    return 0
+
+def convert(config: dict, args) -> int:
+    """Copy every guild's users into another store backend"""
+    settings = {"backend": args.to, "path": args.path or stores.SQLITE_FILE, "url": args.url, "prefix": args.prefix}
+    target = stores.open_backend({"store": settings})
+    try:
+        for guild_id, primary in resolve_guilds(config, args.guild):
+            with opened(config, guild_id, primary) as (_, user_data):
+                if args.to == "json":
+                    # Same layout as /data, under the given directory
+                    destination = os.path.join(args.path, os.path.relpath(data_file(guild_id, primary), os.path.dirname(DATA_FILE)))
+                    partition = stores.JsonPartition(destination)
+                else:
+                    partition = target.partition(guild_id, None)
+                try:
+                    existing = partition.load()
+                except FileNotFoundError:
+                    existing = {}
+                if existing and not args.force:
+                    raise SystemExit(f"Guild {guild_id} already has {len(existing)} users there; pass --force to replace them")
+                partition.save(user_data)
+                print(f"Guild {guild_id}: copied {len(user_data)} users")
+    finally:
+        target.close()
+    return 0
+
+def add_filters(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--user", action="append", help="user id; repeat for more")
+    parser.add_argument("--phase", help="phase number or name")
+    parser.add_argument("--state", choices=STATES)
+    parser.add_argument("--expiring", type=float, metavar="HOURS", help="running TimeBombs that go off within HOURS")
+
+def set_field(value: str) -> tuple:
+    field, _, encoded = value.partition("=")
+    try:
+        return field, json.loads(encoded)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected FIELD=JSON")
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m storeadmin", description="Offline admin tool for the TimeBomb data store")
+    parser.add_argument("--config", default=CONFIG_FILE)
+    parser.add_argument("--guild", type=int, help="guild id; the one in the top-level config by default")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    query_parser = commands.add_parser("query", help="print users as JSON lines")
+    add_filters(query_parser)
+    query_parser.add_argument("--limit", type=int, default=None)
+    query_parser.add_argument("--count", action="store_true", help="only count the matches")
+    query_parser.set_defaults(func=query, every_guild=False)
+
+    edit_parser = commands.add_parser("edit", help="change every matching user in one save")
+    add_filters(edit_parser)
+    edit_parser.add_argument("--all", action="store_true", help="edit every user when no filter is given")
+    edit_parser.add_argument("--dry-run", action="store_true")
+    change = edit_parser.add_mutually_exclusive_group(required=True)
+    change.add_argument("--extend", type=float, metavar="HOURS", help="add HOURS to running or paused TimeBombs")
+    change.add_argument("--pause", action="store_true")
+    change.add_argument("--resume", action="store_true")
+    change.add_argument("--set", type=set_field, metavar="FIELD=JSON")
+    change.add_argument("--unset", metavar="FIELD")
+    change.add_argument("--delete", action="store_true", help="drop the users' records")
+    edit_parser.set_defaults(func=edit, every_guild=False)
+
+    validate_parser = commands.add_parser("validate", help="check every record and the deadline index")
+    validate_parser.set_defaults(func=validate, every_guild=True)
+
+    compact_parser = commands.add_parser("compact", help="reclaim space the store no longer needs")
+    compact_parser.set_defaults(func=compact, every_guild=True)
+
+    convert_parser = commands.add_parser("convert", help="copy users into another store backend")
+    convert_parser.add_argument("--to", choices=sorted(stores.BACKENDS), required=True)
+    convert_parser.add_argument("--path", help="SQLite database, or directory for JSON files")
+    convert_parser.add_argument("--url", default="redis://localhost:6379/0")
+    convert_parser.add_argument("--prefix", default="timebomb")
+    convert_parser.add_argument("--force", action="store_true", help="replace users already at the destination")
+    convert_parser.set_defaults(func=convert, every_guild=True)
+
+    args = parser.parse_args(argv)
+    if args.command == "convert" and args.to == "json" and not args.path:
+        parser.error("--to json needs --path")
+    config = read_config(args.config)
+    # Phase keys shape the stored data, so they come from the same config as the bot's
+    phases.configure(config)
+    if getattr(args, "phase", None) is not None:
+        phase = find_phase(args.phase)
+        if phase is None:
+            parser.error(f"no phase {args.phase!r}")
+        args.phase = phase
+    if args.guild is None and not args.every_guild:
+        if not config.get("guild_id"):
+            parser.error("--guild is needed when the config has no top-level guild_id")
+        args.guild = int(config["guild_id"])
+    return args.func(config, args)
+
+if __name__ == "__main__":
+    sys.exit(main())
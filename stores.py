@@ -0,0 +1,567 @@
+import contextlib
+import datetime
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import time
+import storage
+from metrics import METRICS
+
+# Shared database used when several processes run the bot against one volume
+SQLITE_FILE = "/data/timebomb.db"
+
+def _dumps(data) -> str:
+    return json.dumps(data, separators=(",", ":"))
+
+def _scan_due(user_data: dict, until: datetime.datetime) -> list:
+    """Users whose running TimeBomb goes off by `until`, soonest first, found by looking at everyone"""
+    due = []
+    for user_id, data in user_data.items():
+        deadline = storage.next_deadline(data)
+        if deadline is not None and deadline <= until:
+            due.append((deadline, user_id))
+    due.sort()
+    return [user_id for _, user_id in due]
+
+class FileLock:
+    """Advisory lock on a file next to a JSON data file, so only one process ever writes it"""
+
+    # lock file path -> open handle, for locks this process holds
+    held = {}
+
+    def __init__(self, path: str):
+        self.path = path + ".lock"
+
+    def acquire(self, wait: bool = True) -> bool:
+        """Take the lock, or with wait=False return False when another process has it"""
+        if self.path in FileLock.held:
+            return True
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        handle = open(self.path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | (0 if wait else fcntl.LOCK_NB))
+        except BlockingIOError:
+            handle.close()
+            return False
+        FileLock.held[self.path] = handle
+        return True
+
+    def release(self) -> None:
+        handle = FileLock.held.pop(self.path, None)
+        if handle is not None:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+class JsonPartition:
+    """One guild's users in a single JSON file, rewritten on every full save
+
+    Saving a few users would still mean rewriting the whole file, so those
+    saves only mark it dirty and the next full save or flush() writes them.
+
+    With a lock the partition takes it on first use and keeps it, so the
+    admin CLI can't write the file while the bot has it loaded.
+    """
+
+    def __init__(self, path: str, lock: FileLock = None):
+        self.path = path
+        self.lock = lock
+        # Whether saved users are waiting for the file to be rewritten
+        self.dirty = False
+
+    def load(self) -> dict:
+        if self.lock is not None and not self.lock.acquire(wait=False):
+            logging.warning("Waiting for another process to release %s", self.path, extra={"event": "store_locked"})
+            self.lock.acquire()
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def save(self, user_data: dict, user_ids=None) -> None:
+        if user_ids is not None:
+            self.dirty = True
+            return
+        if self.lock is not None:
+            self.lock.acquire()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # json.dumps without indent takes the C encoder; json.dump never does
+        encoded = json.dumps(user_data, separators=(",", ":"))
+        # Readers, like the admin CLI, never see a half-written file
+        with open(self.path + ".tmp", 'w') as f:
+            f.write(encoded)
+        os.replace(self.path + ".tmp", self.path)
+        self.dirty = False
+
+    def flush(self, user_data: dict) -> None:
+        """Write users saved since the last rewrite"""
+        if self.dirty:
+            self.save(user_data)
+
+    def refresh(self, user_data: dict) -> int:
+        # Only one process ever writes the file
+        return 0
+
+    def due(self, user_data: dict, until: datetime.datetime) -> list:
+        return _scan_due(user_data, until)
+
+class JsonBackend:
+    """The original layout: a JSON file per guild, usable by a single process only"""
+    shared = False
+
+    def partition(self, guild_id: int, data_file: str) -> JsonPartition:
+        return JsonPartition(data_file, FileLock(data_file))
+
+    def import_json(self, guild_id: int, data_file: str) -> int:
+        return 0
+
+    def acquire_lease(self, name: str, holder: str, seconds: float) -> bool:
+        return True
+
+    def release_lease(self, name: str, holder: str) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+class SQLitePartition:
+    """One guild's rows in the shared database
+
+    Saves write only the users whose record changed since this process last
+    saw it, so processes never overwrite each other's users.
+    """
+
+    def __init__(self, backend: "SQLiteBackend", guild_id: int):
+        self.backend = backend
+        self.guild_id = guild_id
+        # user_id -> record as last read from or written to the database
+        self.snapshot = {}
+        # Highest change sequence number this process has seen
+        self.seq = 0
+
+    def load(self) -> dict:
+        rows = self.backend.connection.execute(
+            "SELECT user_id, data, seq FROM users WHERE guild_id = ?", (self.guild_id,)
+        ).fetchall()
+        self.snapshot = {user_id: data for user_id, data, _ in rows if data is not None}
+        self.seq = max((seq for _, _, seq in rows), default=0)
+        return {user_id: json.loads(data) for user_id, data in self.snapshot.items()}
+
+    def save(self, user_data: dict, user_ids=None) -> None:
+        """Write the users whose record changed; `user_ids` limits the check to those users"""
+        changed = []
+        for user_id in user_data if user_ids is None else user_ids:
+            data = user_data.get(user_id)
+            if data is None:
+                continue
+            encoded = _dumps(data)
+            if self.snapshot.get(user_id) != encoded:
+                changed.append((user_id, encoded))
+        candidates = self.snapshot if user_ids is None else user_ids
+        removed = [user_id for user_id in candidates if user_id not in user_data and user_id in self.snapshot]
+        if not changed and not removed:
+            return
+
+        with self.backend.transaction() as connection:
+            seq = self.backend.next_seq(connection)
+            connection.executemany(
+                "INSERT INTO users (guild_id, user_id, data, seq) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (guild_id, user_id) DO UPDATE SET data = excluded.data, seq = excluded.seq",
+                [(self.guild_id, user_id, encoded, seq) for user_id, encoded in changed]
+            )
+            # Deleted users stay behind as empty rows so other processes notice on refresh
+            connection.executemany(
+                "UPDATE users SET data = NULL, seq = ? WHERE guild_id = ? AND user_id = ?",
+                [(seq, self.guild_id, user_id) for user_id in removed]
+            )
+        self.snapshot.update(changed)
+        for user_id in removed:
+            del self.snapshot[user_id]
+        METRICS.inc("timebomb_store_rows_written_total", len(changed) + len(removed), backend="sqlite")
+
+    def _unsaved(self, user_id: str, local) -> bool:
+        saved = self.snapshot.get(user_id)
+        if local is None:
+            return saved is not None
+        return saved is None or _dumps(local) != saved
+
+    def refresh(self, user_data: dict) -> int:
+        """Pull in users other processes changed, updating records in place so held references stay current"""
+        rows = self.backend.connection.execute(
+            "SELECT user_id, data, seq FROM users WHERE guild_id = ? AND seq > ?", (self.guild_id, self.seq)
+        ).fetchall()
+        applied = 0
+        for user_id, encoded, seq in rows:
+            self.seq = max(self.seq, seq)
+            if self.snapshot.get(user_id) == encoded:
+                # Our own write coming back
+                continue
+            local = user_data.get(user_id)
+            if self._unsaved(user_id, local):
+                # Changed here too and not saved yet; our save wins
+                continue
+
+            if encoded is None:
+                user_data.pop(user_id, None)
+                self.snapshot.pop(user_id, None)
+            elif local is not None:
+                local.clear()
+                local.update(json.loads(encoded))
+                self.snapshot[user_id] = encoded
+            else:
+                user_data[user_id] = json.loads(encoded)
+                self.snapshot[user_id] = encoded
+            applied += 1
+        return applied
+
+    def due(self, user_data: dict, until: datetime.datetime) -> list:
+        return _scan_due(user_data, until)
+
+    def flush(self, user_data: dict) -> None:
+        # Every save is already written
+        pass
+
+    def compact(self) -> int:
+        """Drop the empty rows of users deleted before the last compaction, then VACUUM
+
+        Newer ones stay until the next run, so every process has had time to
+        refresh past them. Returns how many rows went.
+        """
+        marker_name = f"compacted_seq:{self.guild_id}"
+        with self.backend.transaction() as connection:
+            marker = connection.execute("SELECT value FROM counters WHERE name = ?", (marker_name,)).fetchone()
+            purged = connection.execute(
+                "DELETE FROM users WHERE guild_id = ? AND data IS NULL AND seq <= ?", (self.guild_id, marker[0] if marker else 0)
+            ).rowcount
+            connection.execute("INSERT OR REPLACE INTO counters (name, value) SELECT ?, value FROM counters WHERE name = 'seq'", (marker_name,))
+        self.backend.connection.execute("VACUUM")
+        return purged
+
+class SQLiteBackend:
+    """Every guild's users, plus scheduler leases, in one SQLite database in WAL mode"""
+    shared = True
+
+    def __init__(self, path: str = SQLITE_FILE, busy_timeout: float = 5.0, read_only: bool = False):
+        if read_only:
+            # For the admin CLI; the schema has to be there already
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, isolation_level=None, timeout=busy_timeout, check_same_thread=False)
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Autocommit; writes open their own BEGIN IMMEDIATE transactions
+        self.connection = sqlite3.connect(path, isolation_level=None, timeout=busy_timeout, check_same_thread=False)
+        # WAL lets every process read while one of them writes
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS users (
+                guild_id INTEGER NOT NULL,
+                user_id TEXT NOT NULL,
+                data TEXT,
+                seq INTEGER NOT NULL,
+                PRIMARY KEY (guild_id, user_id)
+            );
+            CREATE INDEX IF NOT EXISTS users_by_seq ON users (guild_id, seq);
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO counters (name, value) VALUES ('seq', 0);
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                holder TEXT NOT NULL,
+                expires REAL NOT NULL
+            );
+        """)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back on error"""
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def next_seq(self, connection) -> int:
+        # Inside BEGIN IMMEDIATE, so no other process can hand out the same number
+        connection.execute("UPDATE counters SET value = value + 1 WHERE name = 'seq'")
+        return connection.execute("SELECT value FROM counters WHERE name = 'seq'").fetchone()[0]
+
+    def partition(self, guild_id: int, data_file: str) -> SQLitePartition:
+        return SQLitePartition(self, guild_id)
+
+    def import_json(self, guild_id: int, data_file: str) -> int:
+        """Seed an empty partition from a guild's old JSON data file"""
+        if self.connection.execute("SELECT 1 FROM users WHERE guild_id = ? LIMIT 1", (guild_id,)).fetchone():
+            return 0
+        try:
+            user_data = JsonPartition(data_file).load()
+        except FileNotFoundError:
+            return 0
+        SQLitePartition(self, guild_id).save(user_data)
+        return len(user_data)
+
+    def acquire_lease(self, name: str, holder: str, seconds: float) -> bool:
+        """Take or renew a lease; False while another holder's lease is still running"""
+        now = time.time()
+        with self.transaction() as connection:
+            row = connection.execute("SELECT holder, expires FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is not None and row[0] != holder and row[1] > now:
+                return False
+            connection.execute(
+                "INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires",
+                (name, holder, now + seconds)
+            )
+        return True
+
+    def release_lease(self, name: str, holder: str) -> None:
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM leases WHERE name = ? AND holder = ?", (name, holder))
+
+    def close(self) -> None:
+        self.connection.close()
+
+def _epoch(when: datetime.datetime) -> float:
+    # Stored timestamps are naive UTC
+    return when.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+class RedisPartition:
+    """One guild's users on a Redis-compatible server
+
+    Each user is a hash of JSON-encoded top-level fields. A sorted set scores
+    users by their next deadline, so the sweep finds who is due with one
+    range query. A second sorted set scores users by the change sequence of
+    their last write, which is how other processes find what to refresh.
+    """
+
+    def __init__(self, backend: "RedisBackend", guild_id: int):
+        self.backend = backend
+        self.redis = backend.redis
+        self.guild_id = guild_id
+        prefix = f"{backend.prefix}:{guild_id}"
+        self.user_prefix = prefix + ":user:"
+        self.users_key = prefix + ":users"
+        self.deadlines_key = prefix + ":deadlines"
+        self.changes_key = prefix + ":changes"
+        self.compacted_key = prefix + ":compacted"
+        # user_id -> {field: encoded value} as last read from or written to the server
+        self.snapshot = {}
+        self.seq = 0
+
+    def load(self) -> dict:
+        # Read the sequence first, so writes racing the load come back on the next refresh
+        self.seq = int(self.redis.get(self.backend.seq_key) or 0)
+        user_ids = list(self.redis.smembers(self.users_key))
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipe.hgetall(self.user_prefix + user_id)
+        self.snapshot = dict(zip(user_ids, pipe.execute()))
+        return {
+            user_id: {field: json.loads(value) for field, value in fields.items()}
+            for user_id, fields in self.snapshot.items()
+        }
+
+    def save(self, user_data: dict, user_ids=None) -> None:
+        """Write the users whose record changed; `user_ids` limits the check to those users
+
+        A single user's save costs one hash update plus O(log n) sorted set
+        updates, so moving one deadline never touches the rest of the guild.
+        """
+        changed = []
+        for user_id in user_data if user_ids is None else user_ids:
+            data = user_data.get(user_id)
+            if data is None:
+                continue
+            encoded = {field: _dumps(value) for field, value in data.items()}
+            if self.snapshot.get(user_id) != encoded:
+                changed.append((user_id, encoded))
+        candidates = self.snapshot if user_ids is None else user_ids
+        removed = [user_id for user_id in candidates if user_id not in user_data and user_id in self.snapshot]
+        if not changed and not removed:
+            return
+
+        seq = self.redis.incr(self.backend.seq_key)
+        # Every change from one save goes out in a single MULTI/EXEC round trip
+        pipe = self.redis.pipeline()
+        for user_id, encoded in changed:
+            key = self.user_prefix + user_id
+            previous = self.snapshot.get(user_id, {})
+            dropped = [field for field in previous if field not in encoded]
+            if dropped:
+                pipe.hdel(key, *dropped)
+            updated = {field: value for field, value in encoded.items() if previous.get(field) != value}
+            if updated:
+                pipe.hset(key, mapping=updated)
+            pipe.sadd(self.users_key, user_id)
+            deadline = storage.next_deadline(user_data[user_id])
+            if deadline is not None:
+                pipe.zadd(self.deadlines_key, {user_id: _epoch(deadline)})
+            else:
+                pipe.zrem(self.deadlines_key, user_id)
+            pipe.zadd(self.changes_key, {user_id: seq})
+        for user_id in removed:
+            pipe.delete(self.user_prefix + user_id)
+            pipe.srem(self.users_key, user_id)
+            pipe.zrem(self.deadlines_key, user_id)
+            pipe.zadd(self.changes_key, {user_id: seq})
+        pipe.execute()
+
+        self.snapshot.update(changed)
+        for user_id in removed:
+            del self.snapshot[user_id]
+        METRICS.inc("timebomb_store_rows_written_total", len(changed) + len(removed), backend="redis")
+
+    def _unsaved(self, user_id: str, local) -> bool:
+        saved = self.snapshot.get(user_id)
+        if local is None:
+            return saved is not None
+        return saved is None or {field: _dumps(value) for field, value in local.items()} != saved
+
+    def refresh(self, user_data: dict) -> int:
+        """Pull in users other processes changed, updating records in place so held references stay current"""
+        entries = self.redis.zrangebyscore(self.changes_key, f"({self.seq}", "+inf", withscores=True)
+        if not entries:
+            return 0
+        pipe = self.redis.pipeline(transaction=False)
+        for user_id, _ in entries:
+            pipe.sismember(self.users_key, user_id)
+            pipe.hgetall(self.user_prefix + user_id)
+        results = pipe.execute()
+
+        applied = 0
+        for i, (user_id, seq) in enumerate(entries):
+            self.seq = max(self.seq, int(seq))
+            fields = results[2 * i + 1] if results[2 * i] else None
+            if self.snapshot.get(user_id) == fields:
+                continue
+            local = user_data.get(user_id)
+            if self._unsaved(user_id, local):
+                continue
+
+            if fields is None:
+                user_data.pop(user_id, None)
+                self.snapshot.pop(user_id, None)
+                applied += 1
+                continue
+            data = {field: json.loads(value) for field, value in fields.items()}
+            if local is not None:
+                local.clear()
+                local.update(data)
+            else:
+                user_data[user_id] = data
+            self.snapshot[user_id] = fields
+            applied += 1
+        return applied
+
+    def due(self, user_data: dict, until: datetime.datetime) -> list:
+        return self.redis.zrangebyscore(self.deadlines_key, "-inf", _epoch(until))
+
+    def flush(self, user_data: dict) -> None:
+        # Every save is already written
+        pass
+
+    def compact(self) -> int:
+        """Trim change entries of users deleted before the last compaction, and deadlines of users that are gone
+
+        Like SQLite's empty rows, newer change entries stay until the next
+        run so every process sees the delete. Returns how many entries went.
+        """
+        marker = self.redis.get(self.compacted_key) or 0
+        users = self.redis.smembers(self.users_key)
+        stale = [user_id for user_id in self.redis.zrangebyscore(self.changes_key, "-inf", marker) if user_id not in users]
+        orphans = [user_id for user_id in self.redis.zrange(self.deadlines_key, 0, -1) if user_id not in users]
+        pipe = self.redis.pipeline()
+        if stale:
+            pipe.zrem(self.changes_key, *stale)
+        if orphans:
+            pipe.zrem(self.deadlines_key, *orphans)
+        pipe.set(self.compacted_key, self.redis.get(self.backend.seq_key) or 0)
+        pipe.execute()
+        return len(stale) + len(orphans)
+
+class RedisBackend:
+    """Users and leases on a Redis-compatible server shared by every process"""
+    shared = True
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "timebomb", client=None):
+        if client is None:
+            try:
+                import redis
+            except ImportError as e:
+                raise SystemExit("The redis store needs the redis package: pip install redis") from e
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.prefix = prefix
+        self.seq_key = prefix + ":seq"
+
+    def partition(self, guild_id: int, data_file: str) -> RedisPartition:
+        return RedisPartition(self, guild_id)
+
+    def import_json(self, guild_id: int, data_file: str) -> int:
+        """Seed an empty partition from a guild's old JSON data file"""
+        partition = RedisPartition(self, guild_id)
+        if self.redis.exists(partition.users_key):
+            return 0
+        try:
+            user_data = JsonPartition(data_file).load()
+        except FileNotFoundError:
+            return 0
+        partition.save(user_data)
+        return len(user_data)
+
+    def acquire_lease(self, name: str, holder: str, seconds: float) -> bool:
+        """Take or renew a lease; False while another holder's lease is still running"""
+        key = f"{self.prefix}:lease:{name}"
+        milliseconds = int(seconds * 1000)
+        if self.redis.set(key, holder, nx=True, px=milliseconds):
+            return True
+        # Renew only if it is still ours, without racing a takeover
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) != holder:
+                    return False
+                pipe.multi()
+                pipe.set(key, holder, px=milliseconds)
+                pipe.execute()
+                return True
+            except Exception as e:
+                if type(e).__name__ == "WatchError":
+                    return False
+                raise
+
+    def release_lease(self, name: str, holder: str) -> None:
+        key = f"{self.prefix}:lease:{name}"
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.get(key) == holder:
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.execute()
+            except Exception as e:
+                if type(e).__name__ != "WatchError":
+                    raise
+
+    def close(self) -> None:
+        self.redis.close()
+
+# Backend name in config.json -> factory taking the rest of the store section and
+# whether to open it read-only, which only SQLite can enforce
+BACKENDS = {
+    "json": lambda settings, read_only: JsonBackend(),
+    "sqlite": lambda settings, read_only: SQLiteBackend(settings.get("path", SQLITE_FILE), settings.get("busy_timeout", 5.0), read_only),
+    "redis": lambda settings, read_only: RedisBackend(settings.get("url", "redis://localhost:6379/0"), settings.get("prefix", "timebomb")),
+}
+
+def open_backend(config: dict, read_only: bool = False):
+    """Open the store named in the optional store section of config.json"""
+    settings = config.get("store", {})
+    name = settings.get("backend", "json")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown store backend {name!r}")
+    backend = BACKENDS[name](settings, read_only)
+    logging.info("Using the %s store", name, extra={"event": "store_opened"})
+    return backend
@@ -0,0 +1,207 @@
+import datetime
+import hashlib
+import json
+import logging
+import os
+from typing import Optional
+import clock
+import phases
+
+TOMBSTONE_FILE = "/data/tombstones.json"
+BLOOM_FILE = "/data/tombstones.bloom"
+
+# Journal lines written before the exact store and bloom filter are rewritten
+JOURNAL_LIMIT = 1000
+
+class BloomFilter:
+    """Fixed-size bit array answering "definitely not seen" without touching the exact store"""
+
+    def __init__(self, size_bits: int = 1 << 20, hashes: int = 4, bits: Optional[bytearray] = None):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = bits if bits is not None else bytearray(size_bits // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=8 * self.hashes).digest()
+        for i in range(self.hashes):
+            yield int.from_bytes(digest[i * 8:(i + 1) * 8], "little") % self.size_bits
+
+    def add(self, key: str) -> None:
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class TombstoneIndex:
+    """Remembers the phase and deadline of members who left so rejoining can't reset their timer"""
+
+    def __init__(self, config: dict, path: str = None, bloom_path: str = None):
+        settings = config.get("tombstones", {})
+        self.path = path or TOMBSTONE_FILE
+        self.bloom_path = bloom_path or BLOOM_FILE
+        self.retention = datetime.timedelta(days=settings.get("retention_days", 90))
+        self.bloom = None
+        if settings.get("use_bloom", True):
+            self.bloom = BloomFilter(settings.get("bloom_bits", 1 << 20), settings.get("bloom_hashes", 4))
+        # Leaves and returns since the last rewrite, one JSON line each, replayed over the exact store
+        self.journal_path = self.path + ".log"
+        self.journal_length = 0
+        # Exact store, only read from disk the first time it's needed
+        self.entries = None
+
+    def load(self) -> None:
+        """Load the bloom filter; the exact store stays on disk until a possible match"""
+        if self.bloom is None:
+            return
+        try:
+            with open(self.bloom_path, 'rb') as f:
+                bits = bytearray(f.read())
+            if len(bits) == len(self.bloom.bits):
+                self.bloom.bits = bits
+            else:
+                # Filter was resized in config, rebuild it from the exact store
+                self._load_entries()
+                self._rebuild_bloom()
+        except FileNotFoundError:
+            if os.path.exists(self.path):
+                self._load_entries()
+                self._rebuild_bloom()
+                return
+        # Leavers since the last rewrite are only in the journal
+        for user_id, entry in self._read_journal():
+            if entry is not None:
+                self.bloom.add(user_id)
+
+    def _read_journal(self) -> list:
+        try:
+            with open(self.journal_path, 'r') as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return []
+        changes = []
+        for line in lines:
+            try:
+                changes.append(json.loads(line))
+            except ValueError:
+                # A line cut short by a crash mid-write
+                logging.warning("Skipping a damaged tombstone journal line", extra={"event": "tombstone_error"})
+        self.journal_length = len(changes)
+        return changes
+
+    def _load_entries(self) -> dict:
+        if self.entries is None:
+            try:
+                with open(self.path, 'r') as f:
+                    self.entries = json.load(f)
+            except FileNotFoundError:
+                self.entries = {}
+            except Exception as e:
+                logging.error("Error loading tombstones: %s", e, extra={"event": "tombstone_error"})
+                self.entries = {}
+            for user_id, entry in self._read_journal():
+                if entry is None:
+                    self.entries.pop(user_id, None)
+                else:
+                    self.entries[user_id] = entry
+        return self.entries
+
+    def _rebuild_bloom(self) -> None:
+        if self.bloom is None:
+            return
+        self.bloom.bits = bytearray(len(self.bloom.bits))
+        for user_id in self.entries:
+            self.bloom.add(user_id)
+
+    def save(self) -> None:
+        """Rewrite the exact store and bloom filter, dropping expired tombstones, and start a new journal"""
+        entries = self._load_entries()
+        cutoff = clock.utcnow() - self.retention
+        expired = [user_id for user_id, entry in entries.items()
+                   if datetime.datetime.fromisoformat(entry["left_at"]) < cutoff]
+        for user_id in expired:
+            del entries[user_id]
+        if expired:
+            self._rebuild_bloom()
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            with open(self.path + ".tmp", 'w') as f:
+                json.dump(entries, f, separators=(",", ":"))
+            os.replace(self.path + ".tmp", self.path)
+            if self.bloom is not None:
+                with open(self.bloom_path + ".tmp", 'wb') as f:
+                    f.write(self.bloom.bits)
+                os.replace(self.bloom_path + ".tmp", self.bloom_path)
+            # Everything in the journal is in the files now
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self.journal_length = 0
+        except Exception as e:
+            logging.error("Error saving tombstones: %s", e, extra={"event": "tombstone_error"})
+
+    def _write(self, user_id: str, entry: Optional[dict]) -> None:
+        """Journal one tombstone being added, or removed when `entry` is None, rewriting everything now and then"""
+        if self.journal_length >= JOURNAL_LIMIT:
+            self.save()
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        try:
+            with open(self.journal_path, 'a') as f:
+                f.write(json.dumps([user_id, entry], separators=(",", ":")) + "\n")
+            self.journal_length += 1
+        except Exception as e:
+            logging.error("Error saving tombstones: %s", e, extra={"event": "tombstone_error"})
+
+    def record(self, user_id: str, data: dict) -> None:
+        """Keep only what is needed to resume a leaver's TimeBomb"""
+        phase = phases.ENGINE.current(data)
+        if phase is None:
+            return
+
+        entry = self._load_entries()[user_id] = {
+            "phase": phase.number,
+            "deadline": data.get(phase.end_key),
+            "paused": data.get(phase.paused_key),
+            "jailed": phase.failed(data),
+            "join_date": data.get("join_date"),
+            "warnings": list(data.get("warnings_sent", {})),
+            # Progress towards the phase's requirements, so rejoining doesn't lose it
+            "activity": data.get("activity"),
+            "approved_posts": data.get("approved_posts"),
+            "left_at": clock.utcnow().isoformat()
+        }
+        if self.bloom is not None:
+            self.bloom.add(user_id)
+        self._write(user_id, entry)
+
+    def pop(self, user_id: str) -> Optional[dict]:
+        """Return and forget a returning member's tombstone"""
+        if self.bloom is not None and user_id not in self.bloom:
+            return None
+        tombstone = self._load_entries().pop(user_id, None)
+        if tombstone is not None:
+            self._write(user_id, None)
+        return tombstone
+
+def restore_user_data(tombstone: dict) -> dict:
+    """Rebuild a user_data record from a tombstone"""
+    warnings_sent = {key: tombstone["left_at"] for key in tombstone["warnings"]}
+    phase = phases.ENGINE.by_number[tombstone["phase"]]
+    data = {
+        "join_date": tombstone["join_date"] or tombstone["left_at"],
+        "warnings_sent": warnings_sent
+    }
+    for later in phases.ENGINE.phases[1:]:
+        data[later.active_key] = later is phase
+    if tombstone.get("paused") is not None:
+        data[phase.paused_key] = tombstone["paused"]
+    else:
+        data[phase.end_key] = tombstone["deadline"]
+    data[phase.failed_key] = tombstone["jailed"]
+    # Tombstones from before progress was kept have neither
+    if tombstone.get("activity") is not None:
+        data["activity"] = tombstone["activity"]
+    if tombstone.get("approved_posts") is not None:
+        data["approved_posts"] = tombstone["approved_posts"]
+    return data
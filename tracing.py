@@ -0,0 +1,175 @@
+import asyncio
+from collections import defaultdict
+import contextlib
+import contextvars
+import functools
+import logging
+import time
+import discord
+from metrics import METRICS
+
+# Discord drops interactions that get no response within 3 seconds
+DEFAULT_DEFER_AFTER = 2.0
+DEFAULT_SLOW_SECONDS = 1.0
+
+_current = contextvars.ContextVar("timebomb_trace", default=None)
+
+class Trace:
+    """Timings collected while one slash command runs"""
+
+    def __init__(self, command: str, interaction: discord.Interaction, defer_after: float):
+        self.command = command
+        self.interaction = interaction
+        self.defer_after = defer_after
+        self.started = time.perf_counter()
+        self.first_response = None
+        self.auto_deferred = False
+        self.deferring = None
+        self.responding = False
+        # span name -> [total seconds, calls]
+        self.spans = defaultdict(lambda: [0.0, 0])
+        self.store_seconds = 0.0
+        self.depth = 0
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def responded(self) -> None:
+        if self.first_response is None:
+            self.first_response = self.elapsed()
+
+    def summary(self) -> str:
+        spans = ", ".join(
+            f"{name} {seconds * 1000:.0f}ms x{calls}"
+            for name, (seconds, calls) in sorted(self.spans.items(), key=lambda item: -item[1][0])
+        )
+        first = f"{self.first_response * 1000:.0f}ms" if self.first_response is not None else "never"
+        return (
+            f"first response {first}{' (auto-deferred)' if self.auto_deferred else ''}, "
+            f"store {self.store_seconds * 1000:.0f}ms" + (f" [{spans}]" if spans else "")
+        )
+
+@contextlib.contextmanager
+def span(name: str):
+    """Time a store call against the command being traced, if any; also usable as a decorator"""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+
+    trace.depth += 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        trace.depth -= 1
+        totals = trace.spans[name]
+        totals[0] += duration
+        totals[1] += 1
+        # Nested spans are already inside their parent's time
+        if trace.depth == 0:
+            trace.store_seconds += duration
+
+async def _defer(interaction: discord.Interaction, trace: Trace) -> None:
+    if interaction.response.is_done():
+        return
+    try:
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        trace.auto_deferred = True
+        trace.responded()
+        logging.info("Auto-deferred /%s after %.2fs", trace.command, trace.elapsed(), extra={"event": "command_deferred"})
+    except (discord.HTTPException, discord.InteractionResponded) as e:
+        logging.warning("Could not defer /%s: %s", trace.command, e, extra={"event": "command_error"})
+
+def _start_defer(interaction: discord.Interaction, trace: Trace) -> None:
+    if trace.deferring is None and not trace.responding and not interaction.response.is_done():
+        trace.deferring = asyncio.create_task(_defer(interaction, trace))
+
+async def checkpoint() -> None:
+    """Called from long-running handlers: defer if the budget is nearly spent, and let the loop breathe"""
+    trace = _current.get()
+    if trace is not None and trace.elapsed() >= trace.defer_after:
+        _start_defer(trace.interaction, trace)
+        if trace.deferring is not None:
+            await trace.deferring
+    else:
+        await asyncio.sleep(0)
+
+class TracedResponse:
+    """Wraps InteractionResponse so handlers keep working after an automatic defer"""
+
+    def __init__(self, interaction: discord.Interaction, trace: Trace):
+        self._interaction = interaction
+        self._response = interaction.response
+        self._trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self._response, name)
+
+    async def _settle(self) -> None:
+        if self._trace.deferring is not None:
+            await self._trace.deferring
+
+    async def send_message(self, content=None, **kwargs):
+        await self._settle()
+        self._trace.responding = True
+        if self._trace.auto_deferred:
+            # The deferred "thinking" message is replaced by the first followup
+            kwargs.pop("delete_after", None)
+            result = await self._interaction.followup.send(content, **kwargs)
+        else:
+            result = await self._response.send_message(content, **kwargs)
+        self._trace.responded()
+        return result
+
+    async def defer(self, **kwargs):
+        await self._settle()
+        if self._trace.auto_deferred:
+            return None
+        self._trace.responding = True
+        result = await self._response.defer(**kwargs)
+        self._trace.responded()
+        return result
+
+class TracedInteraction:
+    """The interaction a traced handler sees; everything but the response passes straight through"""
+
+    def __init__(self, interaction: discord.Interaction, trace: Trace):
+        self._interaction = interaction
+        self.response = TracedResponse(interaction, trace)
+
+    def __getattr__(self, name):
+        return getattr(self._interaction, name)
+
+def traced(callback):
+    """Trace an AdminCommands slash command and defer it automatically when it runs long"""
+    @functools.wraps(callback)
+    async def wrapper(cog, interaction: discord.Interaction, *args, **kwargs):
+        settings = cog.bot.CONFIG.get("tracing", {})
+        trace = Trace(callback.__name__, interaction, settings.get("defer_after", DEFAULT_DEFER_AFTER))
+        token = _current.set(trace)
+        # Fires only when the handler yields; blocking handlers call checkpoint() instead
+        timer = asyncio.get_running_loop().call_later(trace.defer_after, _start_defer, interaction, trace)
+        try:
+            return await callback(cog, TracedInteraction(interaction, trace), *args, **kwargs)
+        finally:
+            timer.cancel()
+            _current.reset(token)
+            if trace.deferring is not None and not trace.deferring.done():
+                await trace.deferring
+
+            total = trace.elapsed()
+            if trace.first_response is not None:
+                METRICS.observe("timebomb_command_first_response_seconds", trace.first_response, command=trace.command)
+            METRICS.observe("timebomb_command_store_seconds", trace.store_seconds, command=trace.command)
+            if trace.auto_deferred:
+                METRICS.inc("timebomb_command_auto_deferred_total", command=trace.command)
+            if total >= settings.get("slow_seconds", DEFAULT_SLOW_SECONDS):
+                logging.warning(
+                    "Slow /%s took %.2fs: %s", trace.command, total, trace.summary(),
+                    extra={"event": "slow_command", "command": trace.command, "duration": total,
+                           "first_response": trace.first_response, "store_seconds": trace.store_seconds,
+                           "spans": {name: seconds for name, (seconds, _) in trace.spans.items()}}
+                )
+    return wrapper
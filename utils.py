@@ -2,6 +2,9 @@ import discord
 import datetime
 from typing import Optional
 import logging
+import tombstones
+import clock
+import phases
 
 async def send_warning_message(user: discord.Member, time_left: str, phase: int) -> None:
     """Send a warning message to a user with exact specified format"""
@@ -13,24 +16,23 @@ async def send_warning_message(user: discord.Member, time_left: str, phase: int)
     
     try:
         await user.send(embed=embed)
-        logging.info(f"Warning sent to {user.id} for phase {phase} - {time_left} remaining")
+        logging.info("Warning sent to %s for phase %s - %s remaining", user.id, phase, time_left, extra={"user_id": user.id, "phase": phase, "event": "warning_sent"})
     except discord.Forbidden:
-        logging.warning(f"Could not send warning to {user.id}")
+        logging.warning("Could not send warning to %s", user.id, extra={"user_id": user.id, "event": "dm_failed"})
 
-async def handle_bomb_failure(guild: discord.Guild, user_id: int, phase: int) -> None:
+async def handle_bomb_failure(bot, guild: discord.Guild, user_id: int, phase: phases.Phase) -> None:
     """Handle when a user fails a TimeBomb"""
     member = guild.get_member(user_id)
     if not member:
         return
         
-    role_id = CONFIG["roles"]["first_jail"] if phase == 1 else CONFIG["roles"]["second_jail"]
-    jail_role = guild.get_role(role_id)
+    jail_role = guild.get_role(bot.CONFIG["roles"][phase.jail_role])
     
     if not jail_role:
         return
         
     try:
-        await member.add_roles(jail_role)
+        await bot.role_transitions.apply(member, add=[jail_role], reason=f"Phase {phase.number} TimeBomb ran out")
         
         embed = discord.Embed(
             title="⚠️ Challenge Failed",
@@ -47,11 +49,14 @@ async def handle_bomb_failure(guild: discord.Guild, user_id: int, phase: int) ->
 
 def format_time_remaining(end_time: datetime.datetime) -> Optional[str]:
     """Format the remaining time in a human-readable format"""
-    now = datetime.datetime.utcnow()
+    now = clock.utcnow()
     if end_time < now:
         return None
         
-    remaining = end_time - now
+    return format_duration(end_time - now)
+
+def format_duration(remaining: datetime.timedelta) -> str:
+    """Format a stretch of time like the warnings do"""
     days = remaining.days
     hours = remaining.seconds // 3600
     minutes = (remaining.seconds % 3600) // 60
@@ -61,11 +66,86 @@ def format_time_remaining(end_time: datetime.datetime) -> Optional[str]:
     elif hours > 0:
         return f"{hours}h {minutes}m"
     else:
-        return f"{minutes}m" 
+        return f"{minutes}m"
+
+# Warning key -> (title, description, color); warnings without an entry get a plain reminder
+WARNING_MESSAGES = {
+    "first_24h": (
+        "⚠️ First Challenge - 24 Hours Remaining",
+        "You have 24 hours left to complete your first challenge!\n\n"
+        "Requirements:\n"
+        "1️⃣ Create an Instagram account following our course rules\n"
+        "2️⃣ Verify your account by opening a ticket\n"
+        "3️⃣ Introduce yourself in general chat\n\n"
+        "⚠️ If you don't complete these in time, you'll be moved to jail!",
+        discord.Color.yellow()
+    ),
+    "first_12h": (
+        "⚠️ First Challenge - 12 Hours Remaining",
+        "⚠️ URGENT: Only 12 hours left to complete your first challenge!\n\n"
+        "Requirements:\n"
+        "1️⃣ Create an Instagram account following our course rules\n"
+        "2️⃣ Verify your account by opening a ticket\n"
+        "3️⃣ Introduce yourself in general chat\n\n"
+        "⚠️ Time is running out! Contact an admin if you need help!",
+        discord.Color.orange()
+    ),
+    "second_7d": (
+        "⚠️ Second Challenge - 7 Days Remaining",
+        "You have 7 days left to complete your second challenge!\n\n"
+        "Requirements:\n"
+        "1️⃣ Get three posts approved\n"
+        "2️⃣ Send at least 10 messages in general chat\n"
+        "3️⃣ Spend at least 30 minutes in voice calls\n\n"
+        "💡 Use /timer to check your progress!",
+        discord.Color.yellow()
+    ),
+    "second_3d": (
+        "⚠️ Second Challenge - 3 Days Remaining",
+        "⚠️ Only 3 days left to complete your second challenge!\n\n"
+        "Requirements:\n"
+        "1️⃣ Get three posts approved\n"
+        "2️⃣ Send at least 10 messages in general chat\n"
+        "3️⃣ Spend at least 30 minutes in voice calls\n\n"
+        "⚠️ Make sure to complete everything in time!",
+        discord.Color.orange()
+    ),
+    "second_24h": (
+        "⚠️ Second Challenge - 24 Hours Remaining",
+        "⚠️ URGENT: Only 24 hours left to complete your second challenge!\n\n"
+        "Requirements:\n"
+        "1️⃣ Get three posts approved\n"
+        "2️⃣ Send at least 10 messages in general chat\n"
+        "3️⃣ Spend at least 30 minutes in voice calls\n\n"
+        "⚠️ Contact an admin immediately if you need help!",
+        discord.Color.red()
+    ),
+}
+
+# Phase name -> what has to be done in it, for the messages that start a phase
+PHASE_TASKS = {
+    "first": (
+        "1️⃣ Create an Instagram account following our course rules\n"
+        "2️⃣ Verify your account by opening a ticket\n"
+        "3️⃣ Introduce yourself in general chat\n"
+    ),
+    "second": (
+        "1️⃣ Get three posts approved\n"
+        "2️⃣ Send at least 10 messages in general chat\n"
+        "3️⃣ Spend at least 30 minutes in voice calls\n"
+    ),
+}
+
+def warning_embed(warning: phases.WarningWindow, end_time: datetime.datetime) -> discord.Embed:
+    if warning.key in WARNING_MESSAGES:
+        title, description, color = WARNING_MESSAGES[warning.key]
+    else:
+        title, description, color = "⚠️ TimeBomb Warning", f"You have {format_time_remaining(end_time)} remaining!", discord.Color.yellow()
+    return discord.Embed(title=title, description=description, color=color)
 
 async def check_and_send_warnings(bot, user_id: str, data: dict) -> None:
     """Check and send time-based warnings"""
-    current_time = datetime.datetime.utcnow()
+    current_time = clock.utcnow()
     warnings_sent = data.get("warnings_sent", {})
     guild = bot.get_guild(bot.CONFIG["guild_id"])
     member = guild.get_member(int(user_id))
@@ -73,156 +153,30 @@ async def check_and_send_warnings(bot, user_id: str, data: dict) -> None:
     if not member:
         return
 
-    # First TimeBomb warnings (3-day bomb)
-    if "first_bomb_end" in data and not data.get("first_bomb_failed", False):
-        end_time = datetime.datetime.fromisoformat(data["first_bomb_end"])
-        remaining = end_time - current_time
-        hours_left = remaining.total_seconds() / 3600
-
-        # 24 hour warning
-        if 23 <= hours_left <= 25 and "first_24h" not in warnings_sent:
-            embed = discord.Embed(
-                title="⚠️ First Challenge - 24 Hours Remaining",
-                description=(
-                    "You have 24 hours left to complete your first challenge!\n\n"
-                    "Requirements:\n"
-                    "1️⃣ Create an Instagram account following our course rules\n"
-                    "2️⃣ Verify your account by opening a ticket\n"
-                    "3️⃣ Introduce yourself in general chat\n\n"
-                    "⚠️ If you don't complete these in time, you'll be moved to jail!"
-                ),
-                color=discord.Color.yellow()
-            )
-            try:
-                await member.send(embed=embed)
-                warnings_sent["first_24h"] = current_time.isoformat()
-                logging.info(f"24h warning sent to {user_id} for phase 1")
-            except discord.Forbidden:
-                logging.warning(f"Could not send 24h warning to {user_id}")
-
-        # 12 hour warning
-        elif 11 <= hours_left <= 13 and "first_12h" not in warnings_sent:
-            embed = discord.Embed(
-                title="⚠️ First Challenge - 12 Hours Remaining",
-                description=(
-                    "⚠️ URGENT: Only 12 hours left to complete your first challenge!\n\n"
-                    "Requirements:\n"
-                    "1️⃣ Create an Instagram account following our course rules\n"
-                    "2️⃣ Verify your account by opening a ticket\n"
-                    "3️⃣ Introduce yourself in general chat\n\n"
-                    "⚠️ Time is running out! Contact an admin if you need help!"
-                ),
-                color=discord.Color.orange()
-            )
-            try:
-                await member.send(embed=embed)
-                warnings_sent["first_12h"] = current_time.isoformat()
-                logging.info(f"12h warning sent to {user_id} for phase 1")
-            except discord.Forbidden:
-                logging.warning(f"Could not send 12h warning to {user_id}")
-
-    # Second TimeBomb warnings (14-day bomb)
-    if data.get("second_bomb_active", False) and not data.get("second_bomb_failed", False):
-        end_time = datetime.datetime.fromisoformat(data["second_bomb_end"])
+    phase = phases.ENGINE.live(data)
+    if phase is not None:
+        end_time = phase.deadline(data)
         remaining = end_time - current_time
-        days_left = remaining.days
-
-        # 7 day warning
-        if 6.5 <= days_left <= 7.5 and "second_7d" not in warnings_sent:
-            embed = discord.Embed(
-                title="⚠️ Second Challenge - 7 Days Remaining",
-                description=(
-                    "You have 7 days left to complete your second challenge!\n\n"
-                    "Requirements:\n"
-                    "1️⃣ Get three posts approved\n"
-                    "2️⃣ Send at least 10 messages in general chat\n"
-                    "3️⃣ Spend at least 30 minutes in voice calls\n\n"
-                    "💡 Use /timer to check your progress!"
-                ),
-                color=discord.Color.yellow()
-            )
-            try:
-                await member.send(embed=embed)
-                warnings_sent["second_7d"] = current_time.isoformat()
-                logging.info(f"7d warning sent to {user_id} for phase 2")
-            except discord.Forbidden:
-                logging.warning(f"Could not send 7d warning to {user_id}")
-
-        # 3 day warning
-        elif 2.5 <= days_left <= 3.5 and "second_3d" not in warnings_sent:
-            embed = discord.Embed(
-                title="⚠️ Second Challenge - 3 Days Remaining",
-                description=(
-                    "⚠️ Only 3 days left to complete your second challenge!\n\n"
-                    "Requirements:\n"
-                    "1️⃣ Get three posts approved\n"
-                    "2️⃣ Send at least 10 messages in general chat\n"
-                    "3️⃣ Spend at least 30 minutes in voice calls\n\n"
-                    "⚠️ Make sure to complete everything in time!"
-                ),
-                color=discord.Color.orange()
-            )
-            try:
-                await member.send(embed=embed)
-                warnings_sent["second_3d"] = current_time.isoformat()
-                logging.info(f"3d warning sent to {user_id} for phase 2")
-            except discord.Forbidden:
-                logging.warning(f"Could not send 3d warning to {user_id}")
-
-        # 24 hour warning
-        elif 23 <= (remaining.total_seconds() / 3600) <= 25 and "second_24h" not in warnings_sent:
-            embed = discord.Embed(
-                title="⚠️ Second Challenge - 24 Hours Remaining",
-                description=(
-                    "⚠️ URGENT: Only 24 hours left to complete your second challenge!\n\n"
-                    "Requirements:\n"
-                    "1️⃣ Get three posts approved\n"
-                    "2️⃣ Send at least 10 messages in general chat\n"
-                    "3️⃣ Spend at least 30 minutes in voice calls\n\n"
-                    "⚠️ Contact an admin immediately if you need help!"
-                ),
-                color=discord.Color.red()
-            )
-            try:
-                await member.send(embed=embed)
-                warnings_sent["second_24h"] = current_time.isoformat()
-                logging.info(f"24h warning sent to {user_id} for phase 2")
-            except discord.Forbidden:
-                logging.warning(f"Could not send 24h warning to {user_id}")
+        # The first due warning that hasn't gone out yet
+        for warning in phase.warnings:
+            if warning.start <= remaining <= warning.end and warning.key not in warnings_sent:
+                await bot.dispatch_limiter.wait()
+                try:
+                    await member.send(embed=warning_embed(warning, end_time))
+                    warnings_sent[warning.key] = current_time.isoformat()
+                    logging.info("%s warning sent to %s for phase %s", warning.key, user_id, phase.number, extra={"user_id": user_id, "phase": phase.number, "event": "warning_sent"})
+                except discord.Forbidden:
+                    logging.warning("Could not send %s warning to %s", warning.key, user_id, extra={"user_id": user_id, "event": "dm_failed"})
+                break
 
     data["warnings_sent"] = warnings_sent
-    bot.save_user_data()
-
-async def complete_first_phase(bot, member: discord.Member) -> None:
-    """Handle completion of first phase"""
-    user_id = str(member.id)
-    if user_id not in bot.user_data:
-        return
+    bot.save_user_data([user_id])
 
-    # Add success role
-    success_role = member.guild.get_role(bot.CONFIG["roles"]["first_success"])
-    if success_role:
-        await member.add_roles(success_role)
-        await send_second_phase_message(member)
-
-    # Start second phase
-    end_time = datetime.datetime.utcnow() + datetime.timedelta(days=14)
-    bot.user_data[user_id].update({
-        "second_bomb_active": True,
-        "second_bomb_end": end_time.isoformat()
-    })
-    bot.save_user_data()
-
-    # Send success message and second phase instructions
+async def send_release_message(member: discord.Member) -> None:
+    """Send jail release message to user"""
     embed = discord.Embed(
-        title="🚀 Second Challenge Activated!",
-        description=(
-            "You now have 14 days to complete:\n\n"
-            "1️⃣ Get three posts approved\n"
-            "2️⃣ Send at least 10 messages in general chat\n"
-            "3️⃣ Spend at least 30 minutes in voice calls\n\n"
-            "Use /timer to check your progress!"
-        ),
+        title="🔓 Released from Jail",
+        description="You've been given another chance. Make sure to complete the requirements this time!",
         color=discord.Color.green()
     )
     
@@ -231,305 +185,279 @@ async def complete_first_phase(bot, member: discord.Member) -> None:
     except discord.Forbidden:
         pass
 
-    # Log the event
-    log_channel = bot.get_channel(bot.CONFIG["log_channel"])
-    if log_channel:
-        log_embed = discord.Embed(
-            title="First Phase Completed",
-            description=f"{member.mention} has completed the first TimeBomb phase",
-            color=discord.Color.green()
-        )
-        await log_channel.send(embed=log_embed)
-
-async def complete_second_phase(bot, member: discord.Member) -> None:
-    """Handle completion of second phase"""
-    user_id = str(member.id)
-    if user_id not in bot.user_data:
-        return
-
-    # Add final success role
-    success_role = member.guild.get_role(bot.CONFIG["roles"]["second_success"])
-    if success_role:
-        await member.add_roles(success_role)
-
-    # Send completion message
+async def send_extension_message(member: discord.Member, end_time: datetime.datetime) -> None:
+    """Tell a user an admin gave them more time"""
     embed = discord.Embed(
-        title="🎉 Congratulations!",
-        description="You've successfully completed all challenges! Welcome to the full community!",
-        color=discord.Color.gold()
+        title="⏰ TimeBomb Extended",
+        description=f"An admin gave you more time. You now have {format_time_remaining(end_time)} remaining.",
+        color=discord.Color.blue()
     )
-    
-    try:
-        await member.send(embed=embed)
-    except discord.Forbidden:
-        pass
 
-    # Log the event
-    log_channel = bot.get_channel(bot.CONFIG["log_channel"])
-    if log_channel:
-        log_embed = discord.Embed(
-            title="All Phases Completed",
-            description=f"{member.mention} has completed all TimeBomb phases",
-            color=discord.Color.gold()
-        )
-        await log_channel.send(embed=log_embed)
-
-    # Clean up user data
-    del bot.user_data[user_id]
-    bot.save_user_data() 
-
-async def send_jail_message(member: discord.Member, phase: int) -> None:
-    """Send jail notification to user"""
-    message = (
-        "⚠️ First Challenge Failed\n"
-        "You've been placed in jail for not completing the requirements in time. "
-        "Contact an admin to discuss your next steps."
-    ) if phase == 1 else (
-        "⚠️ Second Challenge Failed\n"
-        "You've been placed in jail for not completing the advanced requirements in time. "
-        "Contact an admin to discuss your next steps."
-    )
-    
-    embed = discord.Embed(
-        title="TimeBomb Failed",
-        description=message,
-        color=discord.Color.red()
-    )
-    
     try:
         await member.send(embed=embed)
     except discord.Forbidden:
         pass
 
-async def send_release_message(member: discord.Member) -> None:
-    """Send jail release message to user"""
-    embed = discord.Embed(
-        title="🔓 Released from Jail",
-        description="You've been given another chance. Make sure to complete the requirements this time!",
-        color=discord.Color.green()
-    )
-    
-    try:
-        await member.send(embed=embed)
-    except discord.Forbidden:
-        pass
+def restart_released_user(bot, user_id: str, phase: phases.Phase, current_time: datetime.datetime,
+                          duration: datetime.timedelta = None) -> None:
+    """Give a user let out of a phase's jail a fresh TimeBomb for that phase; the caller saves"""
+    if phase is phases.ENGINE.first:
+        bot.archive.forget(user_id)
+        bot.user_data[user_id] = phases.ENGINE.new_record(current_time, duration=duration)
+    else:
+        data = bot.revive_user(user_id)
+        if data is None:
+            data = bot.user_data[user_id] = phases.ENGINE.new_record(current_time, phase, duration)
+        phase.start(data, current_time, duration)
+        data[phase.failed_key] = False
 
-async def handle_jail_release(bot, member: discord.Member, phase: int) -> None:
+async def handle_jail_release(bot, member: discord.Member, phase: phases.Phase) -> None:
     """Handle releasing a user from jail"""
     # Remove jail role
-    jail_role = member.guild.get_role(
-        bot.CONFIG["roles"]["first_jail"] if phase == 1 else bot.CONFIG["roles"]["second_jail"]
-    )
+    jail_role = member.guild.get_role(bot.CONFIG["roles"][phase.jail_role])
     if jail_role and jail_role in member.roles:
-        await member.remove_roles(jail_role)
+        await bot.role_transitions.apply(member, remove=[jail_role], reason="Released from jail")
     
     # Reset timer
-    user_id = str(member.id)
-    current_time = datetime.datetime.utcnow()
-    
-    if phase == 1:
-        end_time = current_time + datetime.timedelta(days=3)
-        bot.user_data[user_id] = {
-            "join_date": current_time.isoformat(),
-            "first_bomb_end": end_time.isoformat(),
-            "warnings_sent": {},
-            "second_bomb_active": False
-        }
-    else:
-        end_time = current_time + datetime.timedelta(days=14)
-        bot.user_data[user_id].update({
-            "second_bomb_end": end_time.isoformat(),
-            "second_bomb_failed": False
-        })
-    
+    restart_released_user(bot, str(member.id), phase, clock.utcnow())
     bot.save_user_data()
     
     # Send release message
     await send_release_message(member)
     
     # Log the release
-    log_channel = bot.get_channel(bot.CONFIG["log_channel"])
+    log_channel = bot.log_channel
     if log_channel:
         log_embed = discord.Embed(
             title="User Released from Jail",
-            description=f"{member.mention} has been released from phase {phase} jail",
+            description=f"{member.mention} has been released from phase {phase.number} jail",
             color=discord.Color.green()
         )
         await log_channel.send(embed=log_embed) 
 
-async def send_second_phase_message(user: discord.Member) -> None:
-    """Send second phase activation message with exact specified format"""
+async def send_welcome_message(member: discord.Member, start_time: datetime.datetime) -> None:
+    """Send welcome message to new member"""
     embed = discord.Embed(
-        title="🚀 Second Challenge Activated!",
+        title="🎯 Welcome to Your First TimeBomb!",
         description=(
-            "You now have 14 days to complete:\n\n"
-            "1️⃣ Get three posts approved\n"
-            "2️⃣ Send at least 10 messages in general chat\n"
-            "3️⃣ Spend at least 30 minutes in voice calls\n\n"
-            "Use /timer to check your progress!"
+            "Welcome to our community! You're now on your first TimeBomb challenge.\n\n"
+            f"⏰ You have {phases.ENGINE.first.days} days to complete these requirements:\n\n"
+            f"{PHASE_TASKS.get(phases.ENGINE.first.name, '')}\n"
+            "💡 Use /timer to check your remaining time!\n\n"
+            f"⚠️ Important: Failing to complete these requirements within {phases.ENGINE.first.days} days "
+            "will result in being moved to jail until requirements are met."
         ),
         color=discord.Color.blue()
     )
+    embed.set_footer(text=f"Time started: {start_time.strftime('%Y-%m-%d %H:%M')} UTC")
     
     try:
-        await user.send(embed=embed)
-        logging.info(f"Second phase message sent to {user.id}")
+        await member.send(embed=embed)
+        logging.info("Welcome message sent to %s", member.id, extra={"user_id": member.id, "phase": 1, "event": "welcome_sent"})
     except discord.Forbidden:
-        logging.warning(f"Could not send second phase message to {user.id}")
+        logging.warning("Could not send welcome message to %s", member.id, extra={"user_id": member.id, "event": "dm_failed"})
 
-async def send_completion_message(user: discord.Member) -> None:
-    """Send final completion message with exact specified format"""
+async def handle_role_change(bot, member: discord.Member, role: discord.Role) -> None:
+    """Handle role changes and send appropriate messages"""
+    role_event = bot.snapshot.role_events.get(role.id)
+    if role_event is not None:
+        phase, event = role_event
+        logging.info("Role change detected for %s (ID: %s): %s (ID: %s)", member.name, member.id, role.name, role.id, extra={"user_id": member.id, "event": "role_change"})
+        await bot.snapshot.dispatch[(phase.number, event)](bot, member, role, phase)
+
+async def handle_phase_success(bot, member: discord.Member, role: discord.Role, phase: phases.Phase) -> None:
+    """Success role of a phase with another after it: start the next TimeBomb"""
+    log_channel = bot.log_channel
+    user_id = str(member.id)
+    following = phase.next
+    logging.info("Target role detected for %s, updating timers and sending message", member.name, extra={"user_id": member.id, "phase": phase.number, "event": "role_change"})
+    
+    # Update timers
+    current_time = clock.utcnow()
+    
+    data = bot.revive_user(user_id)
+    if data is not None:
+        # Remove this phase's timer and start the next one
+        phase.clear(data)
+        following.start(data, current_time)
+        data.setdefault("warnings_sent", {})
+        bot.save_user_data()
+        logging.info("Updated timers for %s: Started phase %s", member.name, following.number, extra={"user_id": member.id, "phase": following.number, "event": "phase_started"})
+    
+    # Send combined success/next phase message
     embed = discord.Embed(
-        title="🎉 Congratulations!",
-        description="You've successfully completed all challenges! Welcome to the full community!",
-        color=discord.Color.gold()
+        title=f"🎯 {phase.title} Challenge Complete & {following.title} Challenge Started!",
+        description=(
+            f"🎉 Congratulations! You've completed the {phase.title.lower()} challenge!\n\n"
+            f"🚀 Your {following.title.lower()} challenge has now begun:\n\n"
+            f"You have {following.days} days to complete:\n"
+            f"{PHASE_TASKS.get(following.name, '')}\n"
+            "💡 Use /timer to check your remaining time!\n\n"
+            f"⚠️ Important: Failing to complete these requirements within {following.days} days "
+            "will result in being moved to jail until requirements are met."
+        ),
+        color=discord.Color.green()
     )
+    try:
+        await member.send(embed=embed)
+        if log_channel:
+            await log_channel.send(f"✅ Successfully sent target role message to {member.mention}")
+    except discord.Forbidden:
+        if log_channel:
+            await log_channel.send(f"❌ Could not send target role message to {member.mention} - DMs closed")
+    except Exception as e:
+        if log_channel:
+            await log_channel.send(f"❌ Error sending target role message to {member.mention}: {str(e)}")
+
+async def handle_completion(bot, member: discord.Member, role: discord.Role, phase: phases.Phase) -> None:
+    """Success role of the last phase (Final Role): the user is done"""
+    log_channel = bot.log_channel
+    user_id = str(member.id)
+    logging.info("Final success role detected for %s, cleaning up timers", member.name, extra={"user_id": member.id, "phase": phase.number, "event": "role_change"})
+    
+    # Remove all timers and send congratulations
+    if user_id in bot.user_data:
+        bot.archive_users([user_id], "completed")  # Remove all timer data
+        bot.save_user_data()
+        logging.info("Removed all timers for %s", member.name, extra={"user_id": member.id, "phase": phase.number, "event": "phase_completed"})
     
+    # Send completion message
+    embed = discord.Embed(
+        title="🎉 Congratulations - All Challenges Complete!",
+        description=(
+            "You've successfully completed all challenges!\n"
+            "Welcome to the full community! 🌟\n\n"
+            "You are now a full member with access to all features."
+        ),
+        color=discord.Color.gold()
+    )
     try:
-        await user.send(embed=embed)
-        logging.info(f"Completion message sent to {user.id}")
+        await member.send(embed=embed)
+        if log_channel:
+            await log_channel.send(f"✅ Successfully sent completion message to {member.mention}")
     except discord.Forbidden:
-        logging.warning(f"Could not send completion message to {user.id}") 
+        if log_channel:
+            await log_channel.send(f"❌ Could not send completion message to {member.mention} - DMs closed")
+    except Exception as e:
+        if log_channel:
+            await log_channel.send(f"❌ Error sending completion message to {member.mention}: {str(e)}")
 
-async def send_welcome_message(member: discord.Member, start_time: datetime.datetime) -> None:
-    """Send welcome message to new member"""
+async def handle_jail_role(bot, member: discord.Member, role: discord.Role, phase: phases.Phase) -> None:
+    """Jail Messages"""
+    log_channel = bot.log_channel
     embed = discord.Embed(
-        title="🎯 Welcome to Your First TimeBomb!",
+        title=f"⚠️ {phase.title} Challenge Failed",
         description=(
-            "Welcome to our community! You're now on your first TimeBomb challenge.\n\n"
-            "⏰ You have 3 days to complete these requirements:\n\n"
-            "1️⃣ Create an Instagram account following our course rules\n"
-            "2️⃣ Verify your account by opening a ticket\n"
-            "3️⃣ Introduce yourself in general chat\n\n"
-            "💡 Use /timer to check your remaining time!\n\n"
-            "⚠️ Important: Failing to complete these requirements within 3 days "
-            "will result in being moved to jail until requirements are met."
+            f"You've been placed in jail for not completing the {phase.title.lower()} "
+            "phase requirements in time.\n\n"
+            "To get out of jail:\n"
+            "1️⃣ Contact an admin\n"
+            "2️⃣ Explain why you couldn't complete the tasks\n"
+            "3️⃣ Show that you're ready to complete them\n\n"
+            "An admin will review your case and may give you another chance."
         ),
-        color=discord.Color.blue()
+        color=discord.Color.red()
     )
-    embed.set_footer(text=f"Time started: {start_time.strftime('%Y-%m-%d %H:%M')} UTC")
-    
     try:
         await member.send(embed=embed)
-        logging.info(f"Welcome message sent to {member.id}")
+        if log_channel:
+            await log_channel.send(f"✅ Successfully sent jail message to {member.mention}")
     except discord.Forbidden:
-        logging.warning(f"Could not send welcome message to {member.id}")
+        if log_channel:
+            await log_channel.send(f"❌ Could not send jail message to {member.mention} - DMs closed")
+    except Exception as e:
+        if log_channel:
+            await log_channel.send(f"❌ Error sending jail message to {member.mention}: {str(e)}") 
 
-async def handle_role_change(member: discord.Member, role: discord.Role) -> None:
-    """Handle role changes and send appropriate messages"""
-    logging.info(f"Role change detected for {member.name} (ID: {member.id}): {role.name} (ID: {role.id})")
-    
-    # Get bot instance (fixed)
-    bot = member.guild.me._state._get_client()
-    
-    # Log channel for monitoring
-    log_channel = member.guild.get_channel(bot.CONFIG["log_channel"])
+def get_tracked_phase_data(bot, user_id: str) -> Optional[dict]:
+    """Return a user's data if their running TimeBomb is completed by activity requirements"""
+    data = bot.user_data.get(user_id)
+    if not data:
+        return None
+    phase = phases.ENGINE.live(data)
+    return data if phase is not None and phase.requirements else None
+
+def get_requirement_threshold(config: dict, counter: str) -> Optional[int]:
+    """Translate a second phase requirement from config into the counter's units"""
+    requirements = config.get("requirements", {})
+    if counter == "messages":
+        return requirements.get("messages", 10)
+    if counter == "voice_seconds":
+        return requirements.get("voice_minutes", 30) * 60
+    if counter == "approvals":
+        return requirements.get("approvals", 3)
+    return None
+
+def requirements_met(config: dict, activity: dict, counters: tuple = ("messages", "voice_seconds", "approvals")) -> bool:
+    """Check whether every counter a phase requires has reached its threshold"""
+    for counter in counters:
+        if activity.get(counter, 0) < get_requirement_threshold(config, counter):
+            return False
+    return True
+
+async def evaluate_requirements(bot, member: discord.Member) -> bool:
+    """Complete an activity phase for a single user once all its requirements are met"""
+    data = get_tracked_phase_data(bot, str(member.id))
+    if data is None:
+        return False
+    phase = phases.ENGINE.live(data)
+    if not requirements_met(bot.CONFIG, data.get("activity", {}), phase.requirements):
+        return False
+
+    success_role = member.guild.get_role(bot.CONFIG["roles"][phase.success_role])
+    if not success_role or success_role in member.roles:
+        return False
+
+    try:
+        # on_member_update sees the new role and runs handle_role_change,
+        # exactly as if an admin had handed it out
+        await bot.role_transitions.apply(member, add=[success_role], reason="TimeBomb requirements completed")
+        logging.info("Requirements met for %s, granted phase %s success role", member.id, phase.number, extra={"user_id": member.id, "phase": phase.number, "event": "requirements_met"})
+        return True
+    except discord.HTTPException as e:
+        logging.warning("Could not grant phase success role to %s: %s", member.id, e, extra={"user_id": member.id, "event": "role_edit_failed"})
+        return False
+
+def handle_member_leave(bot, member: discord.Member) -> bool:
+    """Replace a leaving member's record with a tombstone"""
     user_id = str(member.id)
-    
-    # First Success Role (Target Role)
-    if role.id == bot.CONFIG["roles"]["first_success"]:
-        logging.info(f"Target role detected for {member.name}, updating timers and sending message")
-        
-        # Update timers
-        current_time = datetime.datetime.utcnow()
-        end_time = current_time + datetime.timedelta(days=14)
-        
-        if user_id in bot.user_data:
-            # Remove first timer and start second timer
-            if "first_bomb_end" in bot.user_data[user_id]:
-                del bot.user_data[user_id]["first_bomb_end"]
-            if "first_bomb_failed" in bot.user_data[user_id]:
-                del bot.user_data[user_id]["first_bomb_failed"]
-                
-            bot.user_data[user_id].update({
-                "second_bomb_active": True,
-                "second_bomb_end": end_time.isoformat(),
-                "warnings_sent": bot.user_data[user_id].get("warnings_sent", {})
-            })
-            bot.save_user_data()
-            logging.info(f"Updated timers for {member.name}: Started second phase")
-        
-        # Send combined success/second phase message
-        embed = discord.Embed(
-            title="🎯 First Challenge Complete & Second Challenge Started!",
-            description=(
-                "🎉 Congratulations! You've completed the first challenge!\n\n"
-                "🚀 Your second challenge has now begun:\n\n"
-                "You have 14 days to complete:\n"
-                "1️⃣ Get three posts approved\n"
-                "2️⃣ Send at least 10 messages in general chat\n"
-                "3️⃣ Spend at least 30 minutes in voice calls\n\n"
-                "💡 Use /timer to check your remaining time!\n\n"
-                "⚠️ Important: Failing to complete these requirements within 14 days "
-                "will result in being moved to jail until requirements are met."
-            ),
-            color=discord.Color.green()
-        )
-        try:
-            await member.send(embed=embed)
-            if log_channel:
-                await log_channel.send(f"✅ Successfully sent target role message to {member.mention}")
-        except discord.Forbidden:
-            if log_channel:
-                await log_channel.send(f"❌ Could not send target role message to {member.mention} - DMs closed")
-        except Exception as e:
-            if log_channel:
-                await log_channel.send(f"❌ Error sending target role message to {member.mention}: {str(e)}")
-    
-    # Second Success Role (Final Role)
-    elif role.id == bot.CONFIG["roles"]["second_success"]:
-        logging.info(f"Final success role detected for {member.name}, cleaning up timers")
-        
-        # Remove all timers and send congratulations
-        if user_id in bot.user_data:
-            del bot.user_data[user_id]  # Remove all timer data
-            bot.save_user_data()
-            logging.info(f"Removed all timers for {member.name}")
-        
-        # Send completion message
-        embed = discord.Embed(
-            title="🎉 Congratulations - All Challenges Complete!",
-            description=(
-                "You've successfully completed all challenges!\n"
-                "Welcome to the full community! 🌟\n\n"
-                "You are now a full member with access to all features."
-            ),
-            color=discord.Color.gold()
-        )
-        try:
-            await member.send(embed=embed)
-            if log_channel:
-                await log_channel.send(f"✅ Successfully sent completion message to {member.mention}")
-        except discord.Forbidden:
-            if log_channel:
-                await log_channel.send(f"❌ Could not send completion message to {member.mention} - DMs closed")
-        except Exception as e:
-            if log_channel:
-                await log_channel.send(f"❌ Error sending completion message to {member.mention}: {str(e)}")
-    
-    # Jail Messages
-    elif role.id in [bot.CONFIG["roles"]["first_jail"], bot.CONFIG["roles"]["second_jail"]]:
-        is_first_jail = role.id == bot.CONFIG["roles"]["first_jail"]
-        embed = discord.Embed(
-            title=f"⚠️ {'First' if is_first_jail else 'Second'} Challenge Failed",
+    data = bot.revive_user(user_id)
+    if data is None:
+        return False
+
+    bot.tombstones.record(user_id, data)
+    bot.archive_users([user_id], "departed")
+    bot.save_user_data()
+    return True
+
+async def restore_returning_member(bot, member: discord.Member, tombstone: dict) -> None:
+    """Resume a returning member's TimeBomb instead of starting a new one"""
+    user_id = str(member.id)
+    phase = tombstone["phase"]
+    bot.user_data[user_id] = tombstones.restore_user_data(tombstone)
+    bot.save_user_data()
+    logging.info("Restored phase %s TimeBomb for returning member %s", phase, user_id, extra={"user_id": user_id, "phase": phase, "event": "member_rejoined"})
+
+    # Roles are lost on leave, so put a jailed member back in jail
+    if tombstone["jailed"]:
+        jail_role = member.guild.get_role(bot.CONFIG["roles"][phases.ENGINE.by_number[phase].jail_role])
+        if jail_role:
+            try:
+                await bot.role_transitions.apply(member, add=[jail_role], reason="Rejoined while jailed")
+            except discord.HTTPException as e:
+                logging.warning("Could not restore jail role for %s: %s", user_id, e, extra={"user_id": user_id, "event": "role_edit_failed"})
+
+    log_channel = bot.log_channel
+    if log_channel:
+        log_embed = discord.Embed(
+            title="Member Rejoined During TimeBomb",
             description=(
-                f"You've been placed in jail for not completing the {('first' if is_first_jail else 'second')} "
-                "phase requirements in time.\n\n"
-                "To get out of jail:\n"
-                "1️⃣ Contact an admin\n"
-                "2️⃣ Explain why you couldn't complete the tasks\n"
-                "3️⃣ Show that you're ready to complete them\n\n"
-                "An admin will review your case and may give you another chance."
+                f"{member.mention} rejoined and resumed their phase {phase} TimeBomb"
+                f"{' in jail' if tombstone['jailed'] else ''}"
             ),
-            color=discord.Color.red()
+            color=discord.Color.orange()
         )
-        try:
-            await member.send(embed=embed)
-            if log_channel:
-                await log_channel.send(f"✅ Successfully sent jail message to {member.mention}")
-        except discord.Forbidden:
-            if log_channel:
-                await log_channel.send(f"❌ Could not send jail message to {member.mention} - DMs closed")
-        except Exception as e:
-            if log_channel:
-                await log_channel.send(f"❌ Error sending jail message to {member.mention}: {str(e)}") 
\ No newline at end of file
+        if tombstone["deadline"]:
+            deadline = datetime.datetime.fromisoformat(tombstone["deadline"])
+            log_embed.add_field(name="End Time", value=deadline.strftime("%Y-%m-%d %H:%M UTC"))
+        await log_channel.send(embed=log_embed)